@@ -0,0 +1,308 @@
+"""End-to-end crawl benchmark against the local IMDb simulator (imdb_simulator.py).
+
+Starts the simulator in a child process and runs ImdbCrawler in this process with
+its real middlewares, extraction pool and IMDBDatabase pipeline. The frontier
+scheduler is wrapped to hand out exactly --pages requests (retries and redirects
+count), and the crawl ends once their responses are processed. It reports:
+
+- pages/sec: pages that produced an item over the crawl's elapsed time
+- p50/p99 page latency: from the start of a page's download to its first item
+  being scraped, over the first --pages such pages, so time spent queued for the
+  extraction pool counts
+- peak RSS: of this process, and of this process plus its extraction workers
+- DB size: bytes on disk of the pages database (with its WAL) per stored page
+
+Each run is appended to --results as one JSON line, together with the git commit
+and the scenario (site size, page budget, latency, workers). The run is compared
+with the last one of the same scenario, and any metric more than --tolerance
+worse is reported as a regression (exit status 1 with --fail-on-regression).
+
+Usage: python benchmarks/bench_crawl.py [--pages 1000] [--titles 2000] [--names 4000]
+                                        [--latency-ms 0] [--workers 2] [--results FILE]
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SCRAPY_SETTINGS_MODULE', 'imdbcrawler.settings')
+
+from scrapy.utils.project import get_project_settings
+from scrapy.utils.reactor import install_reactor
+
+# Installed before the crawler modules import twisted.internet.reactor
+install_reactor(get_project_settings().get('TWISTED_REACTOR'))
+
+from scrapy import signals
+from scrapy.crawler import CrawlerProcess
+from twisted.internet import task
+
+from imdbcrawler.frontier import FrontierScheduler
+from imdbcrawler.spiders.ImdbCrawler import ImdbCrawler
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULTS = os.path.join(BENCHMARK_DIR, 'results', 'bench_crawl.jsonl')
+# Metric name -> True if higher is better
+METRICS = {
+    'pages_per_sec': True,
+    'latency_p50_ms': False,
+    'latency_p99_ms': False,
+    'peak_rss_mb': False,
+    'peak_total_rss_mb': False,
+    'db_bytes_per_page': False,
+}
+
+
+class BudgetScheduler(FrontierScheduler):
+    """FrontierScheduler that hands out at most BENCH_PAGE_BUDGET requests and then lets the spider close."""
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        scheduler = super().from_crawler(crawler)
+        scheduler.budget = crawler.settings.getint('BENCH_PAGE_BUDGET')
+        return scheduler
+
+    def next_request(self):
+        if self.budget <= 0:
+            return None
+        request = super().next_request()
+        if request is not None:
+            self.budget -= 1
+        return request
+
+    def has_pending_requests(self):
+        return self.budget > 0 and super().has_pending_requests()
+
+    def spider_idle(self, spider):
+        if self.budget > 0:
+            super().spider_idle(spider)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def rss_mb(pid='self'):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def child_pids():
+    pids = set()
+    for tid in os.listdir('/proc/self/task'):
+        try:
+            with open(f'/proc/self/task/{tid}/children') as f:
+                pids.update(int(pid) for pid in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(('127.0.0.1', port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f'The simulator did not start listening on port {port}')
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_crawl(args, workdir, simulator_pid):
+    db_name = os.path.join(workdir, 'imdb_crawler.db')
+    overrides = {
+        'IMDB_DB_NAME': db_name,
+        'FRONTIER_DB': os.path.join(workdir, 'frontier.db'),
+        'METRICS_DIR': os.path.join(workdir, 'metrics'),
+        'IMDB_VECTOR_MODEL_DIR': os.path.join(workdir, 'vector_model'),
+        'HTTPCACHE_ENABLED': False,
+        'AUTOTHROTTLE_ENABLED': False,
+        'DOWNLOAD_DELAY': 0,
+        'RANDOMIZE_DOWNLOAD_DELAY': False,
+        'RATE_LIMIT_ENABLED': False,
+        'CONCURRENT_REQUESTS': args.concurrency,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': args.concurrency,
+        'CONCURRENT_REQUESTS_PER_IP': args.concurrency,
+        'EXTRACTION_WORKERS': args.workers,
+        'SCHEDULER': f'{__name__}.BudgetScheduler',
+        'BENCH_PAGE_BUDGET': args.pages,
+        'LOG_LEVEL': args.log_level,
+    }
+    settings = get_project_settings()
+    for name, value in overrides.items():
+        # Above the spider's custom_settings, like -s on the command line
+        settings.set(name, value, priority='cmdline')
+
+    process = CrawlerProcess(settings, install_root_handler=args.log_level != 'CRITICAL')
+    crawler = process.create_crawler(ImdbCrawler)
+    started = {}
+    latencies = []
+    peak = {'total': 0.0}
+
+    def response_received(response, request, spider):
+        started[response.url] = time.perf_counter() - request.meta.get('download_latency', 0.0)
+
+    def item_scraped(item, response, spider):
+        start = started.pop(response.url, None)
+        if start is not None:
+            latencies.append(time.perf_counter() - start)
+
+    def sample_rss():
+        total = rss_mb() + sum(rss_mb(pid) for pid in child_pids() if pid != simulator_pid)
+        peak['total'] = max(peak['total'], total)
+
+    crawler.signals.connect(response_received, signal=signals.response_received)
+    crawler.signals.connect(item_scraped, signal=signals.item_scraped)
+    sampler = task.LoopingCall(sample_rss)
+
+    def spider_opened(spider):
+        # Not returning the loop's deferred: the engine would wait for it before starting
+        sampler.start(0.5)
+
+    def spider_closed(spider):
+        if sampler.running:
+            sampler.stop()
+
+    crawler.signals.connect(spider_opened, signal=signals.spider_opened)
+    crawler.signals.connect(spider_closed, signal=signals.spider_closed)
+
+    process.crawl(crawler, start_url=f'http://127.0.0.1:{args.port}/', allowed_domain='127.0.0.1')
+    process.start()
+
+    stats = crawler.stats.get_stats()
+    items = stats.get('item_scraped_count', 0)
+    # Each page's first item ends its latency; entity items of the same page do not count
+    pages = len(latencies)
+    latencies = latencies[:args.pages]
+    elapsed = stats.get('elapsed_time_seconds') or 1e-9
+    db_bytes = sum(os.path.getsize(path) for path in (db_name, f'{db_name}-wal') if os.path.exists(path))
+    stored = stats.get('pages/inserted', 0)
+    return {
+        'pages': pages,
+        'items': items,
+        'stored_pages': stored,
+        'responses': stats.get('downloader/response_count', 0),
+        'elapsed_s': round(elapsed, 3),
+        'pages_per_sec': round(pages / elapsed, 2),
+        'latency_p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'peak_total_rss_mb': round(peak['total'], 1),
+        'db_bytes': db_bytes,
+        'db_bytes_per_page': round(db_bytes / max(1, stored)),
+        'spidertrap_dropped': sum(value for key, value in stats.items() if key.startswith('spidertrap/dropped/')),
+        'fastpath_hits': stats.get('fastpath/lookups', 0) - stats.get('fastpath/misses', 0),
+    }
+
+
+def load_previous(path, scenario):
+    previous = None
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('scenario') == scenario:
+                    previous = record
+    return previous
+
+
+def regressions(previous, results, tolerance):
+    found = []
+    for metric, higher_is_better in METRICS.items():
+        before, after = previous['results'].get(metric), results.get(metric)
+        if not before or after is None:
+            continue
+        change = (after - before) / before
+        if (-change if higher_is_better else change) > tolerance:
+            found.append((metric, before, after, change))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=1000, help='stop after this many requests')
+    parser.add_argument('--titles', type=int, default=2000)
+    parser.add_argument('--names', type=int, default=4000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='simulated server latency per request')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--workers', type=int, default=2, help='extraction processes')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--results', default=DEFAULT_RESULTS)
+    parser.add_argument('--tolerance', type=float, default=0.10, help='relative change counted as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    scenario = {
+        'pages': args.pages, 'titles': args.titles, 'names': args.names, 'seed': args.seed,
+        'latency_ms': args.latency_ms, 'workers': args.workers, 'concurrency': args.concurrency,
+    }
+    simulator = subprocess.Popen([
+        sys.executable, os.path.join(BENCHMARK_DIR, 'imdb_simulator.py'), '--port', str(args.port),
+        '--titles', str(args.titles), '--names', str(args.names), '--seed', str(args.seed),
+        '--latency-ms', str(args.latency_ms),
+    ], stdout=subprocess.DEVNULL)
+    workdir = tempfile.mkdtemp(prefix='bench_crawl_')
+    try:
+        wait_for_port(args.port)
+        results = run_crawl(args, workdir, simulator.pid)
+    finally:
+        simulator.terminate()
+        simulator.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for metric, value in results.items():
+        print(f"{metric:<20} {value}")
+    if not results['pages']:
+        print("The crawl scraped nothing; not recording this run.")
+        sys.exit(1)
+
+    previous = load_previous(args.results, scenario)
+    record = {'time': time.time(), 'commit': git_commit(), 'scenario': scenario, 'results': results}
+    os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+    with open(args.results, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record) + '\n')
+
+    if previous is None:
+        print(f"No previous run of this scenario in {args.results}; recorded as the baseline.")
+        return
+    found = regressions(previous, results, args.tolerance)
+    print(f"Compared with {previous.get('commit') or 'the previous run'}:")
+    for metric, before, after, change in found:
+        print(f"  REGRESSION {metric}: {before} -> {after} ({change:+.1%})")
+    if not found:
+        print(f"  no metric moved more than {args.tolerance:.0%} in the wrong direction")
+    elif args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Pages/sec of HTML extraction: inline html.parser (old save_page) vs the process pool.
+
+The corpus is every *.html file under --fixtures, or, if none are given, the response
+bodies the spider already saved in its Scrapy HTTP cache.
+
+Usage: python benchmarks/bench_extraction.py [--fixtures DIR] [--workers N] [--repeat 3]
+"""
+import argparse
+import asyncio
+import glob
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from imdbcrawler.extraction import ExtractionPool, extract_page
+
+HTTPCACHE_GLOB = os.path.join('.scrapy', 'httpcache', '*', '*', '*', 'response_body')
+
+
+def load_corpus(fixtures):
+    if fixtures:
+        paths = glob.glob(os.path.join(fixtures, '**', '*.html'), recursive=True)
+    else:
+        paths = glob.glob(HTTPCACHE_GLOB)
+    corpus = []
+    for path in sorted(paths):
+        with open(path, 'rb') as f:
+            corpus.append(f.read())
+    return corpus
+
+
+def bench_inline(corpus):
+    start = time.perf_counter()
+    for body in corpus:
+        extract_page(body, 'utf-8', 'html.parser')
+    return len(corpus) / (time.perf_counter() - start)
+
+
+async def _run_pool(pool, corpus):
+    await asyncio.gather(*(pool.extract(body, 'utf-8') for body in corpus))
+
+
+def bench_pool(corpus, workers, parser):
+    pool = ExtractionPool(max_workers=workers, parser=parser)
+    try:
+        # Warm the worker processes up so start-up cost is not counted
+        asyncio.run(_run_pool(pool, corpus[:workers]))
+        start = time.perf_counter()
+        asyncio.run(_run_pool(pool, corpus))
+        return len(corpus) / (time.perf_counter() - start)
+    finally:
+        pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fixtures', default=None)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.fixtures)
+    if not corpus:
+        print("No HTML fixtures found; pass --fixtures or run the crawler with HTTPCACHE_ENABLED first.")
+        sys.exit(1)
+    corpus = corpus * args.repeat
+    print(f"Corpus: {len(corpus)} pages")
+
+    print(f"before  inline html.parser:          {bench_inline(corpus):8.1f} pages/sec")
+    print(f"after   pool x{args.workers} html.parser:      {bench_pool(corpus, args.workers, 'html.parser'):8.1f} pages/sec")
+    print(f"after   pool x{args.workers} lxml:             {bench_pool(corpus, args.workers, 'lxml'):8.1f} pages/sec")
+
+
+if __name__ == '__main__':
+    main()
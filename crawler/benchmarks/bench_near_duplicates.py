@@ -0,0 +1,67 @@
+"""Per-page cost of IMDBDatabase.save_page as the pages table grows.
+
+Usage: python benchmarks/bench_near_duplicates.py [--sizes 1000,10000,100000] [--sample 200]
+"""
+import argparse
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from imdbcrawler.spiders.imdb_database import IMDBDatabase
+
+WORDS = [f"word{i}" for i in range(5000)]
+TEMPLATE = ' '.join(random.Random(0).choices(WORDS, k=300))
+
+
+def make_page(rng, n):
+    # IMDb pages share a lot of boilerplate, so half of every page is a fixed template
+    body = ' '.join(rng.choices(WORDS, k=300))
+    return f"Title {n} {TEMPLATE} {body}"
+
+
+def save(db, rng, n):
+    html = make_page(rng, n)
+    url = f"https://www.imdb.com/title/tt{n:07d}/"
+    db.save_page(
+        hashlib.md5(url.encode()).hexdigest(),
+        url,
+        '2024-01-01 00:00:00',
+        'text/html',
+        len(html),
+        f"Title {n}",
+        html,
+        hashlib.md5(html.encode()).hexdigest(),
+        '{}'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--sample', type=int, default=200)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        with IMDBDatabase(os.path.join(tmp, 'bench.db')) as db:
+            stored = 0
+            for size in sizes:
+                while stored < size:
+                    save(db, rng, stored)
+                    stored += 1
+                start = time.perf_counter()
+                for i in range(args.sample):
+                    save(db, rng, stored + i)
+                elapsed = time.perf_counter() - start
+                stored += args.sample
+                print(f"{size:>8} stored pages: {elapsed / args.sample * 1000:.2f} ms/page")
+
+
+if __name__ == '__main__':
+    main()
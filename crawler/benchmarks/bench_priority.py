@@ -0,0 +1,69 @@
+"""Requests/sec through PriorityMiddleware at different keyword list sizes.
+
+"cold" runs the automaton on every request (PRIORITY_CACHE_SIZE = 0); "cached" is
+the default middleware, whose LRU answers host/path scans seen before.
+
+Usage: python benchmarks/bench_priority.py [--sizes 10,1000,100000] [--requests 50000]
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+from scrapy.http import Request
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from imdbcrawler.middlewares import PriorityMiddleware
+
+PATHS = ['title/tt{:07d}/', 'name/nm{:07d}/', 'title/tt{:07d}/reviews?ref_=tt_urv', 'news/ni{:08d}/', 'chart/top/?page={}']
+
+
+def write_keywords(path, size, rng):
+    levels = {'high': [], 'middle': [], 'low': []}
+    for i in range(size):
+        keyword = ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10)))
+        levels[rng.choice(list(levels))].append(keyword)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(levels, f)
+
+
+def bench(middleware, urls):
+    start = time.perf_counter()
+    for url in urls:
+        middleware.prioritize(Request(url))
+    return len(urls) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10,1000,100000')
+    parser.add_argument('--requests', type=int, default=50000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    urls = [
+        'https://www.imdb.com/' + rng.choice(PATHS).format(rng.randint(1, 20000))
+        for _ in range(args.requests)
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'keywords.json')
+        for size in (int(size) for size in args.sizes.split(',')):
+            write_keywords(path, size, rng)
+            start = time.perf_counter()
+            cached = PriorityMiddleware(path)
+            build = time.perf_counter() - start
+            cold = PriorityMiddleware(path, cache_size=0)
+            print(
+                f"{size:>7} keywords: build {build * 1000:8.1f} ms, "
+                f"cold {bench(cold, urls):10.0f} req/s, "
+                f"cached {bench(cached, urls):10.0f} req/s"
+            )
+
+
+if __name__ == '__main__':
+    main()
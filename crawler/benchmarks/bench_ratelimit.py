@@ -0,0 +1,114 @@
+"""Useful throughput of N workers against a throttling site: per-process delay versus the shared bucket.
+
+Serves the IMDb simulator with --max-rps, beyond which it answers 503 with
+Retry-After, and runs --workers ``run_crawler.py`` processes against it for
+--seconds in two configurations:
+
+- delay: the previous politeness settings, DOWNLOAD_DELAY = 1 / --max-rps in every
+  worker and 404 among the retried codes
+- bucket: RateLimitMiddleware with RATE_LIMIT_RPS = --max-rps and one RATE_LIMIT_DB
+  for the fleet
+
+Each worker has its own frontier and pages database, so the workers do not share
+work, only the site's budget. Reports the requests the site served and throttled
+and the pages stored per second over the --seconds window.
+
+Usage: python benchmarks/bench_ratelimit.py [--workers 3] [--max-rps 4] [--seconds 40] [--port 8970]
+"""
+import argparse
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+CRAWLER_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.append(BENCHMARKS_DIR)
+
+from imdb_simulator import serve
+
+CONFIGURATIONS = {
+    'delay': lambda rps, workdir: [
+        f"DOWNLOAD_DELAY={1 / rps}",
+        "RATE_LIMIT_ENABLED=False",
+        "RETRY_HTTP_CODES=500,503,504,400,403,404,408",
+    ],
+    'bucket': lambda rps, workdir: [
+        f"RATE_LIMIT_RPS={rps}",
+        f"RATE_LIMIT_DB={os.path.join(workdir, 'rate_limit.db')}",
+    ],
+}
+
+
+def worker_command(worker_id, port, workdir, settings):
+    return [
+        sys.executable, "run_crawler.py", f"http://127.0.0.1:{port}/", "127.0.0.1",
+        f"FRONTIER_DB={os.path.join(workdir, f'frontier-{worker_id}.db')}",
+        f"IMDB_DB_NAME={os.path.join(workdir, f'pages-{worker_id}.db')}",
+        f"METRICS_DIR={os.path.join(workdir, 'metrics')}",
+        "FRONTIER_WORKER_ID=0",
+        "AUTOTHROTTLE_ENABLED=False",
+        "HTTPCACHE_ENABLED=False",
+        "EXTRACTION_WORKERS=0",
+        "IMDB_VECTOR_MODEL_DIR=",
+        # Pages reach the database within a second, so they can be counted mid-crawl
+        "IMDB_DB_FLUSH_INTERVAL=1",
+        "LOG_LEVEL=CRITICAL",
+        *settings,
+    ]
+
+
+def stored_pages(db_name):
+    try:
+        with sqlite3.connect(f'file:{db_name}?mode=ro', uri=True) as conn:
+            return conn.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+    except sqlite3.Error:
+        return 0
+
+
+def run(name, args, port):
+    server = serve(port, titles=5000, names=10000, max_rps=args.max_rps)
+    throttle = server.RequestHandlerClass.throttle
+    with tempfile.TemporaryDirectory() as workdir:
+        settings = CONFIGURATIONS[name](args.max_rps, workdir)
+        start = time.monotonic()
+        processes = [
+            subprocess.Popen(worker_command(worker_id, port, workdir, settings), cwd=CRAWLER_DIR)
+            for worker_id in range(args.workers)
+        ]
+        time.sleep(args.seconds)
+        elapsed = time.monotonic() - start
+        counts = dict(throttle.counts)
+        pages = sum(stored_pages(os.path.join(workdir, f'pages-{worker_id}.db')) for worker_id in range(args.workers))
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+    server.shutdown()
+    server.server_close()
+    requests = counts['served'] + counts['throttled']
+    print(f"{name:<8} requests/s={requests / elapsed:5.2f} served={counts['served']:<5} "
+          f"throttled={counts['throttled']:<5} ({counts['throttled'] / max(1, requests):.0%}) "
+          f"pages/s={pages / elapsed:5.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--max-rps', type=float, default=4.0, help="the site's rate, and the fleet's budget")
+    parser.add_argument('--seconds', type=float, default=40.0)
+    parser.add_argument('--port', type=int, default=8970)
+    args = parser.parse_args()
+
+    for offset, name in enumerate(CONFIGURATIONS):
+        run(name, args, args.port + offset)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Pages/sec of the offline re-processing job (imdbcrawler.reprocess) over a Scrapy HTTP cache.
+
+Writes --pages responses from the IMDb simulator's site (titles, their near-duplicate
+full-credits pages and names, gzip-encoded like IMDb serves them) into a
+FilesystemCacheStorage-layout cache, then rebuilds a pages database from it with
+each --workers count, and projects the time for a million pages. The last line
+compares that with crawling the same million pages at the default RATE_LIMIT_RPS.
+
+Usage: python benchmarks/bench_reprocess.py [--pages 2000] [--workers 0,1,2,4] [--chunk-size 500]
+"""
+import argparse
+import gzip
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BENCHMARKS_DIR))
+sys.path.append(BENCHMARKS_DIR)
+
+from imdb_simulator import Site
+from imdbcrawler import settings
+from imdbcrawler.reprocess import Reprocessor, cache_entry_path
+
+HOST = 'http://127.0.0.1:8900'
+
+
+def site_pages(site, count):
+    """(url, body) of ``count`` pages: every third a name, the rest titles and their full credits."""
+    for n in range(count):
+        title_id = n // 3
+        if n % 3 == 0:
+            yield f'{HOST}/title/tt{title_id:07d}/', site.title_page(title_id)
+        elif n % 3 == 1:
+            yield f'{HOST}/title/tt{title_id:07d}/fullcredits', site.title_page(title_id, full_credits=True)
+        else:
+            yield f'{HOST}/name/nm{title_id:07d}/', site.name_page(title_id)
+
+
+def write_cache(cache_dir, pages):
+    for n, (url, body) in enumerate(pages):
+        path = cache_entry_path(cache_dir, hashlib.sha1(url.encode()).hexdigest())
+        os.makedirs(path)
+        metadata = {'url': url, 'method': 'GET', 'status': 200, 'response_url': url, 'timestamp': 1704067200 + n}
+        with open(os.path.join(path, 'pickled_meta'), 'wb') as f:
+            pickle.dump(metadata, f, protocol=4)
+        with open(os.path.join(path, 'response_headers'), 'wb') as f:
+            f.write(b'Content-Type: text/html; charset=utf-8\r\nContent-Encoding: gzip\r\n')
+        with open(os.path.join(path, 'response_body'), 'wb') as f:
+            f.write(gzip.compress(body))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--workers', default=f'0,1,{os.cpu_count()}')
+    parser.add_argument('--chunk-size', type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_dir = os.path.join(tmp, 'httpcache', 'imdb_crawler')
+        write_cache(cache_dir, site_pages(Site(titles=args.pages, names=args.pages), args.pages))
+        print(f"{'workers':>8} {'pages/s':>8} {'stored':>7} {'1M pages':>9}")
+        for workers in (int(n) for n in args.workers.split(',')):
+            out = os.path.join(tmp, f'reprocessed-{workers}.db')
+            reprocessor = Reprocessor(out, workers=workers, chunk_size=args.chunk_size)
+            start = time.perf_counter()
+            counters = reprocessor.from_cache(cache_dir)
+            rate = counters['read'] / (time.perf_counter() - start)
+            print(f"{workers:>8} {rate:>8.0f} {counters['stored']:>7} {1e6 / rate / 60:>7.0f}min")
+    rate = settings.RATE_LIMIT_RPS
+    print(f"Crawling 1M pages at RATE_LIMIT_RPS={rate}: {1e6 / rate / 86400:.0f} days")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Write throughput of N pipeline processes on one shared database versus per-worker shards.
+
+Every process saves --pages synthetic pages in IMDB_DB_BATCH_SIZE-sized batches, as
+ImdbcrawlerPipeline does, either all into one imdb_crawler.db or each into its own
+shard; the sharded run also reports how long ShardMerger takes to fold the shards
+into the canonical database afterwards.
+
+Usage: python benchmarks/bench_shards.py [--workers 1,2,4,8] [--pages 2000] [--batch 100]
+"""
+import argparse
+import hashlib
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from imdbcrawler.shards import ShardMerger, shard_path
+from imdbcrawler.spiders.imdb_database import IMDBDatabase
+
+WORDS = [f"word{i}" for i in range(5000)]
+TEMPLATE = ' '.join(random.Random(0).choices(WORDS, k=300))
+
+
+def make_row(rng, worker_id, n):
+    url = f"https://www.imdb.com/title/tt{worker_id:02d}{n:07d}/"
+    html = f"Title {worker_id}-{n} {TEMPLATE} {' '.join(rng.choices(WORDS, k=300))}"
+    return (hashlib.md5(url.encode()).hexdigest(), url, '2024-01-01 00:00:00', 'text/html', len(html), f"Title {n}",
+            html, hashlib.md5(html.encode()).hexdigest(), '{}', None, None, None)
+
+
+def write_pages(db_name, worker_id, pages, batch):
+    rng = random.Random(worker_id)
+    rows = [make_row(rng, worker_id, n) for n in range(pages)]
+    with IMDBDatabase(db_name) as db:
+        for start in range(0, pages, batch):
+            db.save_pages(rows[start:start + batch])
+
+
+def run(tmp, workers, pages, batch, sharded):
+    db_name = os.path.join(tmp, f"{'sharded' if sharded else 'shared'}-{workers}.db")
+    shard_dir = os.path.join(tmp, f"shards-{workers}")
+    targets = [shard_path(shard_dir, worker_id) if sharded else db_name for worker_id in range(workers)]
+    # The schema is created up front, as init_db.py does before main.py starts the workers
+    for target in set(targets):
+        IMDBDatabase(target).open().close()
+
+    processes = [
+        multiprocessing.Process(target=write_pages, args=(target, worker_id, pages, batch))
+        for worker_id, target in enumerate(targets)
+    ]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+    merge_seconds = None
+    if sharded:
+        start = time.perf_counter()
+        ShardMerger(db_name, shard_dir).merge()
+        merge_seconds = time.perf_counter() - start
+    return workers * pages / elapsed, merge_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', default='1,2,4,8')
+    parser.add_argument('--pages', type=int, default=2000, help="pages written by each worker")
+    parser.add_argument('--batch', type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'shared pages/s':>15} {'sharded pages/s':>16} {'speedup':>8} {'merge s':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in (int(n) for n in args.workers.split(',')):
+            shared, _ = run(tmp, workers, args.pages, args.batch, sharded=False)
+            sharded, merge_seconds = run(tmp, workers, args.pages, args.batch, sharded=True)
+            print(f"{workers:>8} {shared:>15.0f} {sharded:>16.0f} {sharded / shared:>7.2f}x {merge_seconds:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Worker cold start: ``python run_crawler.py`` subprocesses versus forks of a preloaded forkserver.
+
+Starts --workers workers the way main.py does, each pointed at its own local
+one-page site, and reports per worker the time from launch to its first request
+(robots.txt) and its RSS and PSS (RSS with shared pages divided among their
+sharers) once it is running. The forkserver's own one-off preload is reported
+separately, since main.py pays it once per run rather than per worker.
+
+Usage: python benchmarks/bench_startup.py [--workers 4] [--port 8950]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CRAWLER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(CRAWLER_DIR)
+
+from imdbcrawler.launcher import WorkerLauncher
+
+PAGE = b'<html><head><title>Start</title></head><body><p>Nothing to follow.</p></body></html>'
+
+
+class FirstRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.first_request.setdefault('time', time.perf_counter())
+        if self.path != '/robots.txt':
+            # Keeps the worker running while its memory is sampled
+            time.sleep(3)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(PAGE)))
+        self.end_headers()
+        self.wfile.write(PAGE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_site(port):
+    server = ThreadingHTTPServer(('127.0.0.1', port), FirstRequestHandler)
+    server.first_request = {}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def memory_mb(pid):
+    """(RSS, PSS) of a process in MB."""
+    values = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                name, _, rest = line.partition(':')
+                if name in ('Rss', 'Pss'):
+                    values[name] = int(rest.split()[0]) / 1024
+    except OSError:
+        pass
+    return values.get('Rss', 0.0), values.get('Pss', 0.0)
+
+
+def worker_command(worker_id, port, workdir):
+    return [
+        sys.executable, "run_crawler.py", f"http://127.0.0.1:{port}/", "127.0.0.1",
+        f"FRONTIER_DB={os.path.join(workdir, f'frontier-{worker_id}.db')}",
+        f"IMDB_DB_NAME={os.path.join(workdir, f'pages-{worker_id}.db')}",
+        f"METRICS_DIR={os.path.join(workdir, 'metrics')}",
+        # Each worker owns every partition of its own frontier
+        "FRONTIER_WORKER_ID=0",
+        "IMDB_VECTOR_MODEL_DIR=",
+        "EXTRACTION_WORKERS=0",
+        "HTTPCACHE_ENABLED=False",
+        "LOG_LEVEL=ERROR",
+    ]
+
+
+def measure(launch, workers, base_port, timeout=60):
+    sites = [start_site(base_port + worker_id) for worker_id in range(workers)]
+    with tempfile.TemporaryDirectory() as workdir:
+        processes = []
+        started = []
+        for worker_id in range(workers):
+            started.append(time.perf_counter())
+            processes.append(launch(worker_command(worker_id, base_port + worker_id, workdir)))
+        deadline = time.monotonic() + timeout
+        while any('time' not in site.first_request for site in sites) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Let the workers settle after their first response before sampling memory
+        time.sleep(1.0)
+        memory = [memory_mb(process.pid) for process in processes]
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+    for site in sites:
+        site.shutdown()
+        site.server_close()
+    first_request = [site.first_request['time'] - start for site, start in zip(sites, started) if 'time' in site.first_request]
+    return first_request, memory
+
+
+def report(name, first_request, memory):
+    rss = [value[0] for value in memory]
+    pss = [value[1] for value in memory]
+    print(f"{name:<12} first request mean={statistics.mean(first_request):.2f}s max={max(first_request):.2f}s "
+          f"RSS mean={statistics.mean(rss):.0f}MB PSS mean={statistics.mean(pss):.0f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8950, help="first of --workers consecutive ports")
+    args = parser.parse_args()
+    os.chdir(CRAWLER_DIR)
+
+    report('subprocess', *measure(subprocess.Popen, args.workers, args.port))
+
+    launcher = WorkerLauncher()
+    start = time.perf_counter()
+    # An empty worker starts the forkserver and waits for its preload
+    warmup = launcher.context.Process(target=int)
+    warmup.start()
+    warmup.join()
+    print(f"forkserver preload: {time.perf_counter() - start:.2f}s (once per run)")
+    report('forkserver', *measure(launcher.launch, args.workers, args.port))
+
+
+if __name__ == '__main__':
+    main()
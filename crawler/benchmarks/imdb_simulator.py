@@ -0,0 +1,305 @@
+"""A local, deterministic IMDb-shaped site for offline crawler benchmarks.
+
+Titles link to their cast, to similar titles and to charts; names link back to the
+titles they are known for. Every link carries an IMDb-style ``ref_`` parameter and
+every page shares the same navigation and footer template. The site also has:
+
+- exact duplicates: /title/ttN/print serves the title page's body byte for byte
+- near-duplicates: /title/ttN/fullcredits repeats the title page with a longer cast
+- redirect loops: /r/loopN/K redirects to /r/loopN/K+1 modulo 3
+- traps: an endless /calendar/?date= chain and ever deeper /browse/... paths
+- dead links: a fraction of name links point at names that do not exist (404)
+
+Title and name pages embed schema.org JSON-LD like IMDb's. Pages carry an ETag and
+Last-Modified and answer conditional GETs with 304, and robots.txt points at a
+sitemap listing every title. With --max-rps, requests beyond that rate get a 503
+with Retry-After, like IMDb's throttling. Page content depends only on --seed, so runs with the
+same arguments see the same site.
+
+Usage: python benchmarks/imdb_simulator.py [--port 8900] [--titles 2000] [--names 4000]
+                                           [--latency-ms 0] [--max-rps 0] [--seed 42]
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import random
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+WORDS = (
+    'the a of and in to his her their with as an by for from on at story life war love city night family '
+    'world man woman young old secret last first new dark journey home return king queen detective murder '
+    'mystery friends brother sister father mother space time dream island house road river mountain killer'
+).split()
+GENRES = ('Drama', 'Comedy', 'Action', 'Thriller', 'Horror', 'Romance', 'Documentary', 'Animation', 'Crime', 'Sci-Fi')
+LAST_MODIFIED = formatdate(datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc).timestamp(), usegmt=True)
+CHARTS = ('top', 'moviemeter', 'boxoffice', 'toptv')
+
+NAV = '''<nav id="imdbHeader"><a href="/?ref_=nv_home">IMDb</a> <a href="/chart/top/?ref_=nv_mv_250">Top 250 Movies</a>
+<a href="/chart/moviemeter/?ref_=nv_mv_mpm">Most Popular Movies</a> <a href="/chart/boxoffice/?ref_=nv_ch_cht">Box Office</a>
+<a href="/chart/toptv/?ref_=nv_tvv_250">Top 250 TV Shows</a> <a href="/calendar/?date=2024-01-01&amp;ref_=nv_mv_cal">Release Calendar</a>
+<a href="/browse/genre/?ref_=nv_brw">Browse</a></nav>'''
+FOOTER = '''<footer><a href="/help/?ref_=ft_hlp">Help</a> <a href="/conditions?ref_=ft_cou">Conditions of Use</a>
+<a href="/privacy?ref_=ft_pvc">Privacy Policy</a> <span>&copy; 1990-2024 by IMDb.com, Inc.</span>
+<script>window.IMDbTracking = {"page": "generated", "sampling": 0.1};</script></footer>'''
+
+
+class Site:
+    def __init__(self, titles=2000, names=4000, seed=42, dead_link_share=0.02):
+        self.titles = titles
+        self.names = names
+        self.seed = seed
+        self.dead_link_share = dead_link_share
+
+    def rng(self, *key):
+        return random.Random(f'{self.seed}:' + ':'.join(map(str, key)))
+
+    def sentence(self, rng, words):
+        return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+    def title_name(self, title_id):
+        rng = self.rng('title-name', title_id)
+        return ' '.join(rng.choice(WORDS).capitalize() for _ in range(rng.randint(1, 4)))
+
+    def person_name(self, name_id):
+        rng = self.rng('person-name', name_id)
+        return f"{rng.choice(WORDS).capitalize()} {rng.choice(WORDS).capitalize()}son"
+
+    def cast(self, title_id, size):
+        rng = self.rng('cast', title_id)
+        cast = []
+        for _ in range(size):
+            if rng.random() < self.dead_link_share:
+                cast.append(self.names + rng.randint(1, 10 ** 6))
+            else:
+                cast.append(rng.randrange(self.names))
+        return cast
+
+    def page(self, title, body, json_ld=None):
+        script = ''
+        if json_ld is not None:
+            script = f'<script type="application/ld+json">{json.dumps(json_ld)}</script>'
+        return (f'<!DOCTYPE html><html lang="en"><head><meta charset="utf-8"><title>{title}</title>'
+                f'<link rel="canonical" href="/"><style>body{{font-family:Arial}}</style>{script}</head>'
+                f'<body>{NAV}<main>{body}</main>{FOOTER}</body></html>').encode('utf-8')
+
+    def title_page(self, title_id, full_credits=False):
+        rng = self.rng('title', title_id)
+        name = self.title_name(title_id)
+        year = 1920 + title_id % 105
+        cast = self.cast(title_id, 40 if full_credits else 12)
+        similar = [rng.randrange(self.titles) for _ in range(6)]
+        plot = ' '.join(self.sentence(rng, rng.randint(8, 20)) for _ in range(rng.randint(3, 8)))
+        cast_html = ''.join(
+            f'<li><a href="/name/nm{name_id:07d}/?ref_=tt_cl_t_{i}">{self.person_name(name_id)}</a></li>'
+            for i, name_id in enumerate(cast)
+        )
+        similar_html = ''.join(
+            f'<a href="/title/tt{other:07d}/?ref_=tt_sims_tt_i_{i}">{self.title_name(other)}</a> '
+            for i, other in enumerate(similar)
+        )
+        genres = rng.sample(GENRES, rng.randint(1, 3))
+        rating = round(rng.uniform(1, 10), 1)
+        body = (
+            f'<h1>{name}</h1><span class="year">{year}</span> <span class="genre">{", ".join(genres)}</span>'
+            f'<span class="rating">{rating:.1f}/10</span><p class="plot">{plot}</p>'
+            f'<h2>{"Full Cast &amp; Crew" if full_credits else "Top Cast"}</h2><ul>{cast_html}</ul>'
+            f'<a href="/title/tt{title_id:07d}/fullcredits?ref_=tt_cl_sm">See full cast</a> '
+            f'<a href="/title/tt{title_id:07d}/print?ref_=tt_pr">Print</a>'
+            f'<h2>More like this</h2>{similar_html}'
+            f'<a href="/r/loop{title_id % 50}/0?ref_=tt_ext">Official site</a>'
+        )
+        # Like IMDb's, only the top of the cast is in the JSON-LD
+        json_ld = {
+            '@context': 'https://schema.org', '@type': 'Movie', 'url': f'/title/tt{title_id:07d}/', 'name': name,
+            'genre': genres, 'datePublished': f'{year}-{1 + title_id % 12:02d}-01',
+            'aggregateRating': {'@type': 'AggregateRating', 'ratingValue': rating, 'ratingCount': rng.randint(5, 500000)},
+            'actor': [{'@type': 'Person', 'url': f'/name/nm{name_id:07d}/', 'name': self.person_name(name_id)} for name_id in cast[:3]],
+            'director': [{'@type': 'Person', 'url': f'/name/nm{cast[-1]:07d}/', 'name': self.person_name(cast[-1])}],
+        }
+        return self.page(f'{name} ({year}) - IMDb', body, json_ld)
+
+    def name_page(self, name_id):
+        rng = self.rng('name', name_id)
+        known_for = [rng.randrange(self.titles) for _ in range(rng.randint(2, 8))]
+        bio = ' '.join(self.sentence(rng, rng.randint(8, 18)) for _ in range(rng.randint(2, 6)))
+        known_html = ''.join(
+            f'<a href="/title/tt{title_id:07d}/?ref_=nm_knf_t_{i}">{self.title_name(title_id)}</a> '
+            for i, title_id in enumerate(known_for)
+        )
+        name = self.person_name(name_id)
+        json_ld = {
+            '@context': 'https://schema.org', '@type': 'Person', 'url': f'/name/nm{name_id:07d}/', 'name': name,
+            'birthDate': f'{1900 + name_id % 100}-{1 + name_id % 12:02d}-{1 + name_id % 28:02d}',
+        }
+        return self.page(f'{name} - IMDb', f'<h1>{name}</h1><p class="bio">{bio}</p><h2>Known for</h2>{known_html}', json_ld)
+
+    def chart_page(self, chart, page_number):
+        rng = self.rng('chart', chart)
+        per_page = 50
+        ranked = rng.sample(range(self.titles), min(self.titles, 250))
+        rows = ''.join(
+            f'<tr><td>{page_number * per_page + i + 1}</td><td><a href="/title/tt{title_id:07d}/?ref_=chttp_t_{i}">'
+            f'{self.title_name(title_id)}</a></td></tr>'
+            for i, title_id in enumerate(ranked[page_number * per_page:(page_number + 1) * per_page])
+        )
+        pages = ''.join(f'<a href="/chart/{chart}/?page={p}&amp;ref_=cht_pg">{p + 1}</a> ' for p in range(len(ranked) // per_page))
+        return self.page(f'IMDb {chart} chart', f'<h1>{chart}</h1><table>{rows}</table>{pages}')
+
+    def calendar_page(self, date):
+        # An endless chain of near-identical pages, one per day
+        try:
+            day = datetime.date.fromisoformat(date)
+        except ValueError:
+            day = datetime.date(2024, 1, 1)
+        following = day + datetime.timedelta(days=1)
+        rng = self.rng('calendar', day.toordinal() % 7)
+        releases = ''.join(
+            f'<li><a href="/title/tt{rng.randrange(self.titles):07d}/?ref_=rlm">release</a></li>' for _ in range(3)
+        )
+        return self.page(f'Release calendar {day}', f'<h1>Releases on {day}</h1><ul>{releases}</ul>'
+                                                    f'<a href="/calendar/?date={following}&amp;ref_=rlm_nxt">Next day</a>')
+
+    def browse_page(self, path):
+        # Every page links one level deeper: a path-depth trap
+        depth = path.count('/')
+        links = ''.join(f'<a href="{path.rstrip("/")}/{genre.lower()}/">{genre}</a> ' for genre in GENRES[:3])
+        return self.page(f'Browse ({depth})', f'<h1>Browse</h1>{links}')
+
+    def home_page(self):
+        rng = self.rng('home')
+        featured = ''.join(f'<a href="/title/tt{rng.randrange(self.titles):07d}/?ref_=hm_fanfav">pick</a> ' for _ in range(20))
+        return self.page('IMDb: Ratings, Reviews, and Where to Watch the Best Movies &amp; TV Shows', f'<h1>Featured</h1>{featured}')
+
+    def robots(self, host):
+        return f'User-agent: *\nDisallow: /help/\nDisallow: /conditions\nDisallow: /privacy\nSitemap: http://{host}/sitemap.xml\n'.encode()
+
+    def sitemap(self, host):
+        urls = ''.join(f'<url><loc>http://{host}/title/tt{title_id:07d}/</loc></url>' for title_id in range(self.titles))
+        return f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>'.encode()
+
+    def resolve(self, path, query, host):
+        """(status, headers, body) for a request path."""
+        parts = [part for part in path.split('/') if part]
+        if path == '/robots.txt':
+            return 200, {'Content-Type': 'text/plain'}, self.robots(host)
+        if path == '/sitemap.xml':
+            return 200, {'Content-Type': 'application/xml'}, self.sitemap(host)
+        if path == '/':
+            return 200, {}, self.home_page()
+        if len(parts) >= 2 and parts[0] == 'title' and parts[1].startswith('tt') and parts[1][2:].isdigit():
+            title_id = int(parts[1][2:])
+            if title_id >= self.titles:
+                return 404, {}, self.page('404 Error - IMDb', '<h1>Page not found</h1>')
+            if len(parts) == 2 or parts[2] == 'print':
+                return 200, {}, self.title_page(title_id)
+            if parts[2] == 'fullcredits':
+                return 200, {}, self.title_page(title_id, full_credits=True)
+        if len(parts) == 2 and parts[0] == 'name' and parts[1].startswith('nm') and parts[1][2:].isdigit():
+            name_id = int(parts[1][2:])
+            if name_id < self.names:
+                return 200, {}, self.name_page(name_id)
+        if len(parts) == 2 and parts[0] == 'chart' and parts[1] in CHARTS:
+            page_number = int(query.get('page', ['0'])[0]) if query.get('page', ['0'])[0].isdigit() else 0
+            return 200, {}, self.chart_page(parts[1], min(page_number, 4))
+        if parts[:1] == ['calendar']:
+            return 200, {}, self.calendar_page(query.get('date', ['2024-01-01'])[0])
+        if parts[:1] == ['browse']:
+            return 200, {}, self.browse_page(path)
+        if len(parts) == 3 and parts[0] == 'r' and parts[2].isdigit():
+            return 302, {'Location': f'/r/{parts[1]}/{(int(parts[2]) + 1) % 3}'}, b''
+        return 404, {}, self.page('404 Error - IMDb', '<h1>Page not found</h1>')
+
+
+class Throttle:
+    """Token bucket of the simulated server: ``rate`` requests/sec, bursts of ``burst``."""
+
+    def __init__(self, rate, burst=2):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.counts = {'served': 0, 'throttled': 0}
+
+    def allow(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            allowed = self.tokens >= 1
+            if allowed:
+                self.tokens -= 1
+            self.counts['served' if allowed else 'throttled'] += 1
+            return allowed
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    site = None
+    latency = 0.0
+    throttle = None
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        parts = urlsplit(self.path)
+        if self.throttle is not None and not self.throttle.allow():
+            status, headers, body = 503, {'Retry-After': '1'}, self.site.page('503 - IMDb', '<h1>Slow down</h1>')
+        else:
+            status, headers, body = self.site.resolve(parts.path, parse_qs(parts.query), self.headers.get('Host', 'localhost'))
+        headers.setdefault('Content-Type', 'text/html; charset=utf-8')
+        if status == 200:
+            etag = '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+            headers['ETag'] = etag
+            headers['Last-Modified'] = LAST_MODIFIED
+            if self.headers.get('If-None-Match') == etag or (
+                    self.headers.get('If-None-Match') is None and self.headers.get('If-Modified-Since') == LAST_MODIFIED):
+                status, body = 304, b''
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=8900, titles=2000, names=4000, seed=42, latency_ms=0.0, host='127.0.0.1', max_rps=0.0):
+    """Start the simulator in a background thread and return the server."""
+    throttle = Throttle(max_rps) if max_rps > 0 else None
+    handler = type('Handler', (SimulatorHandler,), {'site': Site(titles, names, seed), 'latency': latency_ms / 1000,
+                                                    'throttle': throttle})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--titles', type=int, default=2000)
+    parser.add_argument('--names', type=int, default=4000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--max-rps', type=float, default=0.0, help="answer requests beyond this rate with 503")
+    args = parser.parse_args()
+
+    server = serve(args.port, args.titles, args.names, args.seed, args.latency_ms, max_rps=args.max_rps)
+    print(f"Serving a simulated IMDb on http://127.0.0.1:{args.port}/ ({args.titles} titles, {args.names} names)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Pre-parse fast path for response bodies the crawl has already stored.
+
+Every response body is hashed once, with xxh3-128 when the optional xxhash package
+is installed and 16-byte blake2b otherwise, and the digest is cached in the
+request meta so SpiderTrapMiddleware and the spider share it. The spider looks the
+digest up before handing the body to the extraction pool: a hit on the page's own
+row is an unchanged re-fetch, a hit on another page is a duplicate body (IMDb
+serves the same template under several URLs), and either way parsing, text
+extraction and the similarity pass are skipped.
+
+Lookups go to an in-memory LRU of digests this worker has committed or looked up
+first, then to the indexed pages.body_hash column the other workers write to. A
+body only enters the LRU once the pipeline has committed it, so a page that was
+dropped or is still buffered never makes a later fetch look like a repeat.
+Outcomes are counted as ``fastpath/*`` stats, with ``fastpath/hit_rate`` kept up
+to date.
+"""
+import hashlib
+import os
+import sqlite3
+
+from .sketches import BoundedLRU
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+DIGEST_META_KEY = 'body_digest'
+
+
+def body_digest(body):
+    """16-byte digest of a raw response body."""
+    if xxhash is not None:
+        return xxhash.xxh3_128_digest(body)
+    return hashlib.blake2b(body, digest_size=16).digest()
+
+
+def response_digest(response, request=None):
+    """Digest of ``response.body``, computed once per response.
+
+    Downloader middlewares pass ``request``, as ``response.request`` is only set
+    once the response leaves the downloader.
+    """
+    meta = (request or response.request).meta
+    digest = meta.get(DIGEST_META_KEY)
+    if digest is None:
+        digest = body_digest(response.body)
+        meta[DIGEST_META_KEY] = digest
+    return digest
+
+
+class BodyDigestIndex:
+    """Finds which stored page, if any, already has a given body digest."""
+
+    def __init__(self, db_name, cache_size=100000, stats=None):
+        self.db_name = db_name
+        self.cache = BoundedLRU(cache_size)
+        self.stats = stats
+        self.conn = None
+
+    @classmethod
+    def from_settings(cls, settings, stats=None):
+        return cls(
+            settings.get('IMDB_DB_NAME', 'imdb_crawler.db'),
+            settings.getint('BODY_DIGEST_CACHE_SIZE', 100000),
+            stats,
+        )
+
+    def _query(self, body_hash, url_hash):
+        if self.conn is None:
+            if not os.path.exists(self.db_name):
+                return None
+            # Read-only: the pipeline owns the writes to this database
+            self.conn = sqlite3.connect(f'file:{self.db_name}?mode=ro', uri=True, timeout=30)
+        try:
+            row = self.conn.execute(
+                'SELECT url_hash FROM pages WHERE body_hash = ? ORDER BY url_hash = ? DESC LIMIT 1',
+                (body_hash, url_hash)
+            ).fetchone()
+        except sqlite3.OperationalError:
+            # The pipeline has not created or migrated the pages table yet
+            return None
+        return row[0] if row is not None else None
+
+    def lookup(self, body_hash, url_hash, stored_body_hash=None):
+        """url_hash of a page already stored with this body, preferring ``url_hash`` itself.
+
+        ``stored_body_hash`` is the body hash ConditionalGetMiddleware found for the
+        page, which settles an unchanged re-fetch without a query.
+        """
+        if stored_body_hash == body_hash:
+            owner = url_hash
+        elif body_hash in self.cache:
+            owner = self.cache[body_hash]
+            self._count('cache_hits')
+        else:
+            owner = self._query(body_hash, url_hash)
+            self._count('db_lookups')
+            if owner is not None:
+                self.cache[body_hash] = owner
+        self._count('lookups')
+        if owner is None:
+            self._count('misses')
+        else:
+            self._count('hits/unchanged' if owner == url_hash else 'hits/duplicate')
+        if self.stats is not None:
+            lookups = self.stats.get_value('fastpath/lookups', 0)
+            self.stats.set_value('fastpath/hit_rate', round(1 - self.stats.get_value('fastpath/misses', 0) / lookups, 4))
+        return owner
+
+    def remember(self, body_hash, url_hash):
+        """Record a body the pipeline has committed, so repeats skip the database lookup."""
+        self.cache[body_hash] = url_hash
+
+    def _count(self, name):
+        if self.stats is not None:
+            self.stats.inc_value(f'fastpath/{name}')
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,118 @@
+"""Periodic crawl checkpoints and the resume logic used by main.py --resume.
+
+The frontier database already holds the queue and the seen-set, and
+SpiderTrapMiddleware keeps its sketches in mmap'd files under SPIDERTRAP_STATE_DIR.
+A checkpoint makes that state consistent on disk: ``CheckpointExtension`` sends
+``before_checkpoint`` every CHECKPOINT_INTERVAL seconds, on which the pipeline flushes its
+buffer, the scheduler pushes its outgoing batch and the sketches are flushed. It then
+writes CHECKPOINT_DIR/worker-<id>.ckpt, a zlib-compressed pickle holding the
+checkpoint time, the scheduler's local (dont_filter) queue and the stats counters;
+the middleware counters among them are restored when the worker starts again.
+
+A worker only marks a frontier URL done once its outcome is stored, so on resume
+the URLs still claimed are exactly the ones the interrupted workers lost; they
+are queued again, and everything already in the pages table is treated as
+crawled.
+"""
+import os
+import pickle
+import time
+import zlib
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+# Sent before every checkpoint; receivers may return a dict to merge into it
+before_checkpoint = object()
+
+CHECKPOINT_SUFFIX = '.ckpt'
+# Middleware decision counters carried over when a worker restarts from its checkpoint
+RESTORED_STATS = ('spidertrap/', 'priority/')
+
+
+def checkpoint_path(directory, worker_id):
+    return os.path.join(directory, f'worker-{worker_id}{CHECKPOINT_SUFFIX}')
+
+
+def write_checkpoint(path, state):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)))
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint(path):
+    try:
+        with open(path, 'rb') as f:
+            return pickle.loads(zlib.decompress(f.read()))
+    except (OSError, zlib.error, pickle.UnpicklingError, EOFError):
+        return None
+
+
+def resume_frontier(frontier, db_name):
+    """Prepare the frontier of an interrupted crawl for a new fleet.
+
+    Returns the number of URLs queued again.
+    """
+    requeued = frontier.release_all()
+    if os.path.exists(db_name):
+        frontier.mark_stored(db_name)
+    return requeued
+
+
+class CheckpointExtension:
+    """Writes this worker's checkpoint every CHECKPOINT_INTERVAL seconds and on close."""
+
+    def __init__(self, crawler, directory, interval, worker_id):
+        self.crawler = crawler
+        self.directory = directory
+        self.interval = interval
+        self.worker_id = worker_id
+        self.path = checkpoint_path(directory, worker_id)
+        self.checkpoint_loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        directory = settings.get('CHECKPOINT_DIR')
+        if not directory:
+            raise NotConfigured
+        extension = cls(
+            crawler,
+            directory,
+            settings.getfloat('CHECKPOINT_INTERVAL', 60),
+            settings.getint('FRONTIER_WORKER_ID', 0),
+        )
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        os.makedirs(self.directory, exist_ok=True)
+        state = read_checkpoint(self.path)
+        if state is not None:
+            for key, value in state['stats'].items():
+                if key.startswith(RESTORED_STATS):
+                    self.crawler.stats.inc_value(key, value)
+        self.checkpoint_loop = task.LoopingCall(self.write, spider)
+        self.checkpoint_loop.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.checkpoint_loop is not None and self.checkpoint_loop.running:
+            self.checkpoint_loop.stop()
+        self.write(spider)
+
+    def write(self, spider):
+        started = time.time()
+        state = {'time': started, 'worker': self.worker_id, 'local_queue': []}
+        for _, result in self.crawler.signals.send_catch_log(before_checkpoint, spider=spider):
+            if isinstance(result, dict):
+                state.update(result)
+        state['stats'] = {
+            key: value for key, value in self.crawler.stats.get_stats().items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)
+        }
+        write_checkpoint(self.path, state)
+        self.crawler.stats.inc_value('checkpoint/count')
+        self.crawler.stats.set_value('checkpoint/seconds', time.time() - started)
@@ -0,0 +1,152 @@
+"""IMDb titles and people from a page's JSON-LD and markup.
+
+IMDb title and name pages embed a schema.org object (Movie, TVSeries, Person, ...)
+in a ``<script type="application/ld+json">`` block. ``page_entity`` turns it into a
+flat, picklable dict in the extraction process pool, so the pipeline can upsert it
+into the titles/people tables (see imdbcrawler.spiders.entity_store) instead of
+every consumer re-parsing stored text. Where the JSON-LD is missing or partial the
+page itself fills in: the IMDb id from the URL, the name from the first ``<h1>``,
+and the rest of the credits from the /name/nm... links under the page's credit
+headings ("Director", "Writers", "Top Cast", ...). Links under any other heading,
+such as a "More like this" block, are not credits.
+"""
+import html
+import json
+import re
+from urllib.parse import urljoin, urlsplit
+
+TITLE_PAGE = re.compile(r'^/title/(tt\d+)/?$')
+NAME_PAGE = re.compile(r'^/name/(nm\d+)/?$')
+TITLE_ID = re.compile(r'/title/(tt\d+)')
+NAME_ID = re.compile(r'/name/(nm\d+)')
+# schema.org types IMDb uses for the object of a title page
+TITLE_TYPES = {'Movie', 'TVSeries', 'TVEpisode', 'TVSeason', 'VideoGame', 'CreativeWork', 'MusicVideoObject'}
+# schema.org property -> role stored in credits
+CREDIT_ROLES = {'actor': 'actor', 'director': 'director', 'creator': 'creator'}
+# Cast linked from the page but not named in the JSON-LD
+LINKED_ROLE = 'cast'
+# Role of the /name/ links under a credit heading, by the first pattern the heading matches
+SECTION_ROLES = (
+    (re.compile(r'\bdirect', re.I), 'director'),
+    (re.compile(r'\bwrit', re.I), 'writer'),
+    (re.compile(r'\bcreat', re.I), 'creator'),
+    (re.compile(r'\bproduc', re.I), 'producer'),
+    (re.compile(r'\b(cast|stars?)\b', re.I), LINKED_ROLE),
+)
+
+
+def entity_kind(url):
+    """'title' or 'name' for an IMDb title or name page URL, else None."""
+    path = urlsplit(url).path
+    if TITLE_PAGE.match(path):
+        return 'title'
+    if NAME_PAGE.match(path):
+        return 'name'
+    return None
+
+
+def json_ld_objects(scripts):
+    """The JSON-LD objects in the text of the page's ld+json scripts, skipping invalid ones."""
+    for script in scripts:
+        try:
+            data = json.loads(script)
+        except (TypeError, ValueError):
+            continue
+        for item in data if isinstance(data, list) else [data]:
+            if not isinstance(item, dict):
+                continue
+            yield item
+            for nested in item.get('@graph') or []:
+                if isinstance(nested, dict):
+                    yield nested
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _number(value, cast):
+    try:
+        return cast(str(value).replace(',', ''))
+    except (TypeError, ValueError):
+        return None
+
+
+def _year(value):
+    match = re.match(r'\s*(\d{4})', str(value or ''))
+    return int(match.group(1)) if match else None
+
+
+def _credits(obj, url):
+    credits = []
+    for prop, role in CREDIT_ROLES.items():
+        for person in _as_list(obj.get(prop)):
+            if not isinstance(person, dict) or person.get('@type') not in (None, 'Person'):
+                continue
+            match = NAME_ID.search(urljoin(url, person.get('url') or ''))
+            if match:
+                credits.append((match.group(1), role))
+    return credits
+
+
+def section_role(section):
+    """Credit role of the links under a heading, or None when it is not a credit section."""
+    for pattern, role in SECTION_ROLES:
+        if pattern.search(section or ''):
+            return role
+    return None
+
+
+def page_entity(url, scripts, credit_links=(), heading=None):
+    """The title or person a page describes, or None for any other page.
+
+    ``scripts`` are the texts of its ld+json scripts, ``credit_links`` the
+    (href, section) pairs of its /name/ links, ``section`` being the text of the
+    heading each link sits under, and ``heading`` the text of its first <h1>.
+    """
+    kind = entity_kind(url)
+    if kind is None:
+        return None
+    page_id = (TITLE_ID if kind == 'title' else NAME_ID).search(urlsplit(url).path).group(1)
+    wanted = {'Person'} if kind == 'name' else TITLE_TYPES
+    obj = next((candidate for candidate in json_ld_objects(scripts) if candidate.get('@type') in wanted), {})
+
+    entity = {
+        'entity_type': kind,
+        'imdb_id': page_id,
+        # IMDb HTML-escapes the names in its JSON-LD ("Schindler&apos;s List")
+        'entity_name': html.unescape(obj.get('name') or '') or (heading.strip() if heading else None) or None,
+        'title_type': None,
+        'year': None,
+        'rating': None,
+        'rating_count': None,
+        'genres': [],
+        'credits': [],
+        'birth_date': None,
+    }
+    if kind == 'name':
+        entity['birth_date'] = obj.get('birthDate') or None
+        return entity
+
+    rating = obj.get('aggregateRating') or {}
+    entity.update(
+        title_type=obj.get('@type'),
+        year=_year(obj.get('datePublished') or obj.get('startDate')),
+        rating=_number(rating.get('ratingValue'), float) if isinstance(rating, dict) else None,
+        rating_count=_number(rating.get('ratingCount'), int) if isinstance(rating, dict) else None,
+        genres=[genre for genre in _as_list(obj.get('genre')) if isinstance(genre, str)],
+    )
+    credits = _credits(obj, url)
+    # Actors named in the JSON-LD are the top of the linked cast
+    credited = {(person_id, LINKED_ROLE if role == 'actor' else role) for person_id, role in credits}
+    # IMDb's JSON-LD only names the top few actors; the rest of the credits are linked
+    for href, section in credit_links:
+        match = NAME_ID.search(href)
+        role = section_role(section)
+        if match and role and (match.group(1), role) not in credited:
+            credited.add((match.group(1), role))
+            credits.append((match.group(1), role))
+    entity['credits'] = credits
+    return entity
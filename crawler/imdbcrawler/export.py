@@ -0,0 +1,141 @@
+"""Stream pages from the crawler database to a feed the search indexer consumes.
+
+Usage: python -m imdbcrawler.export [--db imdb_crawler.db] [--out pages.jsonl]
+                                    [--format jsonl|binary] [--state export_state.json] [--full]
+
+Each run only exports pages added or changed since the watermark saved by the previous
+run, so reindexing costs grow with the delta rather than with the corpus. The
+watermark is the pages table's commit sequence, so a page written by a slow writer
+after a later-scraped page was exported is still picked up.
+
+A run writes its pages to a feed of its own next to ``--out``, named after the
+sequence range it covers (``pages.000000000001-000000000057.jsonl``), and only saves
+the watermark once that file is complete. The search indexer (Indexer.index_feed)
+applies the pending feeds oldest first and deletes each one after committing it,
+so a run never overwrites pages the indexer has not acknowledged yet.
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+
+from .spiders.imdb_database import IMDBDatabase, PAGE_COLUMNS
+
+EXPORT_FIELDS = ('url_hash', 'url', 'date_time', 'content_type', 'title', 'html')
+LENGTH_PREFIX = struct.Struct('>I')
+
+
+def page_records(db, chunk_size=500, watermark=None):
+    """Yield (watermark, record) pairs for every page after ``watermark``.
+
+    A watermark saved before pages had a seq starts over from the beginning.
+    """
+    since_seq = (watermark or {}).get('seq', 0)
+    for seq, row in db.iter_pages(chunk_size, since_seq):
+        page = dict(zip(PAGE_COLUMNS, row))
+        record = {field: page[field] for field in EXPORT_FIELDS}
+        yield {'seq': seq}, record
+
+
+def write_jsonl(out, record):
+    out.write(json.dumps(record, ensure_ascii=False).encode('utf-8'))
+    out.write(b'\n')
+
+
+def write_length_prefixed(out, record):
+    payload = json.dumps(record, ensure_ascii=False).encode('utf-8')
+    out.write(LENGTH_PREFIX.pack(len(payload)))
+    out.write(payload)
+
+
+WRITERS = {
+    'jsonl': write_jsonl,
+    'binary': write_length_prefixed,
+}
+
+
+def read_length_prefixed(stream):
+    """Iterate the records of a binary feed written by ``write_length_prefixed``."""
+    while True:
+        header = stream.read(LENGTH_PREFIX.size)
+        if len(header) < LENGTH_PREFIX.size:
+            return
+        (length,) = LENGTH_PREFIX.unpack(header)
+        yield json.loads(stream.read(length).decode('utf-8'))
+
+
+def load_watermark(path):
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    return None
+
+
+def save_watermark(path, watermark):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(watermark, f)
+    os.replace(tmp_path, path)
+
+
+def export(db, out, fmt='jsonl', watermark=None, chunk_size=500):
+    """Write pages after ``watermark`` to ``out`` and return (count, new watermark)."""
+    writer = WRITERS[fmt]
+    count = 0
+    for watermark, record in page_records(db, chunk_size, watermark):
+        writer(out, record)
+        count += 1
+    return count, watermark
+
+
+def feed_path(out, first_seq, last_seq):
+    """Feed file for the pages with ``first_seq <= seq <= last_seq``, next to ``out``."""
+    stem, ext = os.path.splitext(out)
+    # Zero-padded so the indexer can apply the feeds in name order
+    return f'{stem}.{first_seq:012d}-{last_seq:012d}{ext}'
+
+
+def write_feed(db, out, fmt='jsonl', watermark=None, chunk_size=500):
+    """Export the pages after ``watermark`` to a new range feed next to ``out``.
+
+    Returns (count, new watermark, feed path); nothing is written when no page changed.
+    """
+    first_seq = (watermark or {}).get('seq', 0) + 1
+    tmp_path = f'{out}.tmp'
+    with open(tmp_path, 'wb') as f:
+        count, watermark = export(db, f, fmt, watermark, chunk_size)
+        f.flush()
+        os.fsync(f.fileno())
+    if not count:
+        os.remove(tmp_path)
+        return 0, watermark, None
+    path = feed_path(out, first_seq, watermark['seq'])
+    os.replace(tmp_path, path)
+    return count, watermark, path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default='imdb_crawler.db')
+    parser.add_argument('--out', default='pages.jsonl', help="feed name the range feeds are written next to, or - for stdout")
+    parser.add_argument('--format', choices=sorted(WRITERS), default='jsonl')
+    parser.add_argument('--state', default='export_state.json', help="watermark file")
+    parser.add_argument('--full', action='store_true', help="ignore the watermark and export everything")
+    parser.add_argument('--chunk-size', type=int, default=500)
+    args = parser.parse_args()
+
+    watermark = None if args.full else load_watermark(args.state)
+    path = None
+    with IMDBDatabase(args.db) as db:
+        if args.out == '-':
+            count, watermark = export(db, sys.stdout.buffer, args.format, watermark, args.chunk_size)
+        else:
+            count, watermark, path = write_feed(db, args.out, args.format, watermark, args.chunk_size)
+    if watermark:
+        save_watermark(args.state, watermark)
+    print(f"Exported {count} pages{f' to {path}' if path else ''}.", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
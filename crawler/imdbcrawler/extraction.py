@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urljoin
+
+from .entities import entity_kind, page_entity
+from .links import page_links
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    lxml = None
+
+
+# Elements that name the credit section of the links after them: headings, and the labels
+# of IMDb's principal credits list ("Director", "Writers", "Stars")
+SECTION_TAGS = ('h2', 'h3', 'h4')
+CREDIT_LABEL = 'metadata-list-item__label'
+
+
+def default_parser():
+    return 'lxml' if lxml is not None else 'html.parser'
+
+
+def normalise_text(raw_text):
+    return ' '.join(filter(None, (chunk.strip() for line in raw_text.splitlines() for chunk in line.split("  "))))
+
+
+def _parse_with_lxml(body, encoding):
+    parser = lxml.html.HTMLParser(encoding=encoding)
+    return lxml.html.document_fromstring(body, parser=parser)
+
+
+def _hrefs_with_lxml(doc, url):
+    base = doc.xpath('//base/@href')
+    return doc.xpath('//a/@href | //area/@href'), urljoin(url, base[0].strip()) if base else url
+
+
+def _entity_with_lxml(doc, url):
+    scripts = doc.xpath('//script[@type="application/ld+json"]/text()')
+    heading = doc.xpath('string(//h1[1])')
+    credit_links = []
+    section = ''
+    # One pass in document order, tracking the section each /name/ link sits in
+    for element in doc.iter(etree.Element):
+        if element.tag in SECTION_TAGS or CREDIT_LABEL in (element.get('class') or ''):
+            section = element.text_content()
+        elif element.tag == 'a' and '/name/' in (element.get('href') or ''):
+            credit_links.append((element.get('href'), section))
+    return page_entity(url, scripts, credit_links, heading)
+
+
+def _text_with_lxml(doc):
+    title = doc.findtext('.//title')
+    etree.strip_elements(doc, 'script', 'style', etree.Comment, with_tail=False)
+    return title, ' '.join(doc.itertext())
+
+
+def _parse_with_soup(body, encoding, parser):
+    from bs4 import BeautifulSoup
+
+    return BeautifulSoup(body.decode(encoding, errors='replace'), parser)
+
+
+def _hrefs_with_soup(soup, url):
+    base = soup.find('base', href=True)
+    hrefs = [element['href'] for element in soup.find_all(['a', 'area'], href=True)]
+    return hrefs, urljoin(url, base['href'].strip()) if base else url
+
+
+def _entity_with_soup(soup, url):
+    scripts = [script.string for script in soup.find_all('script', type='application/ld+json') if script.string]
+    heading = soup.find('h1')
+    credit_links = []
+    section = ''
+    for element in soup.find_all(True):
+        if element.name in SECTION_TAGS or CREDIT_LABEL in ' '.join(element.get('class') or ()):
+            section = element.get_text()
+        elif element.name == 'a' and '/name/' in (element.get('href') or ''):
+            credit_links.append((element['href'], section))
+    return page_entity(url, scripts, credit_links, heading.get_text() if heading else None)
+
+
+def _text_with_soup(soup):
+    title = soup.title.string if soup.title else None
+    for script in soup(['script', 'style']):
+        script.extract()
+    return title, soup.get_text(separator=' ')
+
+
+def extract_page(body, encoding, parser='html.parser', url=None):
+    """Parse a response body and return its title, visible text and the text's MD5.
+
+    With the page's ``url``, ``links`` holds the canonical URLs of its links, taken
+    from the same parsed tree (see imdbcrawler.links), and ``entity`` the title or
+    person of an IMDb title or name page (see imdbcrawler.entities), else None.
+
+    Runs inside the extraction process pool, so it only takes and returns picklable
+    values; ``timings`` holds the seconds spent parsing and extracting the text.
+    """
+    start = time.perf_counter()
+    links = []
+    entity = None
+    if parser == 'lxml' and lxml is not None and body.strip():
+        doc = _parse_with_lxml(body, encoding)
+        parsed = time.perf_counter()
+        if url is not None:
+            # Before _text_with_lxml strips elements (the JSON-LD scripts) from the tree
+            hrefs, base_url = _hrefs_with_lxml(doc, url)
+            links = page_links(hrefs, base_url)
+        linked = time.perf_counter()
+        if url is not None and entity_kind(url):
+            entity = _entity_with_lxml(doc, url)
+        entities_done = time.perf_counter()
+        title, raw_text = _text_with_lxml(doc)
+    else:
+        doc = _parse_with_soup(body, encoding, 'html.parser' if parser == 'lxml' else parser)
+        parsed = time.perf_counter()
+        if url is not None:
+            hrefs, base_url = _hrefs_with_soup(doc, url)
+            links = page_links(hrefs, base_url)
+        linked = time.perf_counter()
+        if url is not None and entity_kind(url):
+            entity = _entity_with_soup(doc, url)
+        entities_done = time.perf_counter()
+        title, raw_text = _text_with_soup(doc)
+
+    text_content = normalise_text(raw_text)
+    text_hash = hashlib.md5(text_content.encode()).hexdigest()
+    return {
+        'title': title or 'No Title',
+        'text': text_content,
+        'text_hash': text_hash,
+        'links': links,
+        'entity': entity,
+        'timings': {
+            'parse': parsed - start,
+            'extract_links': linked - parsed,
+            'extract_entities': entities_done - linked,
+            'extract_text': time.perf_counter() - entities_done,
+        },
+    }
+
+
+class ExtractionPool:
+    """Runs extract_page in worker processes so parsing never blocks the reactor.
+
+    At most ``max_pending`` pages are parsed or queued for parsing at once; further
+    callbacks wait on a semaphore instead of piling bodies into the executor, while
+    the downloader keeps fetching. ``max_workers=0`` parses inline, which is useful
+    for debugging and for the benchmark baseline.
+    """
+
+    def __init__(self, max_workers=None, max_pending=None, parser=None):
+        self.max_workers = os.cpu_count() if max_workers is None else max_workers
+        self.max_pending = max_pending or max(1, self.max_workers) * 2
+        self.parser = parser or default_parser()
+        self.executor = ProcessPoolExecutor(self.max_workers) if self.max_workers > 0 else None
+        self._semaphore = None
+
+    @classmethod
+    def from_settings(cls, settings):
+        max_workers = settings.get('EXTRACTION_WORKERS')
+        return cls(
+            max_workers=None if max_workers is None else int(max_workers),
+            max_pending=settings.getint('EXTRACTION_MAX_PENDING', 0) or None,
+            parser=settings.get('EXTRACTION_PARSER') or None,
+        )
+
+    @property
+    def pending(self):
+        if self._semaphore is None:
+            return 0
+        return self.max_pending - self._semaphore._value
+
+    async def extract(self, body, encoding, url=None):
+        if self.executor is None:
+            return extract_page(body, encoding, self.parser, url)
+        if self._semaphore is None:
+            # Created lazily so it binds to the reactor's running event loop
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+        async with self._semaphore:
+            future = self.executor.submit(extract_page, body, encoding, self.parser, url)
+            return await asyncio.wrap_future(future)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
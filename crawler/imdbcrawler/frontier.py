@@ -0,0 +1,478 @@
+import hashlib
+import pickle
+import sqlite3
+import time
+from collections import deque
+
+from scrapy import signals
+from scrapy.core.scheduler import BaseScheduler
+from scrapy.exceptions import DontCloseSpider
+from scrapy.utils.request import request_from_dict
+from twisted.internet import task
+
+from .checkpoint import before_checkpoint, checkpoint_path, read_checkpoint
+from .metrics import timed
+from .pipelines import pages_flush_failed, pages_flushed
+from .spiders.imdb_database import PRAGMAS
+
+PENDING = 0
+CLAIMED = 1
+DONE = 2
+
+# Sent with the url_hashes of every batch this worker claims, before any of them is
+# dispatched, so per-URL state can be loaded for the whole batch at once
+frontier_claimed = object()
+
+
+def url_hash_for(url):
+    return hashlib.md5(url.encode()).hexdigest()
+
+
+class Frontier:
+    """SQLite-backed URL queue and seen-set shared by every crawler process.
+
+    Each URL hashes to one of ``partitions`` partitions and each partition is owned by
+    exactly one worker (see ``assign_partitions``), so a URL is only ever fetched by
+    its owner no matter which worker discovered it. The primary key on url_hash is the
+    seen-set: pushing a URL that was already queued or crawled is a no-op.
+
+    A claimed URL stays CLAIMED until its outcome is on disk, and the claim is a lease:
+    ``heartbeat`` renews a live worker's claims, and ``reclaim_expired`` queues again
+    the claims of a worker that stopped renewing them (one that crashed, say).
+    """
+
+    def __init__(self, db_name="frontier.db", partitions=64):
+        self.db_name = db_name
+        self.partitions = partitions
+        self.conn = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        # Autocommit mode, so claims can take the write lock up front with BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(self.db_name, timeout=30, isolation_level=None)
+        for pragma in PRAGMAS:
+            self.conn.execute(pragma)
+        self._create_tables()
+        return self
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _create_tables(self):
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS frontier (
+                url_hash TEXT PRIMARY KEY,
+                url TEXT,
+                partition INTEGER,
+                priority INTEGER,
+                state INTEGER,
+                worker INTEGER,
+                request BLOB,
+                added_at REAL,
+                claimed_at REAL
+            )
+        ''')
+        if 'revisit' not in {row[1] for row in self.conn.execute('PRAGMA table_info(frontier)')}:
+            # Set by ``revisit`` for scheduled recrawls of stored pages
+            self.conn.execute('ALTER TABLE frontier ADD COLUMN revisit INTEGER')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_frontier_queue ON frontier (partition, state, priority DESC)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_frontier_claims ON frontier (state, claimed_at)')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS frontier_partitions (
+                partition INTEGER PRIMARY KEY,
+                worker INTEGER
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS frontier_workers (
+                worker INTEGER PRIMARY KEY,
+                heartbeat REAL
+            )
+        ''')
+
+    def partition_for(self, url_hash):
+        return int(url_hash[:8], 16) % self.partitions
+
+    def reset(self):
+        self.conn.execute('DELETE FROM frontier')
+        self.conn.execute('DELETE FROM frontier_partitions')
+        self.conn.execute('DELETE FROM frontier_workers')
+
+    def assign_partitions(self, workers, started=None):
+        """Spread the partitions over ``workers``: a worker count, or a list of worker ids.
+
+        The ``started`` workers (all of them by default) count as live from now on, so
+        ones still starting up keep their partitions for a lease before their first
+        heartbeat; the others have to prove they are alive with their own heartbeats.
+        """
+        if isinstance(workers, int):
+            workers = range(workers)
+        workers = sorted(workers)
+        started = workers if started is None else started
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.execute('DELETE FROM frontier_partitions')
+            self.conn.executemany(
+                'INSERT INTO frontier_partitions (partition, worker) VALUES (?, ?)',
+                [(partition, workers[partition % len(workers)]) for partition in range(self.partitions)]
+            )
+            self._beat(started, time.time())
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def push(self, entries):
+        """Queue (url, priority, request_blob) entries; URLs seen before are ignored."""
+        now = time.time()
+        rows = []
+        for url, priority, request_blob in entries:
+            url_hash = url_hash_for(url)
+            rows.append((url_hash, url, self.partition_for(url_hash), priority, PENDING, request_blob, now))
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.executemany('''
+                INSERT OR IGNORE INTO frontier (url_hash, url, partition, priority, state, request, added_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def push_urls(self, urls, priority=0):
+        self.push((url, priority, None) for url in urls)
+
+    def revisit(self, urls, priority=0):
+        """Queue crawled URLs again for a recrawl, adding any the frontier has not seen.
+
+        The rows are flagged, so their requests are dispatched as revisits.
+        """
+        now = time.time()
+        rows = []
+        for url in urls:
+            url_hash = url_hash_for(url)
+            rows.append((url_hash, url, self.partition_for(url_hash), priority, PENDING, now))
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.executemany('''
+                INSERT INTO frontier (url_hash, url, partition, priority, state, added_at, revisit)
+                VALUES (?, ?, ?, ?, ?, ?, 1)
+                ON CONFLICT (url_hash) DO UPDATE SET
+                    state = excluded.state, priority = excluded.priority, partition = excluded.partition,
+                    request = NULL, added_at = excluded.added_at, revisit = 1
+                WHERE state = ?
+            ''', [row + (DONE,) for row in rows])
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def claim(self, worker, limit):
+        """Atomically take up to ``limit`` of the worker's pending URLs, highest priority first.
+
+        Rows are (url_hash, url, priority, request_blob, requeued, revisit), where
+        ``requeued`` is true for URLs some worker had claimed before (released or
+        interrupted) and ``revisit`` for URLs queued by ``revisit``.
+        """
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = self.conn.execute('''
+                SELECT url_hash, url, priority, request, worker IS NOT NULL, revisit IS NOT NULL FROM frontier
+                WHERE state = ? AND partition IN (SELECT partition FROM frontier_partitions WHERE worker = ?)
+                ORDER BY priority DESC
+                LIMIT ?
+            ''', (PENDING, worker, limit)).fetchall()
+            self.conn.executemany(
+                'UPDATE frontier SET state = ?, worker = ?, claimed_at = ? WHERE url_hash = ?',
+                [(CLAIMED, worker, time.time(), row[0]) for row in rows]
+            )
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        return rows
+
+    def _beat(self, workers, now):
+        self.conn.executemany(
+            'INSERT INTO frontier_workers (worker, heartbeat) VALUES (?, ?) ON CONFLICT (worker) DO UPDATE SET heartbeat = excluded.heartbeat',
+            [(worker, now) for worker in workers]
+        )
+
+    def heartbeat(self, worker):
+        """Record that ``worker`` is alive and renew the leases on its claims."""
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._beat([worker], now)
+            self.conn.execute('UPDATE frontier SET claimed_at = ? WHERE state = ? AND worker = ?', (now, CLAIMED, worker))
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def heartbeats(self):
+        """{worker: time of its last heartbeat}."""
+        return dict(self.conn.execute('SELECT worker, heartbeat FROM frontier_workers').fetchall())
+
+    def reclaim_expired(self, lease_timeout):
+        """Queue again the claims nobody renewed for ``lease_timeout`` seconds."""
+        return self.conn.execute(
+            'UPDATE frontier SET state = ? WHERE state = ? AND claimed_at < ?',
+            (PENDING, CLAIMED, time.time() - lease_timeout)
+        ).rowcount
+
+    def mark_done(self, url_hashes):
+        """Record that the URLs were handled and whatever they produced is stored."""
+        self.conn.executemany('UPDATE frontier SET state = ? WHERE url_hash = ?', [(DONE, url_hash) for url_hash in url_hashes])
+
+    def release(self, worker, url_hashes=None):
+        """Return claimed URLs whose outcome is not stored to the queue (all of the
+        worker's, by default); returns how many were released."""
+        if url_hashes is None:
+            return self.conn.execute(
+                'UPDATE frontier SET state = ? WHERE state = ? AND worker = ?', (PENDING, CLAIMED, worker)
+            ).rowcount
+        return self.conn.executemany(
+            'UPDATE frontier SET state = ? WHERE state = ? AND url_hash = ?',
+            [(PENDING, CLAIMED, url_hash) for url_hash in url_hashes]
+        ).rowcount
+
+    def release_all(self):
+        """Return every claimed URL to the queue, e.g. after the whole fleet was killed."""
+        return self.conn.execute('UPDATE frontier SET state = ? WHERE state = ?', (PENDING, CLAIMED)).rowcount
+
+    def mark_stored(self, db_name):
+        """Treat every page already in ``db_name`` as crawled so it is never fetched again."""
+        self.conn.execute('ATTACH DATABASE ? AS store', (db_name,))
+        try:
+            if not self.conn.execute("SELECT 1 FROM store.sqlite_master WHERE type = 'table' AND name = 'pages'").fetchone():
+                return
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.execute(
+                    'UPDATE frontier SET state = ? WHERE state = ? AND url_hash IN (SELECT url_hash FROM store.pages)',
+                    (DONE, PENDING)
+                )
+                self.conn.execute('''
+                    INSERT OR IGNORE INTO frontier (url_hash, url, state, added_at)
+                    SELECT url_hash, url, ?, ? FROM store.pages
+                ''', (DONE, time.time()))
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        finally:
+            self.conn.execute('DETACH DATABASE store')
+
+    def pending_count(self, worker=None):
+        if worker is None:
+            return self.conn.execute('SELECT COUNT(*) FROM frontier WHERE state = ?', (PENDING,)).fetchone()[0]
+        return self.conn.execute('''
+            SELECT COUNT(*) FROM frontier
+            WHERE state = ? AND partition IN (SELECT partition FROM frontier_partitions WHERE worker = ?)
+        ''', (PENDING, worker)).fetchone()[0]
+
+    def outstanding_count(self, live_within=None, worker=None):
+        """URLs not yet done; with ``live_within``, only those in partitions whose owner
+        sent a heartbeat in the last ``live_within`` seconds, leaving out ``worker``'s
+        own claims."""
+        if live_within is None:
+            return self.conn.execute('SELECT COUNT(*) FROM frontier WHERE state IN (?, ?)', (PENDING, CLAIMED)).fetchone()[0]
+        return self.conn.execute('''
+            SELECT COUNT(*) FROM frontier
+            WHERE (state = ? OR (state = ? AND worker IS NOT ?)) AND partition IN (
+                SELECT partition FROM frontier_partitions JOIN frontier_workers USING (worker) WHERE heartbeat >= ?
+            )
+        ''', (PENDING, CLAIMED, worker, time.time() - live_within)).fetchone()[0]
+
+
+class FrontierScheduler(BaseScheduler):
+    """Scrapy scheduler that pushes every discovered request to the shared Frontier and
+    only pulls back requests from the partitions owned by this worker.
+
+    Requests with ``dont_filter`` set (retries, for instance) skip the frontier's
+    seen-set and stay in a local in-memory queue, which is saved in this worker's
+    checkpoint (see imdbcrawler.checkpoint) and restored when it starts again.
+
+    A dispatched URL is only marked done once the engine has finished with its
+    response (or failure) and the pipeline has flushed what it produced
+    (``pages_flushed``; a ``pages_flush_failed`` holds them back until a later flush
+    succeeds), so a crash loses no claimed URL: the supervisor, a restart
+    of this worker or an expired lease puts it back in the queue. Claims are renewed
+    every FRONTIER_LEASE_TIMEOUT / 10 seconds, and an idle worker only waits for
+    partitions whose owner renewed within FRONTIER_LEASE_TIMEOUT.
+    """
+
+    def __init__(self, crawler, frontier, worker_id, batch_size, checkpoint_dir=None, lease_timeout=300):
+        self.crawler = crawler
+        self.checkpoint_dir = checkpoint_dir
+        self.frontier = frontier
+        self.worker_id = worker_id
+        self.batch_size = batch_size
+        self.lease_timeout = lease_timeout
+        self.local_queue = deque()
+        self.claimed = deque()
+        self.outgoing = []
+        # url_hash -> the latest request for a claimed URL that is not done yet
+        self.dispatched = {}
+        # url_hashes whose latest request waits in local_queue (a retry, for instance)
+        self.retrying = set()
+        self.heartbeat_loop = None
+        self.spider = None
+        # Set while the pipeline holds rows it failed to write
+        self.flush_failed = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        scheduler = cls(
+            crawler,
+            Frontier(settings.get('FRONTIER_DB', 'frontier.db'), settings.getint('FRONTIER_PARTITIONS', 64)),
+            settings.getint('FRONTIER_WORKER_ID', 0),
+            settings.getint('FRONTIER_BATCH_SIZE', 32),
+            settings.get('CHECKPOINT_DIR') or None,
+            settings.getfloat('FRONTIER_LEASE_TIMEOUT', 300),
+        )
+        crawler.signals.connect(scheduler.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(scheduler.checkpoint_state, signal=before_checkpoint)
+        crawler.signals.connect(scheduler.pages_flushed, signal=pages_flushed)
+        crawler.signals.connect(scheduler.pages_flush_failed, signal=pages_flush_failed)
+        return scheduler
+
+    def open(self, spider):
+        self.spider = spider
+        self.frontier.open()
+        # A previous run of this worker may have died holding claims
+        self.frontier.release(self.worker_id)
+        if not self.frontier.conn.execute('SELECT 1 FROM frontier_partitions LIMIT 1').fetchone():
+            # Running stand-alone rather than under main.py: own every partition
+            self.frontier.assign_partitions(1)
+        if self.checkpoint_dir is not None:
+            state = read_checkpoint(checkpoint_path(self.checkpoint_dir, self.worker_id))
+            if state is not None:
+                self.local_queue.extend(request_from_dict(request, spider=spider) for request in state['local_queue'])
+        self.heartbeat_loop = task.LoopingCall(self.heartbeat)
+        self.heartbeat_loop.start(self.lease_timeout / 10)
+
+    def heartbeat(self):
+        self.frontier.heartbeat(self.worker_id)
+        self.frontier.reclaim_expired(self.lease_timeout)
+
+    def handled(self):
+        """url_hashes of dispatched URLs the engine has finished with.
+
+        The engine keeps a request in its slot until the spider's output for it has
+        gone through the item pipelines, so their pages are at least buffered.
+        """
+        engine = self.crawler.engine
+        inprogress = engine.slot.inprogress if engine is not None and engine.slot is not None else ()
+        return [
+            url_hash for url_hash, request in self.dispatched.items()
+            if url_hash not in self.retrying and request not in inprogress
+        ]
+
+    def pages_flushed(self, spider):
+        # Everything handled so far is now in the database
+        self.flush_failed = False
+        self._mark_handled()
+
+    def pages_flush_failed(self, spider):
+        self.flush_failed = True
+
+    def _mark_handled(self):
+        if self.frontier.conn is None:
+            return
+        done = self.handled()
+        if done:
+            self.frontier.mark_done(done)
+            for url_hash in done:
+                del self.dispatched[url_hash]
+
+    def checkpoint_state(self, spider):
+        if self.frontier.conn is not None:
+            self._flush_outgoing()
+        return {'local_queue': [request.to_dict(spider=spider) for request in self.local_queue]}
+
+    def close(self, reason):
+        if self.heartbeat_loop is not None and self.heartbeat_loop.running:
+            self.heartbeat_loop.stop()
+        self._flush_outgoing()
+        # The pipeline has flushed by now (the engine closes it before the scheduler);
+        # if that flush failed, the URLs go back to the queue with the other claims
+        if not self.flush_failed:
+            self._mark_handled()
+        self.frontier.release(self.worker_id)
+        self.frontier.close()
+
+    def has_pending_requests(self):
+        return bool(self.local_queue or self.claimed or self.outgoing) or self.frontier.pending_count(self.worker_id) > 0
+
+    def enqueue_request(self, request):
+        if request.dont_filter:
+            self.local_queue.append(request)
+            url_hash = request.meta.get('frontier_url_hash')
+            if url_hash in self.dispatched:
+                # A retry of a claimed URL: it is not done until the retry is
+                self.dispatched[url_hash] = request
+                self.retrying.add(url_hash)
+        else:
+            request_blob = pickle.dumps(request.to_dict(spider=self.spider), protocol=pickle.HIGHEST_PROTOCOL)
+            self.outgoing.append((request.url, request.priority, request_blob))
+            if len(self.outgoing) >= self.batch_size:
+                self._flush_outgoing()
+        self.crawler.stats.inc_value('frontier/enqueued', spider=self.spider)
+        return True
+
+    def next_request(self):
+        if self.local_queue:
+            request = self.local_queue.popleft()
+            self.retrying.discard(request.meta.get('frontier_url_hash'))
+            return request
+        if not self.claimed:
+            self._flush_outgoing()
+            with timed(self.crawler.stats, 'frontier_claim'):
+                claimed = self.frontier.claim(self.worker_id, self.batch_size)
+            if claimed:
+                self.crawler.signals.send_catch_log(
+                    frontier_claimed, url_hashes=[row[0] for row in claimed], spider=self.spider
+                )
+            self.claimed.extend(claimed)
+        if not self.claimed:
+            return None
+        url_hash, url, priority, request_blob, requeued, revisit = self.claimed.popleft()
+        self.crawler.stats.inc_value('frontier/dequeued', spider=self.spider)
+        if request_blob is None:
+            # Seed URLs pushed by main.py and recrawls queued by revisit carry no serialized request
+            request = self.spider.make_frontier_request(url, priority, revisit=revisit)
+        else:
+            request = request_from_dict(pickle.loads(request_blob), spider=self.spider)
+        if requeued:
+            # An interrupted fetch may already be in SpiderTrapMiddleware's content filter
+            request.meta['frontier_requeued'] = True
+        request.meta['frontier_url_hash'] = url_hash
+        self.dispatched[url_hash] = request
+        return request
+
+    def _flush_outgoing(self):
+        if self.outgoing:
+            outgoing, self.outgoing = self.outgoing, []
+            self.frontier.push(outgoing)
+
+    def spider_idle(self, spider):
+        # Other live workers may still push URLs into our partitions, so stay alive
+        # until their partitions are drained too; this worker's own claims are all
+        # handled by now and only wait for the pipeline's next flush
+        self._flush_outgoing()
+        if self.frontier.outstanding_count(self.lease_timeout, self.worker_id) > 0:
+            raise DontCloseSpider
+
+    def __len__(self):
+        return len(self.local_queue) + len(self.claimed) + self.frontier.pending_count(self.worker_id)
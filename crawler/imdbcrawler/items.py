@@ -7,6 +7,36 @@ import scrapy
 
 
 class ImdbcrawlerItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+    url_hash = scrapy.Field()
+    url = scrapy.Field()
+    date_time = scrapy.Field()
+    content_type = scrapy.Field()
+    content_length = scrapy.Field()
+    title = scrapy.Field()
+    html = scrapy.Field()
+    html_hash = scrapy.Field()
+    metadata = scrapy.Field()
+    etag = scrapy.Field()
+    last_modified = scrapy.Field()
+    body_hash = scrapy.Field()
+    # Set on IMDb title and name pages (see imdbcrawler.entities), None elsewhere
+    entity_type = scrapy.Field()
+    imdb_id = scrapy.Field()
+    entity_name = scrapy.Field()
+    title_type = scrapy.Field()
+    year = scrapy.Field()
+    rating = scrapy.Field()
+    rating_count = scrapy.Field()
+    genres = scrapy.Field()
+    credits = scrapy.Field()
+    birth_date = scrapy.Field()
+
+
+class PageTouchItem(scrapy.Item):
+    """A re-fetch that found a stored page unchanged (a 304 or an identical body)."""
+    url_hash = scrapy.Field()
+    url = scrapy.Field()
+    date_time = scrapy.Field()
+    etag = scrapy.Field()
+    last_modified = scrapy.Field()
+    body_hash = scrapy.Field()
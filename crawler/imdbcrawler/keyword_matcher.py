@@ -0,0 +1,97 @@
+def flatten_keywords(keywords):
+    """Yield every keyword string from a keywords.json level entry.
+
+    Levels map either to a plain list of keywords or to named groups of lists; for
+    groups, the group names are matched as well as their members.
+    """
+    if isinstance(keywords, str):
+        yield keywords
+    elif isinstance(keywords, dict):
+        for group, members in keywords.items():
+            yield group
+            yield from flatten_keywords(members)
+    else:
+        for keyword in keywords:
+            yield from flatten_keywords(keyword)
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton mapping lowercase keywords to priority values.
+
+    Built once, a scan is a single pass over the text regardless of how many
+    keywords there are, and reports the highest value of any keyword it contains.
+    """
+
+    def __init__(self, keyword_values):
+        # Node i is (children, fail link, best value, keyword that gave that value)
+        self.children = [{}]
+        self.fail = [0]
+        self.value = [None]
+        self.keyword = [None]
+        for keyword, value in keyword_values:
+            self._insert(keyword.lower(), value, keyword)
+        self._link()
+        values = [value for value in self.value if value is not None]
+        self.max_value = max(values) if values else None
+
+    @classmethod
+    def from_levels(cls, levels, level_value):
+        return cls(
+            (keyword, level_value(level))
+            for level, keywords in levels.items()
+            for keyword in flatten_keywords(keywords)
+            if keyword
+        )
+
+    def _insert(self, keyword, value, original):
+        node = 0
+        for char in keyword:
+            child = self.children[node].get(char)
+            if child is None:
+                child = len(self.children)
+                self.children.append({})
+                self.fail.append(0)
+                self.value.append(None)
+                self.keyword.append(None)
+                self.children[node][char] = child
+            node = child
+        if self.value[node] is None or value > self.value[node]:
+            self.value[node] = value
+            self.keyword[node] = original
+
+    def _link(self):
+        # Breadth-first, so every fail target is final before its dependants; each node
+        # also inherits the best value reachable through its fail chain
+        queue = list(self.children[0].values())
+        for node in queue:
+            for char, child in self.children[node].items():
+                fail = self.fail[node]
+                while fail and char not in self.children[fail]:
+                    fail = self.fail[fail]
+                target = self.children[fail].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                inherited = self.value[self.fail[child]]
+                if inherited is not None and (self.value[child] is None or inherited > self.value[child]):
+                    self.value[child] = inherited
+                    self.keyword[child] = self.keyword[self.fail[child]]
+                queue.append(child)
+
+    def best_match(self, text):
+        """Return (value, keyword) for the highest-valued keyword in text, or (None, None)."""
+        children = self.children
+        fail = self.fail
+        values = self.value
+        best = None
+        best_node = 0
+        node = 0
+        for char in text:
+            while node and char not in children[node]:
+                node = fail[node]
+            node = children[node].get(char, 0)
+            value = values[node]
+            if value is not None and (best is None or value > best):
+                best = value
+                best_node = node
+                if best == self.max_value:
+                    break
+        return best, self.keyword[best_node] if best is not None else None
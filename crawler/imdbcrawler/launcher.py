@@ -0,0 +1,85 @@
+"""Forkserver launcher for crawler workers.
+
+Every ``python run_crawler.py`` worker pays for importing Scrapy, Twisted, lxml,
+numpy and the project's modules before it sends its first request, and holds its
+own copy of all of them. ``WorkerLauncher`` starts a multiprocessing forkserver
+that imports PRELOAD once; each worker is then forked from it with those modules
+already loaded, and shares their pages copy-on-write with its siblings.
+
+Nothing in PRELOAD imports twisted.internet.reactor, so each worker still installs
+the reactor named by TWISTED_REACTOR itself. ``launch`` returns a handle with the
+parts of the subprocess.Popen interface main.py and the Supervisor use, so either
+kind of worker can be used.
+"""
+import multiprocessing
+
+PRELOAD = [
+    'scrapy.cmdline',
+    'scrapy.crawler',
+    'imdbcrawler.spiders.ImdbCrawler',
+    'imdbcrawler.pipelines',
+    'imdbcrawler.middlewares',
+    'imdbcrawler.frontier',
+    'imdbcrawler.checkpoint',
+    'imdbcrawler.supervisor',
+    'lxml.html',
+    'numpy',
+]
+
+
+def crawl_args(start_url, allowed_domain, settings=()):
+    """The scrapy command line of one worker, from run_crawler.py's arguments."""
+    args = ["scrapy", "crawl", "imdb_crawler", "-a", f"start_url={start_url}", "-a", f"allowed_domain={allowed_domain}"]
+    for setting in settings:
+        args.extend(["-s", setting])
+    return args
+
+
+def run_worker(start_url, allowed_domain, settings):
+    from scrapy.cmdline import execute
+
+    execute(crawl_args(start_url, allowed_domain, settings))
+
+
+class ForkedWorker:
+    """A forked worker behind the subset of subprocess.Popen the callers use."""
+
+    def __init__(self, process):
+        self.process = process
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    @property
+    def returncode(self):
+        return self.process.exitcode
+
+    def poll(self):
+        return self.process.exitcode
+
+    def wait(self, timeout=None):
+        self.process.join(timeout)
+        return self.process.exitcode
+
+    def terminate(self):
+        # SIGTERM, which Scrapy handles with a graceful shutdown, as with Popen
+        self.process.terminate()
+
+    def kill(self):
+        self.process.kill()
+
+
+class WorkerLauncher:
+    """Forks run_crawler.py workers from a forkserver that has PRELOAD imported."""
+
+    def __init__(self, preload=PRELOAD):
+        self.context = multiprocessing.get_context('forkserver')
+        self.context.set_forkserver_preload(list(preload))
+
+    def launch(self, command):
+        """Start a worker from a ``python run_crawler.py <url> <domain> [SETTING=value ...]`` command."""
+        start_url, allowed_domain, *settings = command[command.index('run_crawler.py') + 1:]
+        process = self.context.Process(target=run_worker, args=(start_url, allowed_domain, settings))
+        process.start()
+        return ForkedWorker(process)
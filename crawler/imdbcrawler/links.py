@@ -0,0 +1,85 @@
+"""Link canonicalisation and filtering for the spider's link-extraction stage.
+
+hrefs are pulled out of the tree extract_page has already parsed, in the extraction
+process pool, and canonicalised there: scheme and host lowercased, default ports,
+fragments and tracking parameters (IMDb's ``ref_`` and ``pf_rd_*``, ``utm_*``,
+click ids) dropped and the remaining query sorted, then deduplicated within the
+page. ``LinkFilter``, built once per spider, drops off-site URLs, binary files and
+anything it emitted recently, so the scheduler and frontier only see each link once
+per worker while it stays in the LRU.
+"""
+import re
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+from scrapy.linkextractors import IGNORED_EXTENSIONS
+
+from .sketches import BoundedLRU
+
+TRACKING_PARAMS = re.compile(r'^(ref_|pf_rd_.*|utm_.*|fbclid|gclid|dclid|mc_cid|mc_eid|_ga)$')
+DEFAULT_PORTS = {'http': ':80', 'https': ':443'}
+IGNORED_SUFFIXES = tuple(f'.{extension}' for extension in IGNORED_EXTENSIONS)
+
+
+def canonicalize(url):
+    """Canonical form of an absolute http(s) URL, or None for any other scheme."""
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return None
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS:
+        return None
+    netloc = parts.netloc.lower()
+    if netloc.endswith(DEFAULT_PORTS[scheme]):
+        netloc = netloc[:-len(DEFAULT_PORTS[scheme])]
+    query = ''
+    if parts.query:
+        params = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if not TRACKING_PARAMS.match(key)]
+        query = urlencode(sorted(params))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+def page_links(hrefs, base_url):
+    """Canonical, page-locally unique absolute URLs for the hrefs of one page."""
+    seen = set()
+    links = []
+    for href in hrefs:
+        url = canonicalize(urljoin(base_url, href.strip()))
+        if url is not None and url not in seen:
+            seen.add(url)
+            links.append(url)
+    return links
+
+
+class LinkFilter:
+    """Keeps the on-site links of a page that this process has not emitted recently."""
+
+    def __init__(self, allowed_domains, cache_size=200000, stats=None):
+        self.allowed_domains = tuple(domain.lower() for domain in allowed_domains if domain)
+        self.recent = BoundedLRU(cache_size)
+        self.stats = stats
+
+    def allowed(self, url):
+        parts = urlsplit(url)
+        host = parts.hostname or ''
+        if self.allowed_domains and not any(host == domain or host.endswith('.' + domain) for domain in self.allowed_domains):
+            return False
+        return not parts.path.lower().endswith(IGNORED_SUFFIXES)
+
+    def filter(self, links, source=None):
+        """The links worth a Request; ``source``, the page they came from, counts as emitted."""
+        if source is not None:
+            self.recent[canonicalize(source)] = True
+        fresh = []
+        for url in links:
+            if url in self.recent:
+                # Refresh its position so links shared by many pages stay cached
+                self.recent[url] = True
+                continue
+            self.recent[url] = True
+            if self.allowed(url):
+                fresh.append(url)
+        if self.stats is not None:
+            self.stats.inc_value('links/extracted', len(links))
+            self.stats.inc_value('links/emitted', len(fresh))
+        return fresh
@@ -0,0 +1,209 @@
+"""Per-stage timers, queue gauges and periodic metrics snapshots for the crawler.
+
+Stage timings are kept in the Scrapy stats collector as ``timing/<stage>/count``,
+``timing/<stage>/seconds`` and ``timing/<stage>/max_seconds``, so they also show
+up in the stats dump Scrapy logs when the spider closes. ``CrawlMetrics`` appends
+a JSON snapshot of the stats to METRICS_DIR/worker-<id>.jsonl every
+METRICS_INTERVAL seconds and, with METRICS_PORT set, serves a live one on
+http://127.0.0.1:<port>/metrics. ``aggregate_snapshots`` merges the workers'
+latest snapshots; main.py uses it to report on the whole crawl.
+"""
+import datetime
+import glob
+import json
+import os
+import time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+from twisted.web import resource, server
+
+from .timings import TIMING_PREFIX, record_timing, timed
+
+QUEUE_PREFIX = 'queue/'
+
+
+def stage_summary(values):
+    """Map each timed stage to its call count, mean and max in milliseconds and total seconds."""
+    stages = {}
+    for key, value in values.items():
+        if key.startswith(TIMING_PREFIX):
+            stage, field = key[len(TIMING_PREFIX):].rsplit('/', 1)
+            stages.setdefault(stage, {})[field] = value
+    summary = {}
+    for stage, fields in sorted(stages.items()):
+        count = fields.get('count', 0)
+        seconds = fields.get('seconds', 0.0)
+        summary[stage] = {
+            'count': count,
+            'mean_ms': round(seconds * 1000 / count, 3) if count else 0.0,
+            'max_ms': round(fields.get('max_seconds', 0.0) * 1000, 3),
+            'total_s': round(seconds, 3),
+        }
+    return summary
+
+
+def _json_value(value):
+    if isinstance(value, (datetime.datetime, datetime.timedelta)):
+        return str(value)
+    return value
+
+
+def read_latest_snapshot(path):
+    """Return the last complete snapshot in a JSONL file, or None."""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            # Snapshots are small; the tail is enough to hold the last whole line
+            f.seek(max(0, size - 256 * 1024))
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    for line in reversed(lines):
+        try:
+            return json.loads(line)
+        except ValueError:
+            # A worker may be halfway through writing the last line
+            continue
+    return None
+
+
+def aggregate_snapshots(directory):
+    """Merge the latest snapshot of every worker under ``directory``.
+
+    Counters, timings and queue depths are summed; maxima take the largest value.
+    """
+    workers = {}
+    totals = {}
+    for path in sorted(glob.glob(os.path.join(directory, 'worker-*.jsonl'))):
+        snapshot = read_latest_snapshot(path)
+        if snapshot is None:
+            continue
+        workers[snapshot.get('worker')] = snapshot
+        for key, value in snapshot.get('stats', {}).items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            if key.endswith('_rate'):
+                # Ratios do not add up across workers; they are recomputed from the counters
+                continue
+            if key.endswith('max_seconds') or key.startswith('memusage/max'):
+                totals[key] = max(totals.get(key, value), value)
+            else:
+                totals[key] = totals.get(key, 0) + value
+    return {
+        'time': time.time(),
+        'workers': len(workers),
+        'stats': totals,
+        'stages': stage_summary(totals),
+    }
+
+
+class CrawlMetrics:
+    """Scrapy extension that times the download stage, samples queue depths and
+    exports snapshots of the stats collector."""
+
+    def __init__(self, crawler, directory, interval, port, worker_id):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.directory = directory
+        self.interval = interval
+        self.port = port
+        self.worker_id = worker_id
+        self.path = os.path.join(directory, f'worker-{worker_id}.jsonl')
+        self.snapshot_loop = None
+        self.listener = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('METRICS_ENABLED', True):
+            raise NotConfigured
+        extension = cls(
+            crawler,
+            settings.get('METRICS_DIR', 'metrics'),
+            settings.getfloat('METRICS_INTERVAL', 10),
+            settings.getint('METRICS_PORT', 0),
+            settings.getint('FRONTIER_WORKER_ID', 0),
+        )
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        return extension
+
+    def spider_opened(self, spider):
+        os.makedirs(self.directory, exist_ok=True)
+        self.snapshot_loop = task.LoopingCall(self.write_snapshot)
+        self.snapshot_loop.start(self.interval, now=False)
+        if self.port:
+            from twisted.internet import reactor
+
+            self.listener = reactor.listenTCP(self.port, server.Site(MetricsResource(self)), interface='127.0.0.1')
+            spider.logger.info(f'Serving metrics on http://127.0.0.1:{self.port}/metrics')
+
+    def spider_closed(self, spider):
+        if self.snapshot_loop is not None and self.snapshot_loop.running:
+            self.snapshot_loop.stop()
+        # The scheduler and downloader are already closed, so keep the last sampled depths
+        self.write_snapshot(sample_queues=False)
+        if self.listener is not None:
+            self.listener.stopListening()
+            self.listener = None
+
+    def response_received(self, response, request, spider):
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            record_timing(self.stats, 'download', latency)
+
+    def sample_queues(self):
+        engine = self.crawler.engine
+        if engine is None or engine.slot is None:
+            return
+        gauges = {
+            'scheduler': len(engine.slot.scheduler),
+            'inprogress': len(engine.slot.inprogress),
+            'downloader_active': len(engine.downloader.active),
+        }
+        if engine.scraper.slot is not None:
+            gauges['scraper_active'] = len(engine.scraper.slot.active)
+            gauges['scraper_active_bytes'] = engine.scraper.slot.active_size
+        extraction_pool = getattr(engine.spider, 'extraction_pool', None)
+        if extraction_pool is not None:
+            gauges['extraction_pending'] = extraction_pool.pending
+        for name, value in gauges.items():
+            self.stats.set_value(f'{QUEUE_PREFIX}{name}', value)
+
+    def snapshot(self, sample_queues=True):
+        if sample_queues:
+            self.sample_queues()
+        values = {key: _json_value(value) for key, value in self.stats.get_stats().items()}
+        return {
+            'time': time.time(),
+            'worker': self.worker_id,
+            'pid': os.getpid(),
+            'stats': values,
+            'stages': stage_summary(values),
+        }
+
+    def write_snapshot(self, sample_queues=True):
+        snapshot = self.snapshot(sample_queues)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(snapshot) + '\n')
+
+
+class MetricsResource(resource.Resource):
+    """Serves the current snapshot as JSON at /metrics."""
+
+    isLeaf = True
+
+    def __init__(self, metrics):
+        super().__init__()
+        self.metrics = metrics
+
+    def render_GET(self, request):
+        if request.path.rstrip(b'/') != b'/metrics':
+            request.setResponseCode(404)
+            return b''
+        request.setHeader(b'Content-Type', b'application/json')
+        return json.dumps(self.metrics.snapshot()).encode('utf-8')
@@ -1,11 +1,23 @@
 import hashlib
 import json
+import os
+import sqlite3
+import time
+from collections import deque
+from urllib.parse import urlsplit
 from scrapy import signals
-from scrapy.exceptions import IgnoreRequest
-from scrapy.http import HtmlResponse
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import HtmlResponse, Request
 from scrapy.linkextractors import LinkExtractor
 from queue import PriorityQueue
 
+from .body_digests import response_digest
+from .checkpoint import before_checkpoint
+from .frontier import frontier_claimed
+from .keyword_matcher import KeywordMatcher
+from .metrics import timed
+from .sketches import BoundedLRU, CountMinSketch, ScalableBloomFilter
+
 class ImdbcrawlerSpiderMiddleware:
     @classmethod
     def from_crawler(cls, crawler):
@@ -32,20 +44,19 @@ class ImdbcrawlerSpiderMiddleware:
 
 
 class ImdbcrawlerDownloaderMiddleware:
+    # PriorityMiddleware (a spider middleware) and SpiderTrapMiddleware are
+    # registered themselves; running second copies here would build a second set
+    # of sketches and split their counts
     @classmethod
     def from_crawler(cls, crawler):
         s = cls()
-        s.priority_middleware = PriorityMiddleware()
-        s.spider_trap_middleware = SpiderTrapMiddleware()
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         return s
 
     def process_request(self, request, spider):
-        self.priority_middleware.process_request(request, spider)
         return None
 
     def process_response(self, request, response, spider):
-        response = self.spider_trap_middleware.process_response(request, response, spider)
         return response
 
     def process_exception(self, request, exception, spider):
@@ -56,28 +67,107 @@ class ImdbcrawlerDownloaderMiddleware:
 
 
 class PriorityMiddleware:
-    def __init__(self):
-        with open("keywords.json", encoding='utf-8') as f:
+    """Spider middleware that sets request priority from the keywords.json levels found in the URL.
+
+    A URL gets the value of the highest level among the keywords it contains (high 1,
+    middle 0, low -1) and 0 if it contains none. The priority is set on the requests
+    the spider yields, before FrontierScheduler stores them, and is what the frontier
+    orders its claims by; seeds and recrawls pushed by main.py keep priority 0.
+
+    The keywords are compiled once into an Aho-Corasick automaton, host/path scans are
+    memoised in an LRU, and the file is reloaded when its mtime changes (checked at
+    most every ``reload_interval`` seconds). Matches are only logged when
+    ``log_matches`` is set (PRIORITY_LOG_MATCHES); the assigned priorities are
+    counted in the stats as ``priority/assigned/<value>``.
+    """
+
+    def __init__(self, keywords_path="keywords.json", log_matches=False, reload_interval=30, cache_size=100000, stats=None):
+        self.keywords_path = keywords_path
+        self.stats = stats
+        self.log_matches = log_matches
+        self.reload_interval = reload_interval
+        self.cache = BoundedLRU(cache_size)
+        self.keywords_mtime = None
+        self.next_reload_check = 0
+        self.load_keywords()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            settings.get('PRIORITY_KEYWORDS_FILE', 'keywords.json'),
+            settings.getbool('PRIORITY_LOG_MATCHES', False),
+            settings.getfloat('PRIORITY_KEYWORDS_RELOAD_INTERVAL', 30),
+            settings.getint('PRIORITY_CACHE_SIZE', 100000),
+            crawler.stats,
+        )
+
+    def load_keywords(self):
+        with open(self.keywords_path, encoding='utf-8') as f:
             self.keywords = json.load(f)
+        self.keywords_mtime = os.stat(self.keywords_path).st_mtime
+        self.matcher = KeywordMatcher.from_levels(self.keywords, self.get_priority_value)
+        self.cache.clear()
 
-    def process_request(self, request, spider):
-        priority = self.calculate_priority(request)
+    def reload_if_changed(self):
+        now = time.monotonic()
+        if now < self.next_reload_check:
+            return
+        self.next_reload_check = now + self.reload_interval
+        try:
+            if os.stat(self.keywords_path).st_mtime != self.keywords_mtime:
+                self.load_keywords()
+        except (OSError, ValueError):
+            # Keep the previous keywords while the file is missing or half-written
+            pass
+
+    def process_start_requests(self, start_requests, spider):
+        for request in start_requests:
+            yield self.prioritize(request, spider)
+
+    def process_spider_output(self, response, result, spider):
+        for item in result:
+            yield self.prioritize(item, spider)
+
+    async def process_spider_output_async(self, response, result, spider):
+        async for item in result:
+            yield self.prioritize(item, spider)
+
+    def prioritize(self, request, spider=None):
+        """Set the priority of a Request (items pass through unchanged) and return it."""
+        if not isinstance(request, Request):
+            return request
+        with timed(self.stats, 'priority'):
+            priority = self.calculate_priority(request, spider)
         request.priority = priority
-        return None
+        if self.stats is not None:
+            self.stats.inc_value(f'priority/assigned/{priority}')
+        return request
 
-    def calculate_priority(self, request):
+    def calculate_priority(self, request, spider=None):
+        self.reload_if_changed()
         priority = 0
-        content = request.url.lower()
+        url = request.url
+
+        if self.matcher.max_value is None:
+            return priority
 
-        if len(content) > 10:
-            priority = max(priority, 1)
+        parts = urlsplit(url.lower())
+        host_path = f"{parts.scheme}://{parts.netloc}{parts.path}"
+        match = self.cache.get(host_path)
+        if match is None:
+            match = self.matcher.best_match(host_path)
+            self.cache[host_path] = match
+        if parts.query or parts.fragment:
+            query_match = self.matcher.best_match(url.lower()[len(host_path):])
+            if query_match[0] is not None and (match[0] is None or query_match[0] > match[0]):
+                match = query_match
 
-        for priority_level, keywords in self.keywords.items():
-            for keyword in keywords:
-                if keyword.lower() in content:
-                    priority = max(priority, self.get_priority_value(priority_level))
-                    print(f"Keyword '{keyword}' found with priority level '{priority_level}' for URL: {request.url}")
-                    break
+        value, keyword = match
+        if value is not None:
+            priority = value
+            if self.log_matches and spider is not None:
+                spider.logger.debug(f"Keyword '{keyword}' found with priority {value} for URL: {request.url}")
 
         return priority
 
@@ -90,55 +180,181 @@ class PriorityMiddleware:
             return -1
 
 class SpiderTrapMiddleware:
-    def __init__(self):
-        self.visited_hashes = set()
-        self.redirect_count = {}
+    """Drops redirect loops, duplicate bodies and over-visited URLs.
+
+    State lives in fixed-size sketches keyed by binary MD5 digests rather than in
+    dicts of URL and hex strings, so memory stays bounded on long crawls. With a
+    ``state_dir`` the sketches are mmap'd files and survive restarts. Every drop is
+    counted in the stats as ``spidertrap/dropped/<reason>``.
+    """
+
+    def __init__(self, state_dir=None, expected_pages=100000, redirect_history_size=100000, stats=None):
+        self.stats = stats
+        paths = {}
+        if state_dir is not None:
+            os.makedirs(state_dir, exist_ok=True)
+            paths = {name: os.path.join(state_dir, name) for name in ('content', 'visits', 'redirects')}
+        self.visited_hashes = ScalableBloomFilter(expected_pages, path=paths.get('content'))
+        self.redirect_count = CountMinSketch(path=paths.get('redirects'))
         self.redirect_threshold = 5
         self.content_threshold = 3
-        self.url_visit_count = {}
+        self.url_visit_count = CountMinSketch(path=paths.get('visits'))
         self.max_visits_per_url = 10
-        self.redirect_history = {}
+        self.redirect_history = BoundedLRU(redirect_history_size)
         self.redirect_chain_limit = 5
+        self.closed = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        state_dir = settings.get('SPIDERTRAP_STATE_DIR')
+        if state_dir:
+            state_dir = os.path.join(state_dir, f"worker-{settings.getint('FRONTIER_WORKER_ID', 0)}")
+        middleware = cls(state_dir, settings.getint('SPIDERTRAP_EXPECTED_PAGES', 100000), stats=crawler.stats)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(middleware.checkpoint, signal=before_checkpoint)
+        return middleware
 
     def process_response(self, request, response, spider):
+        with timed(self.stats, 'spidertrap'):
+            return self.check_response(request, response)
+
+    def drop(self, reason, message):
+        if self.stats is not None:
+            self.stats.inc_value(f'spidertrap/dropped/{reason}')
+        raise IgnoreRequest(message)
+
+    def check_response(self, request, response):
         url = response.url
+        url_digest = hashlib.md5(url.encode()).digest()
 
         if response.status in [301, 302]:
-            if url not in self.redirect_count:
-                self.redirect_count[url] = 0
-            self.redirect_count[url] += 1
-            if self.redirect_count[url] > self.redirect_threshold:
-                raise IgnoreRequest(f"Too many redirects: {url}")
-            self.track_redirect_chain(url, response.headers.get('Location'))
-
-        if isinstance(response, HtmlResponse):
-            content_hash = hashlib.md5(response.body).hexdigest()
-            if content_hash in self.visited_hashes:
-                raise IgnoreRequest(f"Duplicate content detected: {response.url}")
-            self.visited_hashes.add(content_hash)
-
-        if url not in self.url_visit_count:
-            self.url_visit_count[url] = 0
-        self.url_visit_count[url] += 1
-        if self.url_visit_count[url] > self.max_visits_per_url:
-            raise IgnoreRequest(f"URL visited too frequently: {url}")
-
-        if url in self.redirect_history and len(self.redirect_history[url]) > self.redirect_chain_limit:
-            raise IgnoreRequest(f"Possible infinite redirect loop detected: {url}")
+            if self.redirect_count.add(url_digest) > self.redirect_threshold:
+                self.drop('redirects', f"Too many redirects: {url}")
+            self.track_redirect_chain(url_digest, response.headers.get('Location'))
+
+        # A scheduled revisit of a stored page is expected to see the same body again
+        revisit = request.meta.get('revisit', False)
+        if isinstance(response, HtmlResponse) and not request.meta.get('frontier_requeued') and not revisit:
+            if self.visited_hashes.add(response_digest(response, request)):
+                self.drop('duplicate_content', f"Duplicate content detected: {response.url}")
+
+        if self.url_visit_count.add(url_digest) > self.max_visits_per_url and not revisit:
+            self.drop('visit_limit', f"URL visited too frequently: {url}")
+
+        if url_digest in self.redirect_history and len(self.redirect_history[url_digest]) > self.redirect_chain_limit:
+            self.drop('redirect_loop', f"Possible infinite redirect loop detected: {url}")
         
         if response.body.count(b'\x00') > 100:
-            raise IgnoreRequest(f"Ill-formed HTML with too many null characters: {response.url}")
+            self.drop('null_characters', f"Ill-formed HTML with too many null characters: {response.url}")
         
         path_depth = response.url.count('/')
         if path_depth > 20:
-            raise IgnoreRequest(f"Path depth too large: {response.url}")
+            self.drop('path_depth', f"Path depth too large: {response.url}")
 
         return response
 
-    def track_redirect_chain(self, url, location):
+    def track_redirect_chain(self, url_digest, location):
         """Track the chain of redirects for a URL."""
-        if url not in self.redirect_history:
-            self.redirect_history[url] = []
-        self.redirect_history[url].append(location)
-        if len(self.redirect_history[url]) > self.redirect_chain_limit:
-            self.redirect_history[url] = self.redirect_history[url][-self.redirect_chain_limit:]
+        if url_digest not in self.redirect_history:
+            self.redirect_history[url_digest] = deque(maxlen=self.redirect_chain_limit)
+        self.redirect_history[url_digest].append(location)
+
+    def checkpoint(self, spider):
+        if self.closed:
+            return
+        for sketch in (self.visited_hashes, self.redirect_count, self.url_visit_count):
+            sketch.flush()
+
+    def spider_closed(self, spider):
+        self.closed = True
+        for sketch in (self.visited_hashes, self.redirect_count, self.url_visit_count):
+            sketch.flush()
+            sketch.close()
+
+
+class ConditionalGetMiddleware:
+    """Turns fetches of pages already in the pages table into conditional GETs.
+
+    The stored ETag and Last-Modified go out as If-None-Match and If-Modified-Since,
+    and all three stored validators (with the raw body hash) are left in
+    ``request.meta['stored_validators']`` so the spider can treat a 304, or a 200
+    with an identical body, as a touch instead of parsing the page again.
+
+    The validators of a whole frontier batch are read with one query when the batch
+    is claimed (``frontier_claimed``) and kept in an LRU until its requests go out;
+    only other requests, such as start requests, retries and redirects, are looked
+    up one at a time.
+    """
+
+    def __init__(self, db_name, stats=None, cache_size=10000):
+        self.db_name = db_name
+        self.stats = stats
+        self.conn = None
+        self.validators = BoundedLRU(cache_size)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('CONDITIONAL_GET_ENABLED', True):
+            raise NotConfigured
+        middleware = cls(settings.get('IMDB_DB_NAME', 'imdb_crawler.db'), crawler.stats)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(middleware.frontier_claimed, signal=frontier_claimed)
+        return middleware
+
+    def fetch_validators(self, url_hashes):
+        """{url_hash: (etag, last_modified, body_hash)} of the stored pages among ``url_hashes``."""
+        if self.conn is None:
+            if not os.path.exists(self.db_name):
+                return {}
+            # Read-only: the pipeline owns the writes to this database
+            self.conn = sqlite3.connect(f'file:{self.db_name}?mode=ro', uri=True, timeout=30)
+        found = {}
+        try:
+            for start in range(0, len(url_hashes), 500):
+                chunk = url_hashes[start:start + 500]
+                for url_hash, *row in self.conn.execute(
+                    f'SELECT url_hash, etag, last_modified, body_hash FROM pages WHERE url_hash IN ({",".join("?" * len(chunk))})',
+                    chunk
+                ):
+                    found[url_hash] = tuple(row)
+        except sqlite3.OperationalError:
+            # The pipeline has not created or migrated the pages table yet
+            return {}
+        return found
+
+    def frontier_claimed(self, url_hashes, spider):
+        found = self.fetch_validators(url_hashes)
+        for url_hash in url_hashes:
+            self.validators[url_hash] = found.get(url_hash)
+
+    def lookup(self, url):
+        url_hash = hashlib.md5(url.encode()).hexdigest()
+        if url_hash in self.validators:
+            return self.validators.pop(url_hash)
+        return self.fetch_validators([url_hash]).get(url_hash)
+
+    def process_request(self, request, spider):
+        row = self.lookup(request.url)
+        if row is None:
+            return None
+        etag, last_modified, body_hash = row
+        request.meta['stored_validators'] = {'etag': etag, 'last_modified': last_modified, 'body_hash': body_hash}
+        if etag:
+            request.headers.setdefault('If-None-Match', etag)
+        if last_modified:
+            request.headers.setdefault('If-Modified-Since', last_modified)
+        if self.stats is not None:
+            self.stats.inc_value('conditional/requests')
+        return None
+
+    def process_response(self, request, response, spider):
+        if response.status == 304 and self.stats is not None:
+            self.stats.inc_value('conditional/not_modified')
+        return response
+
+    def spider_closed(self, spider):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
@@ -6,8 +6,172 @@
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
-import json
+import sqlite3
+import time
+from scrapy import signals
+from twisted.internet import task
+
+from .checkpoint import before_checkpoint
+from .metrics import timed
+from .items import PageTouchItem
+from .shards import shard_path
+from .spiders.entity_store import ENTITY_COLUMNS
+from .spiders.freshness import DEFAULT_INTERVAL
+from .spiders.imdb_database import IMDBDatabase, PAGE_COLUMNS, TOUCH_COLUMNS
+
+# Sent after every flush that left nothing buffered, with the (url_hash, body_hash)
+# pairs committed since the last one as ``bodies``; the frontier then marks the
+# URLs handled so far as done
+pages_flushed = object()
+# Sent instead when a flush failed; what it did not commit stays buffered for the next one
+pages_flush_failed = object()
 
 class ImdbcrawlerPipeline:
+    """Buffers scraped pages and writes them over one long-lived SQLite connection.
+
+    Pages are flushed with executemany in a single transaction once the buffer
+    reaches IMDB_DB_BATCH_SIZE items or IMDB_DB_FLUSH_INTERVAL seconds have passed,
+    before every checkpoint, and when the spider closes. PageTouchItems (unchanged
+    re-fetches) are buffered alongside and only refresh date_time and the validators,
+    and the titles and people parsed from IMDb pages are upserted with each flush.
+    Each flush is followed by a ``pages_flushed`` signal, or, if the database
+    raised, by ``pages_flush_failed`` with the uncommitted rows put back in the buffers.
+    """
+
+    def __init__(self, db_name, batch_size, flush_interval, storage='raw', vector_model_dir=None, compact_interval=300, stats=None,
+                 revisit_intervals=(3600, DEFAULT_INTERVAL, 30 * 24 * 3600), vector_dedup=False):
+        self.db = IMDBDatabase(db_name, storage=storage, vector_model_dir=vector_model_dir, stats=stats,
+                               revisit_intervals=revisit_intervals, vector_dedup=vector_dedup)
+        self.stats = stats
+        self.compact_interval = compact_interval
+        self.compactor = None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.touches = []
+        self.entities = []
+        # Bodies of pages and touches committed since the last pages_flushed
+        self.bodies = []
+        self.last_flush = time.monotonic()
+        self.flush_loop = None
+        self.signals = None
+        self.spider = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        db_name = settings.get('IMDB_DB_NAME', 'imdb_crawler.db')
+        if settings.get('IMDB_DB_SHARD_DIR'):
+            # This worker's own shard, merged into IMDB_DB_NAME by imdbcrawler.shards
+            db_name = shard_path(settings.get('IMDB_DB_SHARD_DIR'), settings.getint('FRONTIER_WORKER_ID', 0))
+        pipeline = cls(
+            db_name,
+            settings.getint('IMDB_DB_BATCH_SIZE', 100),
+            settings.getfloat('IMDB_DB_FLUSH_INTERVAL', 5.0),
+            settings.get('IMDB_DB_STORAGE', 'raw'),
+            settings.get('IMDB_VECTOR_MODEL_DIR') or None,
+            settings.getfloat('IMDB_VECTOR_COMPACT_INTERVAL', 300),
+            crawler.stats,
+            (
+                settings.getfloat('REVISIT_MIN_INTERVAL', 3600),
+                settings.getfloat('REVISIT_INITIAL_INTERVAL', DEFAULT_INTERVAL),
+                settings.getfloat('REVISIT_MAX_INTERVAL', 30 * 24 * 3600),
+            ),
+            settings.getbool('IMDB_VECTOR_DEDUP', False),
+        )
+        pipeline.signals = crawler.signals
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(pipeline.checkpoint, signal=before_checkpoint)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.spider = spider
+        self.db.open()
+        if self.db.storage == 'blob':
+            spider.logger.warning("IMDB_DB_STORAGE='blob' keeps page text out of pages_fts; "
+                                  "imdbcrawler.search will only match these pages by title")
+        if self.db.vectors is not None:
+            from .spiders.vector_model import BackgroundCompactor
+
+            self.compactor = BackgroundCompactor(self.db.vectors, self.compact_interval)
+            self.compactor.start()
+        # Time-bounded flushes so a slow trickle of pages still reaches the database
+        self.flush_loop = task.LoopingCall(self.flush_if_stale)
+        self.flush_loop.start(self.flush_interval, now=False)
+
     def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        if isinstance(item, PageTouchItem):
+            self.touches.append(tuple(adapter.get(column) for column in TOUCH_COLUMNS))
+        else:
+            self.buffer.append(tuple(adapter.get(column) for column in PAGE_COLUMNS))
+            if adapter.get('imdb_id'):
+                self.entities.append(tuple(adapter.get(column) for column in ENTITY_COLUMNS))
+        if self.stats is not None:
+            self.stats.set_value('queue/pipeline_buffer', len(self.buffer) + len(self.touches))
+        if len(self.buffer) + len(self.touches) >= self.batch_size:
+            self.flush()
         return item
+
+    def flush_if_stale(self):
+        if (self.buffer or self.touches or self.entities) and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if self.db.conn is None:
+            return
+        if self.buffer or self.touches or self.entities:
+            pages, self.buffer = self.buffer, []
+            touches, self.touches = self.touches, []
+            entities, self.entities = self.entities, []
+            if self.stats is not None:
+                self.stats.set_value('queue/pipeline_buffer', 0)
+            counts = (len(pages), len(touches), len(entities))
+            try:
+                with timed(self.stats, 'db_flush'):
+                    # Each write is its own transaction; drop what has been committed
+                    if pages:
+                        stored = set(self.db.save_pages(pages))
+                        self.bodies += [(page[0], page[-1]) for page in pages if page[0] in stored and page[-1]]
+                        pages = []
+                    if touches:
+                        self.db.touch_pages(touches)
+                        self.bodies += [(touch[0], touch[-1]) for touch in touches if touch[-1]]
+                        touches = []
+                    if entities:
+                        self.db.save_entities(entities)
+                        entities = []
+            except sqlite3.Error:
+                self.spider.logger.exception(f'Flush to {self.db.db_name} failed; keeping the rows for the next one')
+                self.buffer[:0] = pages
+                self.touches[:0] = touches
+                self.entities[:0] = entities
+                if self.stats is not None:
+                    self.stats.inc_value('pages/flush_errors')
+                    self.stats.set_value('queue/pipeline_buffer', len(self.buffer) + len(self.touches))
+                if self.signals is not None:
+                    self.signals.send_catch_log(pages_flush_failed, spider=self.spider)
+                return
+            self.spider.logger.debug(
+                'Flushed {} pages, {} unchanged pages and {} entities to {}'.format(*counts, self.db.db_name)
+            )
+        bodies, self.bodies = self.bodies, []
+        if self.signals is not None:
+            self.signals.send_catch_log(pages_flushed, spider=self.spider, bodies=bodies)
+
+    def checkpoint(self, spider):
+        # Buffered pages must be in the database before the checkpoint is taken
+        self.flush()
+
+    def spider_closed(self, spider):
+        if self.flush_loop is not None and self.flush_loop.running:
+            self.flush_loop.stop()
+        self.flush()
+
+    def close_spider(self, spider):
+        self.spider_closed(spider)
+        if self.compactor is not None:
+            self.compactor.stop()
+            self.compactor.join()
+        self.db.close()
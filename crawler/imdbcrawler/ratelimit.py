@@ -0,0 +1,231 @@
+"""Per-host request budget shared by every worker process.
+
+DOWNLOAD_DELAY and AutoThrottle only pace the process they run in, so N workers
+send N times the intended rate to www.imdb.com. ``HostRateLimiter`` keeps one token
+bucket per host in a small SQLite table (RATE_LIMIT_DB) that all workers update
+under SQLite's write lock, as they already share the frontier: RATE_LIMIT_RPS is
+the fleet's rate for each host, with bursts of up to RATE_LIMIT_BURST requests.
+
+Buckets use the generic cell rate algorithm: a request never polls for a token but
+reserves the next free slot and is told how long to wait for it, so waiting
+requests cost nothing and start in the order they asked. A 429 or 503 multiplies
+the host's rate by RATE_LIMIT_BACKOFF and holds its requests for the Retry-After
+the server sent (or one slot at the new rate), capped at RATE_LIMIT_MAX_BACKOFF;
+each successful response then wins back RATE_LIMIT_RECOVERY of RATE_LIMIT_RPS.
+
+``RateLimitMiddleware`` sits after the HTTP cache, so cache hits spend no tokens,
+and records ``ratelimit/*`` stats. While it is enabled ImdbCrawler turns AutoThrottle
+off, whose per-process delay would only add to the bucket's.
+"""
+import asyncio
+import datetime
+import os
+import sqlite3
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+from .supervisor import THROTTLE_STATUSES
+
+
+def retry_after_seconds(value, now=None):
+    """Seconds from a Retry-After header (delta-seconds or an HTTP date), or None."""
+    if not value:
+        return None
+    value = value.decode('latin-1') if isinstance(value, bytes) else value
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, when.timestamp() - (time.time() if now is None else now))
+
+
+def rate_limit_enabled(settings):
+    """Whether RateLimitMiddleware paces the crawl under these settings."""
+    return settings.getbool('RATE_LIMIT_ENABLED', True) and settings.getfloat('RATE_LIMIT_RPS', 0.5) > 0
+
+
+class HostRateLimiter:
+    """Token buckets per host, in a SQLite table shared across processes."""
+
+    def __init__(self, db_name, rate=0.5, burst=1, backoff=0.5, recovery=0.02, max_backoff=300.0, min_rate=None):
+        self.db_name = db_name
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.backoff = backoff
+        self.recovery = recovery
+        self.max_backoff = max_backoff
+        self.min_rate = min_rate or rate / 64
+        self.conn = None
+
+    def open(self):
+        directory = os.path.dirname(self.db_name)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Transactions are managed explicitly, so BEGIN IMMEDIATE takes the write lock
+        self.conn = sqlite3.connect(self.db_name, timeout=30, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        # Losing the last few updates in a crash only resets some buckets
+        self.conn.execute('PRAGMA synchronous = OFF')
+        self.conn.execute('PRAGMA busy_timeout = 30000')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS host_buckets (
+                host TEXT PRIMARY KEY,
+                rate REAL,
+                next_slot REAL,
+                blocked_until REAL
+            )
+        ''')
+        return self
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _bucket(self, host, now):
+        row = self.conn.execute('SELECT rate, next_slot, blocked_until FROM host_buckets WHERE host = ?', (host,)).fetchone()
+        if row is None:
+            return self.rate, now, 0.0
+        rate, next_slot, blocked_until = row
+        # RATE_LIMIT_RPS may have been lowered since the bucket was stored
+        return min(rate, self.rate), next_slot, blocked_until
+
+    def _store(self, host, rate, next_slot, blocked_until):
+        self.conn.execute(
+            '''
+            INSERT INTO host_buckets (host, rate, next_slot, blocked_until) VALUES (?, ?, ?, ?)
+            ON CONFLICT (host) DO UPDATE SET rate = excluded.rate, next_slot = excluded.next_slot,
+                blocked_until = excluded.blocked_until
+            ''',
+            (host, rate, next_slot, blocked_until)
+        )
+
+    def acquire(self, host, now=None):
+        """Reserve the host's next request slot; returns (seconds to wait, current rate)."""
+        now = time.time() if now is None else now
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            rate, next_slot, blocked_until = self._bucket(host, now)
+            interval = 1.0 / rate
+            next_slot = max(next_slot, now)
+            # Up to burst - 1 slots may be taken ahead of their time, never during a backoff
+            start = max(next_slot - (self.burst - 1) * interval, now, blocked_until)
+            self._store(host, rate, max(next_slot, start) + interval, blocked_until)
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return start - now, rate
+
+    def penalize(self, host, retry_after=None, now=None):
+        """Back off after a 429/503; returns the host's new rate."""
+        now = time.time() if now is None else now
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            rate, next_slot, blocked_until = self._bucket(host, now)
+            if blocked_until <= now:
+                # The rest of a burst answered during the pause does not cut the rate again
+                rate = max(self.min_rate, rate * self.backoff)
+            pause = min(self.max_backoff, retry_after if retry_after is not None else 1.0 / rate)
+            blocked_until = max(blocked_until, now + pause)
+            self._store(host, rate, max(next_slot, blocked_until), blocked_until)
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return rate
+
+    def blocked_for(self, host, now=None):
+        """Seconds left of the host's current backoff, 0 if there is none."""
+        now = time.time() if now is None else now
+        row = self.conn.execute('SELECT blocked_until FROM host_buckets WHERE host = ?', (host,)).fetchone()
+        return max(0.0, row[0] - now) if row is not None else 0.0
+
+    def reward(self, host):
+        """Additive increase after a successful response, up to the configured rate."""
+        self.conn.execute(
+            'UPDATE host_buckets SET rate = MIN(?, rate + ?) WHERE host = ? AND rate < ?',
+            (self.rate, self.rate * self.recovery, host, self.rate)
+        )
+
+    def rates(self):
+        """{host: current rate} for every host seen so far."""
+        return dict(self.conn.execute('SELECT host, rate FROM host_buckets').fetchall())
+
+
+class RateLimitMiddleware:
+    """Delays each download until its host's shared bucket has a slot for it."""
+
+    def __init__(self, limiter, stats=None):
+        self.limiter = limiter
+        self.stats = stats
+        # Last rate seen per host, so full-rate hosts are not rewarded on every response
+        self.rates = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not rate_limit_enabled(settings):
+            raise NotConfigured
+        limiter = HostRateLimiter(
+            settings.get('RATE_LIMIT_DB', 'rate_limit.db'),
+            settings.getfloat('RATE_LIMIT_RPS', 0.5),
+            settings.getint('RATE_LIMIT_BURST', 1),
+            settings.getfloat('RATE_LIMIT_BACKOFF', 0.5),
+            settings.getfloat('RATE_LIMIT_RECOVERY', 0.02),
+            settings.getfloat('RATE_LIMIT_MAX_BACKOFF', 300),
+        )
+        middleware = cls(limiter.open(), crawler.stats)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    async def process_request(self, request, spider):
+        host = urlsplit(request.url).hostname or ''
+        delay, self.rates[host] = self.limiter.acquire(host)
+        if self.stats is not None:
+            self.stats.inc_value('ratelimit/requests')
+            if delay > 0:
+                self.stats.inc_value('ratelimit/delayed')
+                self.stats.inc_value('ratelimit/wait_seconds', delay)
+        while delay > 0:
+            # The asyncio reactor's loop, like the extraction pool's
+            await asyncio.sleep(delay)
+            # A slot reserved before a 429/503 is given up for one after the backoff
+            delay = 0.0
+            if self.limiter.blocked_for(host) > 0:
+                delay, self.rates[host] = self.limiter.acquire(host)
+                if self.stats is not None:
+                    self.stats.inc_value('ratelimit/wait_seconds', delay)
+        return None
+
+    def process_response(self, request, response, spider):
+        if 'cached' in response.flags:
+            return response
+        host = urlsplit(request.url).hostname or ''
+        if response.status in THROTTLE_STATUSES:
+            self.rates[host] = self.limiter.penalize(host, retry_after_seconds(response.headers.get('Retry-After')))
+            if self.stats is not None:
+                self.stats.inc_value('ratelimit/backoffs')
+                self.stats.set_value(f'ratelimit/rate/{host}', self.rates[host])
+        elif response.status < 400 and self.rates.get(host, self.limiter.rate) < self.limiter.rate:
+            self.limiter.reward(host)
+        return response
+
+    def spider_closed(self, spider):
+        self.limiter.close()
@@ -0,0 +1,268 @@
+"""Offline re-processing of crawled pages after a change to extraction or dedup.
+
+Usage: python -m imdbcrawler.reprocess --out reprocessed.db [--source cache|pages]
+                                       [--cache-dir .scrapy/httpcache/imdb_crawler] [--db imdb_crawler.db]
+                                       [--threshold 0.9] [--storage raw|blob] [--vector-model-dir DIR [--vector-dedup]]
+                                       [--workers N] [--chunk-size 500] [--state reprocess_state.json] [--full]
+
+Rebuilds a pages database into --out without fetching anything:
+
+- ``--source cache`` reads the raw responses the spider left in its Scrapy HTTP cache
+  (FilesystemCacheStorage, HTTPCACHE_GZIP or not) and runs each one through the
+  current extract_page and page_item, exactly as the spider would, so changes to
+  text, link or entity extraction and to the dedup threshold all apply.
+- ``--source pages`` reads the text already stored in --db and only re-runs dedup,
+  since the pages table keeps the extracted text, not the HTML.
+
+Parsing and MinHash signatures, the CPU-bound part, run in a pool of --workers
+processes, one --chunk-size chunk ahead of the writer; the main process writes each
+chunk with IMDBDatabase.save_pages (near-duplicate checks at --threshold, executemany
+inserts) and then saves its position to --state. An interrupted run picks up after
+the last written chunk: cache entries are read in (mtime, fingerprint) order and
+pages in commit-sequence order, so a later run also catches up on entries
+written or rewritten since.
+"""
+import argparse
+import datetime
+import gzip
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from urllib.parse import urlsplit
+
+from .export import load_watermark, save_watermark
+from .extraction import default_parser, extract_page
+from .spiders.entity_store import ENTITY_COLUMNS
+from .spiders.imdb_database import IMDBDatabase, PAGE_COLUMNS
+from .spiders.near_duplicates import NearDuplicateIndex
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def cache_entry_path(cache_dir, fingerprint):
+    return os.path.join(cache_dir, fingerprint[:2], fingerprint)
+
+
+def cache_entries(cache_dir, after=None):
+    """(mtime, fingerprint) of every cached response after ``after``, oldest first."""
+    after = tuple(after) if after else (0.0, '')
+    entries = []
+    for prefix in os.scandir(cache_dir) if os.path.isdir(cache_dir) else ():
+        if not prefix.is_dir():
+            continue
+        for entry in os.scandir(prefix.path):
+            try:
+                mtime = os.stat(os.path.join(entry.path, 'pickled_meta')).st_mtime
+            except OSError:
+                # Not a cache entry, or one still being written
+                continue
+            if (mtime, entry.name) > after:
+                entries.append((mtime, entry.name))
+    entries.sort()
+    return entries
+
+
+def _read(path, gzipped):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return gzip.decompress(data) if gzipped else data
+
+
+def cached_response(path):
+    """The response stored in a cache entry, decoded as HttpCompressionMiddleware would."""
+    from scrapy.downloadermiddlewares.httpcompression import HttpCompressionMiddleware
+    from scrapy.http import Headers, Request
+    from scrapy.responsetypes import responsetypes
+    from w3lib.http import headers_raw_to_dict
+
+    with open(os.path.join(path, 'pickled_meta'), 'rb') as f:
+        # HTTPCACHE_GZIP compresses every file of the entry; a pickle never starts like gzip
+        gzipped = f.read(2) == GZIP_MAGIC
+    metadata = pickle.loads(_read(os.path.join(path, 'pickled_meta'), gzipped))
+    body = _read(os.path.join(path, 'response_body'), gzipped)
+    headers = Headers(headers_raw_to_dict(_read(os.path.join(path, 'response_headers'), gzipped)))
+    url = metadata.get('response_url') or metadata['url']
+    respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+    request = Request(metadata['url'], method=metadata.get('method', 'GET'))
+    response = respcls(url=url, headers=headers, status=metadata['status'], body=body, request=request)
+    # The cache sits before decompression in the downloader chain
+    return HttpCompressionMiddleware().process_response(request, response, None), metadata['timestamp']
+
+
+@lru_cache(maxsize=None)
+def _near_duplicates(num_perm):
+    # Signatures need no connection, only the same parameters as the writer's index
+    return NearDuplicateIndex(None, num_perm=num_perm)
+
+
+def process_cached(entry, cache_dir, parser, num_perm):
+    """Worker: (page row, entity row or None, signature) for a cache entry, or None to skip it."""
+    from itemadapter import ItemAdapter
+    from scrapy.http import TextResponse
+
+    from .spiders.ImdbCrawler import page_item
+
+    path = cache_entry_path(cache_dir, entry[1])
+    try:
+        response, timestamp = cached_response(path)
+        # robots.txt is cached too, but never reaches the spider
+        if response.status != 200 or not isinstance(response, TextResponse) or urlsplit(response.url).path == '/robots.txt':
+            return None
+        extracted = extract_page(response.body, response.encoding, parser, response.url)
+        date_time = datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+        item = ItemAdapter(page_item(response, extracted, date_time))
+    except Exception as e:
+        print(f"Skipping cache entry {path}: {e}", file=sys.stderr)
+        return None
+    page = tuple(item.get(column) for column in PAGE_COLUMNS)
+    entity = tuple(item.get(column) for column in ENTITY_COLUMNS) if item.get('imdb_id') else None
+    return page, entity, _near_duplicates(num_perm).signature(extracted['text'])
+
+
+def process_stored(page, num_perm):
+    """Worker: (page row, None, signature) for a stored page."""
+    return page, None, _near_duplicates(num_perm).signature(page[PAGE_COLUMNS.index('html')] or '')
+
+
+def _chunks(values, size):
+    chunk = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Reprocessor:
+    """Re-runs extraction and/or dedup over a stream of inputs into one pages database."""
+
+    def __init__(self, out, threshold=0.9, storage='raw', vector_model_dir=None, workers=None, chunk_size=500,
+                 parser=None, state_path=None, vector_dedup=False):
+        self.db = IMDBDatabase(out, similarity_threshold=threshold, storage=storage, vector_model_dir=vector_model_dir,
+                               vector_dedup=vector_dedup)
+        self.workers = os.cpu_count() if workers is None else workers
+        self.chunk_size = chunk_size
+        self.parser = parser or default_parser()
+        self.state_path = state_path
+        self.counters = {'read': 0, 'skipped': 0, 'stored': 0}
+
+    def _mapped(self, function, chunks):
+        """Yield (chunk, results), with the next chunk already running in the pool."""
+        if self.workers == 0:
+            for chunk in chunks:
+                yield chunk, map(function, chunk)
+            return
+        with ProcessPoolExecutor(self.workers) as executor:
+            previous = None
+            for chunk in chunks:
+                # map() on a bounded chunk submits it all now; its results are read later
+                results = executor.map(function, chunk, chunksize=max(1, len(chunk) // (self.workers * 4)))
+                if previous is not None:
+                    yield previous
+                previous = chunk, results
+            if previous is not None:
+                yield previous
+
+    def _write(self, results, state):
+        pages = []
+        entities = []
+        signatures = {}
+        for result in results:
+            self.counters['read'] += 1
+            if result is None:
+                self.counters['skipped'] += 1
+                continue
+            page, entity, signature = result
+            pages.append(page)
+            signatures[page[0]] = signature
+            if entity is not None:
+                entities.append(entity)
+        if pages:
+            self.db.save_pages(pages, signatures)
+        if entities:
+            self.db.save_entities(entities)
+        if self.state_path:
+            save_watermark(self.state_path, state)
+
+    def run(self, function, inputs, position):
+        """Process ``inputs`` in chunks; ``position(chunk)`` is the state saved once a chunk is written."""
+        num_perm = self.db.near_duplicates.num_perm
+        start = time.perf_counter()
+        for chunk, results in self._mapped(partial(function, num_perm=num_perm), _chunks(inputs, self.chunk_size)):
+            self._write(results, position(chunk))
+            elapsed = time.perf_counter() - start
+            print(f"Reprocessed {self.counters['read']} pages ({self.counters['read'] / elapsed:.0f}/s).", file=sys.stderr)
+        # Near-duplicates of stored pages overwrite them rather than adding rows
+        self.counters['stored'] = self.db.cursor.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+        return self.counters
+
+    def from_cache(self, cache_dir, state=None):
+        after = (state['mtime'], state['fingerprint']) if state else None
+        with self.db:
+            return self.run(
+                partial(process_cached, cache_dir=cache_dir, parser=self.parser),
+                cache_entries(cache_dir, after),
+                lambda chunk: {'source': 'cache', 'mtime': chunk[-1][0], 'fingerprint': chunk[-1][1]},
+            )
+
+    def from_pages(self, db_name, state=None):
+        state = state or {}
+        source = IMDBDatabase(db_name).open(readonly=True)
+        seqs = {}
+
+        def pages():
+            for seq, page in source.iter_pages(self.chunk_size, state.get('seq', 0)):
+                seqs[page[0]] = seq
+                yield page
+
+        def position(chunk):
+            return {'source': 'pages', 'seq': [seqs.pop(page[0]) for page in chunk][-1]}
+
+        try:
+            with self.db:
+                return self.run(process_stored, pages(), position)
+        finally:
+            source.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--out', required=True, help="database to write the re-processed pages to")
+    parser.add_argument('--source', choices=('cache', 'pages'), default='cache')
+    parser.add_argument('--cache-dir', default=os.path.join('.scrapy', 'httpcache', 'imdb_crawler'))
+    parser.add_argument('--db', default='imdb_crawler.db', help="pages database read by --source pages")
+    parser.add_argument('--threshold', type=float, default=0.9, help="near-duplicate similarity threshold")
+    parser.add_argument('--storage', choices=('raw', 'blob'), default='raw')
+    parser.add_argument('--vector-model-dir', default=None, help="also build a TF-IDF model there")
+    parser.add_argument('--vector-dedup', action='store_true', help="dedup with the TF-IDF model instead of MinHash")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="processes (0 runs inline)")
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--state', default='reprocess_state.json', help="checkpoint file")
+    parser.add_argument('--full', action='store_true', help="ignore the checkpoint and start from the beginning")
+    args = parser.parse_args()
+
+    if args.source == 'pages' and os.path.abspath(args.db) == os.path.abspath(args.out):
+        parser.error("--out must differ from --db")
+    if args.vector_dedup and not args.vector_model_dir:
+        parser.error("--vector-dedup needs --vector-model-dir")
+    state = None if args.full else load_watermark(args.state)
+    if state is not None and state.get('source') != args.source:
+        parser.error(f"{args.state} checkpoints a --source {state.get('source')} run; pass --full to start over")
+
+    reprocessor = Reprocessor(args.out, args.threshold, args.storage, args.vector_model_dir, args.workers,
+                              args.chunk_size, state_path=args.state, vector_dedup=args.vector_dedup)
+    if args.source == 'cache':
+        counters = reprocessor.from_cache(args.cache_dir, state)
+    else:
+        counters = reprocessor.from_pages(args.db, state)
+    print(f"Read {counters['read']} pages, skipped {counters['skipped']}; {args.out} holds {counters['stored']} pages.",
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
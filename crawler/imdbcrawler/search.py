@@ -0,0 +1,232 @@
+"""Full-text search over the crawled pages, served over HTTP with asyncio.
+
+Usage: python -m imdbcrawler.search [--db imdb_crawler.db] [--host 127.0.0.1] [--port 8081]
+                                    [--pool-size 4] [--cache-size 1024]
+
+Queries run against the pages_fts index (see imdbcrawler.spiders.search_index),
+which triggers on ``pages`` keep current while the crawl writes, so new pages are
+searchable as soon as a pipeline flush commits them. Each query borrows one of
+--pool-size read-only connections and runs on a worker thread, so slow queries
+never block the event loop. Results are cached in an LRU that is dropped whenever
+the index generation moves, i.e. after any write to the pages.
+
+Endpoints:
+
+- GET /search?q=...&limit=20&offset=0: JSON hits with url, title, snippet and score
+- GET /query?q=...: the Lucene Controller's text format, for the existing frontend
+- GET /stats: cache and pool counters
+"""
+import argparse
+import asyncio
+import html
+import json
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qs, urlsplit
+
+from .sketches import BoundedLRU
+from .spiders.imdb_database import IMDBDatabase
+from .spiders.search_index import FullTextIndex
+
+MAX_LIMIT = 100
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class ConnectionPool:
+    """Fixed set of read-only SQLite connections, lent out one query at a time."""
+
+    def __init__(self, db_name, size=4):
+        self.db_name = db_name
+        self.size = size
+        self.executor = ThreadPoolExecutor(size, thread_name_prefix='search')
+        self._idle = None
+        self._connections = []
+
+    def _connect(self):
+        # Borrowed by whichever executor thread runs the query
+        conn = sqlite3.connect(f'file:{self.db_name}?mode=ro', uri=True, timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA busy_timeout = 30000')
+        return conn
+
+    @asynccontextmanager
+    async def connection(self):
+        if self._idle is None:
+            # Created lazily so it binds to the running event loop
+            self._idle = asyncio.LifoQueue()
+            for _ in range(self.size):
+                conn = self._connect()
+                self._connections.append(conn)
+                self._idle.put_nowait(conn)
+        conn = await self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put_nowait(conn)
+
+    async def run(self, function, *args):
+        """Run ``function(conn, *args)`` on a pooled connection in the executor."""
+        async with self.connection() as conn:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function, conn, *args)
+
+    @property
+    def idle(self):
+        return self._idle.qsize() if self._idle is not None else self.size
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for conn in self._connections:
+            conn.close()
+        self._connections = []
+
+
+def _generation(conn):
+    return FullTextIndex(conn).generation()
+
+
+def _search(conn, query, limit, offset):
+    return FullTextIndex(conn).search(query, limit, offset)
+
+
+class SearchService:
+    """BM25 search with an LRU of recent results, invalidated by index writes."""
+
+    def __init__(self, db_name, pool_size=4, cache_size=1024):
+        self.pool = ConnectionPool(db_name, pool_size)
+        self.cache = BoundedLRU(cache_size)
+        self.generation = None
+        self.counters = {'queries': 0, 'cache_hits': 0, 'invalidations': 0}
+
+    async def search(self, query, limit=20, offset=0):
+        self.counters['queries'] += 1
+        generation = await self.pool.run(_generation)
+        if generation != self.generation:
+            if self.cache:
+                self.counters['invalidations'] += 1
+            self.cache.clear()
+            self.generation = generation
+        key = (query, limit, offset)
+        if key in self.cache:
+            self.counters['cache_hits'] += 1
+            return self.cache[key]
+        rows = await self.pool.run(_search, query, limit, offset)
+        hits = [
+            {'url': url, 'title': title, 'snippet': snippet, 'score': round(-score, 4)}
+            for url, title, snippet, score in rows
+        ]
+        # Only cache results still current, not ones that raced with a write
+        if self.generation == generation:
+            self.cache[key] = hits
+        return hits
+
+    def stats(self):
+        return {
+            **self.counters,
+            'cached_results': len(self.cache),
+            'generation': self.generation,
+            'idle_connections': self.pool.idle,
+        }
+
+    def close(self):
+        self.pool.close()
+
+
+def lucene_format(hits):
+    """Hits in the text format of the Java Queryer, which the Next.js frontend parses."""
+    lines = [f"<b>FOUND {len(hits)} HITS:</b><br>"]
+    for hit in hits:
+        content = html.unescape(hit['snippet'].replace('<b>', '').replace('</b>', ''))
+        lines.append(f"URL: {hit['url']}<br>Title: {hit['title']}<br>Content: {content}<br><br>")
+    return ''.join(lines)
+
+
+class SearchServer:
+    """Minimal HTTP/1.1 front end for a SearchService; one request per connection."""
+
+    def __init__(self, service, host='127.0.0.1', port=8081):
+        self.service = service
+        self.host = host
+        self.port = port
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            # The headers are not needed, only consumed
+            while (await reader.readline()).strip():
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2:
+                status, content_type, body = 400, 'text/plain', 'Malformed request'
+            elif parts[0] != 'GET':
+                status, content_type, body = 405, 'text/plain', 'Only GET is supported'
+            else:
+                status, content_type, body = await self.route(parts[1])
+        except Exception as e:
+            status, content_type, body = 500, 'text/plain', f'Error: {e}'
+        payload = body.encode('utf-8')
+        writer.write(
+            f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+            f'Content-Type: {content_type}; charset=utf-8\r\n'
+            f'Content-Length: {len(payload)}\r\n'
+            'Access-Control-Allow-Origin: *\r\n'
+            'Connection: close\r\n\r\n'.encode('latin-1') + payload
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def route(self, target):
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+        if url.path == '/stats':
+            return 200, 'application/json', json.dumps(self.service.stats())
+        if url.path not in ('/search', '/query'):
+            return 404, 'text/plain', 'Not found'
+        query = params.get('q', [''])[0]
+        if not query.strip():
+            return 400, 'text/plain', 'Missing q parameter'
+        try:
+            limit = min(MAX_LIMIT, max(1, int(params.get('limit', ['20'])[0])))
+            offset = max(0, int(params.get('offset', ['0'])[0]))
+        except ValueError:
+            return 400, 'text/plain', 'limit and offset must be integers'
+        hits = await self.service.search(query, limit, offset)
+        if url.path == '/query':
+            return 200, 'text/html', lucene_format(hits)
+        return 200, 'application/json', json.dumps({'query': query, 'offset': offset, 'hits': hits})
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        print(f"Serving search on http://{self.host}:{self.port}/search?q=...", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default='imdb_crawler.db')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--pool-size', type=int, default=4, help="read-only connections (and query threads)")
+    parser.add_argument('--cache-size', type=int, default=1024, help="cached result pages")
+    args = parser.parse_args()
+
+    # Creates pages_fts and its triggers (and indexes existing pages) if the crawl has not yet
+    with IMDBDatabase(args.db) as db:
+        title_only = db.search.title_only_pages()
+    if title_only:
+        print(f"warning: {title_only} pages were stored with IMDB_DB_STORAGE='blob' and are only "
+              "searchable by title", file=sys.stderr)
+    service = SearchService(args.db, args.pool_size, args.cache_size)
+    try:
+        asyncio.run(SearchServer(service, args.host, args.port).serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""Seed URL discovery for main.py without a browser.
+
+Seeds come, in order of preference, from URLs the previous run left pending in the
+frontier, from a cached seed list younger than the TTL, from the sitemaps listed in
+robots.txt (or /sitemap.xml), and finally from the anchors of the root page parsed
+with lxml. Seeds are then picked across URL-prefix clusters (/title, /name,
+/chart, ...) so every worker starts in a different region of the site.
+"""
+import json
+import os
+import random
+import sqlite3
+import time
+from collections import defaultdict
+from urllib.parse import urldefrag, urljoin, urlsplit
+
+import lxml.html
+import requests
+from protego import Protego
+from scrapy.utils.gz import gunzip
+from scrapy.utils.sitemap import Sitemap
+
+from .frontier import DONE
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+
+def is_valid_url(url, allowed_domain):
+    """Check if the URL belongs to the allowed domain."""
+    parts = urlsplit(url)
+    return parts.scheme in ('http', 'https') and allowed_domain in parts.netloc
+
+
+def prefix_key(url, depth=1):
+    """Cluster key of a URL: its host plus the first ``depth`` path segments."""
+    parts = urlsplit(url)
+    segments = [segment for segment in parts.path.split('/') if segment][:depth]
+    return parts.netloc + '/' + '/'.join(segments)
+
+
+def spread_across_prefixes(urls, size, rng=None, depth=1):
+    """Pick ``size`` URLs round-robin over prefix clusters, largest cluster first.
+
+    Each cluster contributes one URL per round, so with at least ``size`` clusters
+    every seed lands in a different region of the site.
+    """
+    rng = rng or random.Random(42)
+    clusters = defaultdict(list)
+    for url in urls:
+        clusters[prefix_key(url, depth)].append(url)
+    queues = []
+    for key in sorted(clusters, key=lambda key: (-len(clusters[key]), key)):
+        members = clusters[key]
+        rng.shuffle(members)
+        queues.append(members)
+
+    seeds = []
+    while queues and len(seeds) < size:
+        for members in queues:
+            if len(seeds) >= size:
+                break
+            seeds.append(members.pop())
+        queues = [members for members in queues if members]
+    return seeds
+
+
+def pending_urls(frontier_db, db_name=None):
+    """URLs the previous run had queued but not fetched, minus pages already stored."""
+    if not os.path.exists(frontier_db):
+        return []
+    conn = sqlite3.connect(frontier_db, timeout=30)
+    try:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'frontier'").fetchone():
+            return []
+        query = 'SELECT url FROM frontier WHERE state != ?'
+        if db_name and os.path.exists(db_name):
+            conn.execute('ATTACH DATABASE ? AS store', (db_name,))
+            if conn.execute("SELECT 1 FROM store.sqlite_master WHERE type = 'table' AND name = 'pages'").fetchone():
+                query += ' AND url_hash NOT IN (SELECT url_hash FROM store.pages)'
+        return [url for (url,) in conn.execute(query + ' ORDER BY priority DESC, added_at', (DONE,))]
+    finally:
+        conn.close()
+
+
+class SeedGenerator:
+    """Finds seed URLs for a site over plain HTTP and caches them on disk.
+
+    The cache is a JSON file keyed by root URL; entries older than ``ttl`` seconds
+    are rediscovered. ``max_urls`` caps how many sitemap URLs are read.
+    """
+
+    def __init__(self, root_url, cache_path="seeds_cache.json", ttl=24 * 3600, max_urls=50000, timeout=10, session=None):
+        self.root_url = root_url
+        self.allowed_domain = urlsplit(root_url).netloc
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.max_urls = max_urls
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        self.session.headers.setdefault('User-Agent', USER_AGENT)
+        self.robots = None
+
+    def fetch(self, url):
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException as e:
+            print(f"An error occurred while fetching {url}: {e}")
+            return None
+        if response.status_code != 200:
+            print(f"Failed to access {url}, response code: {response.status_code}")
+            return None
+        return response
+
+    def load_robots(self):
+        response = self.fetch(urljoin(self.root_url, '/robots.txt'))
+        self.robots = Protego.parse(response.text if response is not None else '')
+        return self.robots
+
+    def allowed(self, url):
+        if not is_valid_url(url, self.allowed_domain):
+            return False
+        return self.robots is None or self.robots.can_fetch(url, USER_AGENT)
+
+    def sitemap_urls(self):
+        """Page URLs from the sitemaps in robots.txt (or /sitemap.xml), following indexes."""
+        to_visit = list(self.robots.sitemaps) if self.robots is not None else []
+        if not to_visit:
+            to_visit = [urljoin(self.root_url, '/sitemap.xml')]
+        seen = set()
+        urls = []
+        while to_visit and len(urls) < self.max_urls:
+            sitemap_url = to_visit.pop(0)
+            if sitemap_url in seen:
+                continue
+            seen.add(sitemap_url)
+            response = self.fetch(sitemap_url)
+            if response is None:
+                continue
+            body = response.content
+            if body[:2] == b'\x1f\x8b':
+                body = gunzip(body)
+            try:
+                sitemap = Sitemap(body)
+            except Exception as e:
+                print(f"Could not parse sitemap {sitemap_url}: {e}")
+                continue
+            for entry in sitemap:
+                loc = entry.get('loc')
+                if not loc:
+                    continue
+                if sitemap.type == 'sitemapindex':
+                    to_visit.append(loc)
+                else:
+                    urls.append(loc)
+                    if len(urls) >= self.max_urls:
+                        break
+        return urls
+
+    def root_links(self):
+        """Same-site anchors of the root page, parsed with lxml."""
+        response = self.fetch(self.root_url)
+        if response is None or not response.content.strip():
+            return []
+        doc = lxml.html.document_fromstring(response.content, base_url=response.url)
+        doc.make_links_absolute(response.url)
+        return [link for element, attribute, link, _ in doc.iterlinks() if element.tag == 'a' and attribute == 'href']
+
+    def discover(self):
+        self.load_robots()
+        urls = self.sitemap_urls() or self.root_links()
+        seen = set()
+        seeds = []
+        for url in urls:
+            url = urldefrag(url.strip())[0]
+            if url not in seen and self.allowed(url):
+                seen.add(url)
+                seeds.append(url)
+        return seeds
+
+    def load_cache(self):
+        if not os.path.exists(self.cache_path):
+            return None
+        try:
+            with open(self.cache_path, encoding='utf-8') as f:
+                entry = json.load(f).get(self.root_url)
+        except ValueError:
+            return None
+        if entry is None or time.time() - entry['fetched_at'] > self.ttl:
+            return None
+        return entry['urls']
+
+    def save_cache(self, urls):
+        cache = {}
+        if os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, encoding='utf-8') as f:
+                    cache = json.load(f)
+            except ValueError:
+                cache = {}
+        cache[self.root_url] = {'fetched_at': time.time(), 'urls': urls}
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def candidates(self, refresh=False):
+        urls = None if refresh else self.load_cache()
+        if urls is None:
+            urls = self.discover()
+            if urls:
+                self.save_cache(urls)
+        return urls
+
+    def seeds(self, size, pending=None, rng=None):
+        """Return up to ``size`` seeds, preferring ``pending`` URLs left by a previous run."""
+        urls = [url for url in pending or () if is_valid_url(url, self.allowed_domain)]
+        if urls:
+            print(f"Resuming from {len(urls)} pending URLs.")
+        else:
+            urls = self.candidates()
+        return spread_across_prefixes(urls, size, rng)
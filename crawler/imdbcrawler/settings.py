@@ -26,10 +26,10 @@ ROBOTSTXT_OBEY = True
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
 # CONCURRENT_REQUESTS = 16
 
-# Configure a delay for requests for the same website (default: 0)
+# Requests to the same website are paced by RateLimitMiddleware (RATE_LIMIT_RPS below)
+# for the whole fleet rather than by a per-process DOWNLOAD_DELAY
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
-# See also autothrottle settings and docs
-DOWNLOAD_DELAY = 2
+# DOWNLOAD_DELAY = 0
 
 # LOG_FILE = None
 
@@ -73,7 +73,105 @@ DOWNLOAD_DELAY = 2
 #     "imdbcrawler.pipelines.OverWriteFilePipeline": 1,
 # }
 
-# Enable and configure the AutoThrottle extension (disabled by default)
+# SQLite page store used by ImdbcrawlerPipeline. Pages are buffered and written in
+# one transaction per IMDB_DB_BATCH_SIZE items or IMDB_DB_FLUSH_INTERVAL seconds
+IMDB_DB_NAME = "imdb_crawler.db"
+IMDB_DB_BATCH_SIZE = 100
+IMDB_DB_FLUSH_INTERVAL = 5.0
+# "raw" keeps text in pages.html; "blob" stores it compressed and content-addressed
+# in the blobs table (zstd if installed, else zlib) with a trained shared dictionary;
+# blob pages are only searchable by title in imdbcrawler.search
+IMDB_DB_STORAGE = "raw"
+# With IMDB_DB_SHARD_DIR set each worker writes to its own worker-<id>.db there, and
+# main.py --shards merges them into IMDB_DB_NAME in the background (imdbcrawler.shards)
+# IMDB_DB_SHARD_DIR = "crawls/shards"
+# Shared on-disk TF-IDF model (memory-mapped .npy arrays plus an append-only delta),
+# compacted in the background with refreshed IDF every IMDB_VECTOR_COMPACT_INTERVAL seconds
+IMDB_VECTOR_MODEL_DIR = "vector_model"
+IMDB_VECTOR_COMPACT_INTERVAL = 300
+# Near-duplicate checks use MinHash; IMDB_VECTOR_DEDUP = True switches them to the
+# model's cosine similarity (needs IMDB_VECTOR_MODEL_DIR)
+IMDB_VECTOR_DEDUP = False
+
+# HTML parsing runs in a process pool (see imdbcrawler.extraction). EXTRACTION_WORKERS
+# defaults to the CPU count (0 parses inline), EXTRACTION_MAX_PENDING bounds how many
+# pages may be queued for parsing, and EXTRACTION_PARSER defaults to lxml if installed
+# EXTRACTION_WORKERS = 4
+# EXTRACTION_MAX_PENDING = 8
+# EXTRACTION_PARSER = "lxml"
+
+# Shared crawl frontier (imdbcrawler.frontier). main.py assigns each worker its
+# FRONTIER_WORKER_ID; URL hashes are split into FRONTIER_PARTITIONS partitions.
+# Claims are leases: a worker that has not renewed them for FRONTIER_LEASE_TIMEOUT
+# seconds counts as dead, its claimed URLs are queued again and idle workers stop
+# waiting for its partitions
+FRONTIER_DB = "frontier.db"
+FRONTIER_PARTITIONS = 64
+FRONTIER_BATCH_SIZE = 32
+FRONTIER_LEASE_TIMEOUT = 300
+# FRONTIER_WORKER_ID = 0
+
+# SpiderTrapMiddleware keeps its content Bloom filter and URL counters in mmap'd
+# files under SPIDERTRAP_STATE_DIR/worker-<id> so they survive restarts (in memory if unset)
+# SPIDERTRAP_STATE_DIR = "crawls/spidertrap"
+# SPIDERTRAP_EXPECTED_PAGES = 100000
+
+# PriorityMiddleware compiles keywords.json once and reloads it when it changes.
+# Set PRIORITY_LOG_MATCHES to log every keyword hit at debug level
+PRIORITY_KEYWORDS_FILE = "keywords.json"
+PRIORITY_LOG_MATCHES = False
+# PRIORITY_KEYWORDS_RELOAD_INTERVAL = 30
+# PRIORITY_CACHE_SIZE = 100000
+
+# imdbcrawler.metrics.CrawlMetrics records per-stage timings and queue depths in the
+# stats and appends a snapshot to METRICS_DIR/worker-<id>.jsonl every METRICS_INTERVAL
+# seconds; with METRICS_PORT set the latest one is served on 127.0.0.1:<port>/metrics
+METRICS_ENABLED = True
+METRICS_DIR = "metrics"
+METRICS_INTERVAL = 10
+# METRICS_PORT = 9410
+
+# Every CHECKPOINT_INTERVAL seconds each worker flushes its buffers and sketches and
+# writes CHECKPOINT_DIR/worker-<id>.ckpt; main.py --resume restarts from there
+# CHECKPOINT_DIR = "crawls/checkpoints"
+# CHECKPOINT_INTERVAL = 60
+
+# ConditionalGetMiddleware sends the stored ETag/Last-Modified of already-crawled pages;
+# 304s and identical bodies only refresh date_time. Each page's next visit (see
+# main.py --recrawl) follows its observed change rate, clamped to these bounds in seconds
+CONDITIONAL_GET_ENABLED = True
+# REVISIT_MIN_INTERVAL = 3600
+# REVISIT_INITIAL_INTERVAL = 86400
+# REVISIT_MAX_INTERVAL = 2592000
+
+# Response bodies whose digest matches a stored page skip parsing and storage; the
+# digests of this worker's recent pages are cached in memory (fastpath/* stats)
+# BODY_DIGEST_CACHE_SIZE = 100000
+
+# parse_page keeps the canonical URLs of the links it emitted recently in an LRU of
+# this size and skips them when other pages link to them again
+# LINK_CACHE_SIZE = 200000
+
+# RateLimitMiddleware (imdbcrawler.ratelimit) paces requests to each host with a token
+# bucket in RATE_LIMIT_DB that every worker shares, so RATE_LIMIT_RPS is the rate of
+# the whole fleet, not of each worker. A 429/503 cuts the host's rate by
+# RATE_LIMIT_BACKOFF and pauses it for Retry-After (at most RATE_LIMIT_MAX_BACKOFF
+# seconds); every successful response wins back RATE_LIMIT_RECOVERY of RATE_LIMIT_RPS
+RATE_LIMIT_ENABLED = True
+RATE_LIMIT_DB = "rate_limit.db"
+RATE_LIMIT_RPS = 0.5
+# RATE_LIMIT_BURST = 1
+# RATE_LIMIT_BACKOFF = 0.5
+# RATE_LIMIT_RECOVERY = 0.02
+# RATE_LIMIT_MAX_BACKOFF = 300
+
+# Set by main.py --supervise: workers poll this file for the per-domain concurrency
+# and download delay chosen by imdbcrawler.supervisor
+# SUPERVISOR_CONTROL_FILE = "metrics/control.json"
+# SUPERVISOR_CONTROL_INTERVAL = 2
+
+# Enable and configure the AutoThrottle extension (disabled by default); ImdbCrawler
+# enables it, but only while RATE_LIMIT_ENABLED is off
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 # AUTOTHROTTLE_ENABLED = True
 # AUTOTHROTTLE_START_DELAY = 1
@@ -0,0 +1,292 @@
+"""Per-worker page shards and their merge into the canonical pages database.
+
+Usage: python -m imdbcrawler.shards [--db imdb_crawler.db] [--shard-dir crawls/shards]
+                                    [--storage raw|blob] [--chunk-size 500]
+
+With IMDB_DB_SHARD_DIR set, each worker's pipeline writes to its own
+``worker-<id>.db`` there instead of the shared IMDB_DB_NAME, so the workers never
+wait on one another's write lock. ``ShardMerger`` folds the shards into the
+canonical database: pages (with their revisit counters and parsed entities) are
+read in the shard's commit-sequence order after a per-shard watermark, which also
+picks up rows a worker rewrote or touched since the last pass. Conflicts on
+url_hash or html_hash keep the page with the newest date_time, and, as in
+save_pages, a page under a new url_hash whose MinHash signature marks it as a
+near-duplicate of a stored or already merged page is left out. Each chunk and its watermark
+are committed together, so an interrupted merge resumes where it stopped, and
+main.py --shards runs one every few seconds in a MergeThread while the crawl is
+on.
+
+Readers of the canonical database (conditional GETs, the fast path, search) see a
+worker's pages once they are merged.
+"""
+import argparse
+import glob
+import os
+import sqlite3
+import sys
+import threading
+from array import array
+
+from .spiders.entity_store import ENTITY_COLUMNS
+from .spiders.imdb_database import IMDBDatabase, PAGE_COLUMNS
+
+URL_HASH = PAGE_COLUMNS.index('url_hash')
+DATE_TIME = PAGE_COLUMNS.index('date_time')
+HTML = PAGE_COLUMNS.index('html')
+HTML_HASH = PAGE_COLUMNS.index('html_hash')
+REVISIT_COLUMNS = ('url_hash', 'url', 'first_seen', 'last_checked', 'checks', 'changes', 'interval', 'next_visit')
+
+
+def shard_path(shard_dir, worker_id):
+    os.makedirs(shard_dir, exist_ok=True)
+    return os.path.join(shard_dir, f'worker-{worker_id}.db')
+
+
+def _chunks(values, size=500):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _placeholders(values):
+    return ','.join('?' * len(values))
+
+
+class ShardMerger:
+    """Incrementally merges every shard in ``shard_dir`` into the canonical database."""
+
+    def __init__(self, db_name, shard_dir, storage='raw', chunk_size=500):
+        self.db = IMDBDatabase(db_name, storage=storage)
+        self.shard_dir = shard_dir
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+
+    def _create_table(self):
+        self.db.conn.execute('''
+            CREATE TABLE IF NOT EXISTS shard_merges (
+                shard TEXT PRIMARY KEY,
+                seq INTEGER,
+                merged INTEGER
+            )
+        ''')
+        # Tables from before the sequence kept a (date_time, rowid) watermark; those
+        # shards are merged again from the start, which the conflict rules make harmless
+        self.db._add_missing_columns('shard_merges', {'seq': 'INTEGER'})
+        self.db.conn.commit()
+
+    def shards(self):
+        return sorted(glob.glob(os.path.join(self.shard_dir, 'worker-*.db')))
+
+    def watermark(self, shard):
+        row = self.db.conn.execute('SELECT seq FROM shard_merges WHERE shard = ?', (shard,)).fetchone()
+        return (row[0] or 0) if row is not None else 0
+
+    def merge(self):
+        """Merge what every shard gained since the last pass; returns {shard: pages written}."""
+        # Connects per pass, so MergeThread and main.py can each run one
+        with self.lock, self.db:
+            self._create_table()
+            return {os.path.basename(path): self.merge_shard(path) for path in self.shards()}
+
+    def merge_shard(self, path):
+        shard = os.path.basename(path)
+        since_seq = self.watermark(shard)
+        source = IMDBDatabase(path).open(readonly=True)
+        try:
+            if not source.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'pages'").fetchone():
+                # The worker has not created its tables yet
+                return 0
+            written = 0
+            chunk = []
+            for seq, page in source.iter_pages(self.chunk_size, since_seq):
+                chunk.append((seq, page))
+                if len(chunk) >= self.chunk_size:
+                    written += self._merge_chunk(shard, source.conn, chunk)
+                    chunk = []
+            if chunk:
+                written += self._merge_chunk(shard, source.conn, chunk)
+            return written
+        finally:
+            source.close()
+
+    def _merge_chunk(self, shard, source, chunk):
+        conn = self.db.conn
+        pages = [page for _, page in chunk]
+        url_hashes = [page[URL_HASH] for page in pages]
+        # Stored rows the chunk can conflict with: (rowid, url_hash, html_hash, date_time)
+        by_url = {}
+        by_html = {}
+        for column, values in (('url_hash', url_hashes), ('html_hash', {page[HTML_HASH] for page in pages})):
+            for values in _chunks(values):
+                for row in conn.execute(
+                    f'SELECT rowid, url_hash, html_hash, date_time FROM pages WHERE {column} IN ({_placeholders(values)})', values
+                ):
+                    by_url[row[1]] = row
+                    by_html[row[2]] = row
+
+        # The worker already computed each page's MinHash signature
+        signatures = {}
+        for values in _chunks(url_hashes):
+            signatures.update(source.execute(
+                f'SELECT url_hash, signature FROM page_signatures WHERE url_hash IN ({_placeholders(values)})', values
+            ).fetchall())
+
+        written = []
+        with conn:
+            first_seq = self.db.reserve_seq(len(pages))
+            for i, page in enumerate(pages):
+                url_hash, date_time, html_hash = page[URL_HASH], page[DATE_TIME], page[HTML_HASH]
+                current = by_url.get(url_hash)
+                if current is not None and current[3] >= date_time:
+                    continue
+                other = by_html.get(html_hash)
+                if other is not None and other[1] != url_hash:
+                    if other[3] >= date_time:
+                        # The same text is stored under another URL, more recently
+                        continue
+                    self._delete(other[0])
+                    by_url.pop(other[1], None)
+                signature = signatures.get(url_hash)
+                signature = array('Q', signature) if signature is not None else None
+                if current is None and other is None:
+                    # Pages merged earlier in this transaction are already in the index
+                    similarity, signature = self.db.compute_similarity(page[HTML] or '', signature=signature)
+                    if similarity is not None and similarity >= self.db.similarity_threshold:
+                        continue
+                if current is not None:
+                    by_html.pop(current[2], None)
+                row = (self._write(page, first_seq + i, signature), url_hash, html_hash, date_time)
+                by_url[url_hash] = by_html[html_hash] = row
+                written.append(url_hash)
+            self._merge_revisits(source, url_hashes)
+            self._merge_entities(source, url_hashes)
+            conn.execute(
+                '''
+                INSERT INTO shard_merges (shard, seq, merged) VALUES (?, ?, ?)
+                ON CONFLICT (shard) DO UPDATE SET seq = excluded.seq, merged = merged + excluded.merged
+                ''',
+                (shard, chunk[-1][0], len(written))
+            )
+        return len(written)
+
+    def _delete(self, rowid):
+        keys = self.db.cursor.execute('SELECT html_hash, metadata_hash FROM pages WHERE rowid = ?', (rowid,)).fetchone()
+        self.db.cursor.execute('DELETE FROM lsh_buckets WHERE page_rowid = ?', (rowid,))
+        self.db.cursor.execute('DELETE FROM page_signatures WHERE page_rowid = ?', (rowid,))
+        self.db.cursor.execute('DELETE FROM pages WHERE rowid = ?', (rowid,))
+        self.db.release_blobs([key for key in keys if key is not None])
+
+    def _write(self, page, seq, signature=None):
+        page = list(page)
+        html = page[HTML]
+        replaced = self.db._blob_keys([page[URL_HASH]])
+        metadata_hash = None
+        if self.db.storage == 'blob':
+            self.db.blobs.put_text(html, page[HTML_HASH])
+            metadata_hash = self.db.blobs.put_text(page[PAGE_COLUMNS.index('metadata')])
+            page[HTML] = page[PAGE_COLUMNS.index('metadata')] = None
+        columns = (*PAGE_COLUMNS, 'metadata_hash', 'seq')
+        updates = ', '.join(f'{column} = excluded.{column}' for column in columns if column != 'url_hash')
+        self.db.cursor.execute(
+            f'''
+            INSERT INTO pages ({", ".join(columns)}) VALUES ({_placeholders(columns)})
+            ON CONFLICT (url_hash) DO UPDATE SET {updates}
+            ''',
+            (*page, metadata_hash, seq)
+        )
+        self.db.release_blobs(replaced)
+        rowid = self.db.cursor.execute('SELECT rowid FROM pages WHERE url_hash = ?', (page[URL_HASH],)).fetchone()[0]
+        if signature is None:
+            signature = self.db.near_duplicates.signature(html or '')
+        self.db.near_duplicates.add(rowid, page[URL_HASH], signature)
+        return rowid
+
+    def _merge_revisits(self, source, url_hashes):
+        # A worker's counters are the newer ones if it checked the page last
+        for values in _chunks(url_hashes):
+            rows = source.execute(
+                f'SELECT {", ".join(REVISIT_COLUMNS)} FROM revisits WHERE url_hash IN ({_placeholders(values)})', values
+            ).fetchall()
+            self.db.cursor.executemany(
+                f'''
+                INSERT INTO revisits ({", ".join(REVISIT_COLUMNS)}) VALUES ({_placeholders(REVISIT_COLUMNS)})
+                ON CONFLICT (url_hash) DO UPDATE SET
+                    {", ".join(f"{column} = excluded.{column}" for column in REVISIT_COLUMNS[1:])}
+                WHERE excluded.last_checked > revisits.last_checked
+                ''',
+                rows
+            )
+
+    def _merge_entities(self, source, url_hashes):
+        entities = []
+        for values in _chunks(url_hashes):
+            placeholders = _placeholders(values)
+            try:
+                titles = source.execute(
+                    f'SELECT imdb_id, url_hash, updated, name, title_type, year, rating, rating_count FROM titles '
+                    f'WHERE url_hash IN ({placeholders})', values
+                ).fetchall()
+                people = source.execute(
+                    f'SELECT imdb_id, url_hash, updated, name, birth_date FROM people WHERE url_hash IN ({placeholders})', values
+                ).fetchall()
+            except sqlite3.OperationalError:
+                # A shard written before the entity tables existed
+                return
+            for imdb_id, url_hash, updated, name, title_type, year, rating, rating_count in titles:
+                genres = [genre for (genre,) in source.execute('SELECT genre FROM title_genres WHERE title_id = ?', (imdb_id,))]
+                credits = source.execute('SELECT person_id, role FROM credits WHERE title_id = ?', (imdb_id,)).fetchall()
+                entities.append((imdb_id, 'title', url_hash, updated, name, title_type, year, rating, rating_count,
+                                 genres, credits, None))
+            for imdb_id, url_hash, updated, name, birth_date in people:
+                entities.append((imdb_id, 'name', url_hash, updated, name, None, None, None, None, [], [], birth_date))
+        if not entities:
+            return
+        stored = {}
+        for table, kind in (('titles', 'title'), ('people', 'name')):
+            ids = [entity[0] for entity in entities if entity[1] == kind]
+            for values in _chunks(ids):
+                stored.update(self.db.conn.execute(
+                    f'SELECT imdb_id, updated FROM {table} WHERE imdb_id IN ({_placeholders(values)})', values
+                ).fetchall())
+        updated = ENTITY_COLUMNS.index('date_time')
+        self.db.entities.upsert(
+            entity for entity in entities if entity[0] not in stored or (stored[entity[0]] or '') <= entity[updated]
+        )
+
+
+class MergeThread(threading.Thread):
+    """Runs a ShardMerger every ``interval`` seconds until stopped."""
+
+    def __init__(self, merger, interval=10):
+        super().__init__(daemon=True)
+        self.merger = merger
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.merger.merge()
+            except sqlite3.Error as e:
+                # A busy shard or database only delays the merge to the next pass
+                print(f"Shard merge failed: {e}", file=sys.stderr)
+
+    def stop(self):
+        self.stopped.set()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default='imdb_crawler.db')
+    parser.add_argument('--shard-dir', default=os.path.join('crawls', 'shards'))
+    parser.add_argument('--storage', choices=('raw', 'blob'), default='raw')
+    parser.add_argument('--chunk-size', type=int, default=500)
+    args = parser.parse_args()
+
+    merged = ShardMerger(args.db, args.shard_dir, args.storage, args.chunk_size).merge()
+    for shard, count in merged.items():
+        print(f"{shard}: {count} pages merged.", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
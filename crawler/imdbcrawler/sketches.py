@@ -0,0 +1,237 @@
+import math
+import mmap
+import os
+import struct
+from collections import OrderedDict
+
+# Every sketch starts with its magic (type and format version), the two parameters
+# that fix its geometry, and a count of items
+PARAMS = struct.Struct('<8sQQ')
+COUNT = struct.Struct('<Q')
+HEADER_SIZE = PARAMS.size + COUNT.size
+
+
+def _open_buffer(path, size, params):
+    """Return a bytearray, or an mmap of ``path``, of ``size`` bytes starting with ``params``.
+
+    A file whose size or header does not match (written by another version, or with
+    other capacity/width/depth settings) is cleared instead of being read with the
+    wrong geometry. The third value is True when the sketch starts out empty.
+    """
+    header = PARAMS.pack(*params)
+    if path is None:
+        buffer = bytearray(size)
+        buffer[:PARAMS.size] = header
+        return buffer, None, True
+    fd = os.open(path, os.O_RDWR | os.O_CREAT)
+    try:
+        fresh = os.fstat(fd).st_size != size or os.pread(fd, PARAMS.size, 0) != header
+        if fresh:
+            os.ftruncate(fd, 0)
+            os.ftruncate(fd, size)
+            os.pwrite(fd, header, 0)
+        return mmap.mmap(fd, size), fd, fresh
+    except Exception:
+        os.close(fd)
+        raise
+
+
+def _split_digest(digest):
+    # Double hashing: two 64-bit halves of a 16-byte digest give all k probe positions
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:16], 'little') | 1
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over 16-byte binary digests, optionally backed by an mmap'd file."""
+
+    MAGIC = b'BLOOM002'
+
+    def __init__(self, capacity, error_rate=0.0001, path=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.buffer, self.fd, self.fresh = _open_buffer(
+            path, HEADER_SIZE + (self.num_bits + 7) // 8, (self.MAGIC, self.num_bits, self.num_hashes)
+        )
+        self.count = COUNT.unpack_from(self.buffer, PARAMS.size)[0]
+
+    def _positions(self, digest):
+        h1, h2 = _split_digest(digest)
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def __contains__(self, digest):
+        buffer = self.buffer
+        offset = HEADER_SIZE
+        return all(buffer[offset + (bit >> 3)] & (1 << (bit & 7)) for bit in self._positions(digest))
+
+    def add(self, digest):
+        """Add a digest and return True if it was (probably) already present."""
+        buffer = self.buffer
+        offset = HEADER_SIZE
+        present = True
+        for bit in self._positions(digest):
+            index = offset + (bit >> 3)
+            mask = 1 << (bit & 7)
+            if not buffer[index] & mask:
+                buffer[index] |= mask
+                present = False
+        if not present:
+            self.count += 1
+            COUNT.pack_into(buffer, PARAMS.size, self.count)
+        return present
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    @property
+    def nbytes(self):
+        return len(self.buffer)
+
+    def flush(self):
+        if self.fd is not None:
+            self.buffer.flush()
+
+    def close(self):
+        if self.fd is not None:
+            self.buffer.close()
+            os.close(self.fd)
+            self.fd = None
+
+
+class ScalableBloomFilter:
+    """Bloom filter that adds geometrically larger filters as it fills up.
+
+    Each new filter has ``growth`` times the capacity and a tighter error rate, so the
+    overall false positive rate stays below ``error_rate``. Memory grows with the number
+    of distinct items (about 2.4 bytes per item at 0.01%), never with key length, and
+    stops growing after ``max_filters`` filters; the last filter then keeps absorbing
+    items at a rising error rate.
+    """
+
+    def __init__(self, initial_capacity=100000, error_rate=0.0001, growth=2, tightening=0.5, max_filters=12, path=None):
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.max_filters = max_filters
+        self.path = path
+        self.filters = []
+        self._add_filter()
+        # Reopen filters persisted by an earlier run; once one had to be cleared, the
+        # ones after it were built on the same stale contents
+        while path is not None and len(self.filters) < max_filters and os.path.exists(self._filter_path(len(self.filters))):
+            if self.filters[-1].fresh:
+                self._remove_from(len(self.filters))
+                break
+            self._add_filter()
+
+    def _remove_from(self, index):
+        while os.path.exists(self._filter_path(index)):
+            os.remove(self._filter_path(index))
+            index += 1
+
+    def _filter_path(self, index):
+        return None if self.path is None else f"{self.path}.{index}"
+
+    def _add_filter(self):
+        index = len(self.filters)
+        capacity = self.initial_capacity * (self.growth ** index)
+        error_rate = self.error_rate * (1 - self.tightening) * (self.tightening ** index)
+        self.filters.append(BloomFilter(capacity, error_rate, self._filter_path(index)))
+
+    def __contains__(self, digest):
+        return any(digest in bloom for bloom in self.filters)
+
+    def add(self, digest):
+        if digest in self:
+            return True
+        current = self.filters[-1]
+        if current.full and len(self.filters) < self.max_filters:
+            self._add_filter()
+            current = self.filters[-1]
+        current.add(digest)
+        return False
+
+    @property
+    def nbytes(self):
+        return sum(bloom.nbytes for bloom in self.filters)
+
+    def flush(self):
+        for bloom in self.filters:
+            bloom.flush()
+
+    def close(self):
+        for bloom in self.filters:
+            bloom.close()
+
+
+class CountMinSketch:
+    """Approximate counters in ``width * depth`` 32-bit cells, optionally mmap'd.
+
+    Uses conservative update, so estimates never undercount and only overcount when
+    keys collide in every row.
+    """
+
+    MAGIC = b'CMSKT002'
+
+    def __init__(self, width=1 << 18, depth=4, path=None):
+        self.width = width
+        self.depth = depth
+        self.buffer, self.fd, self.fresh = _open_buffer(path, HEADER_SIZE + width * depth * 4, (self.MAGIC, width, depth))
+        self.counters = memoryview(self.buffer)[HEADER_SIZE:].cast('I')
+
+    def _cells(self, digest):
+        h1, h2 = _split_digest(digest)
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in range(self.depth)]
+
+    def estimate(self, digest):
+        counters = self.counters
+        return min(counters[cell] for cell in self._cells(digest))
+
+    def add(self, digest, count=1):
+        """Increment the key's counter and return the new estimate."""
+        counters = self.counters
+        cells = self._cells(digest)
+        value = min(counters[cell] for cell in cells) + count
+        for cell in cells:
+            if counters[cell] < value:
+                counters[cell] = min(value, 0xFFFFFFFF)
+        return value
+
+    @property
+    def nbytes(self):
+        return len(self.buffer)
+
+    def flush(self):
+        if self.fd is not None:
+            self.buffer.flush()
+
+    def close(self):
+        if self.fd is not None:
+            self.counters.release()
+            self.buffer.close()
+            os.close(self.fd)
+            self.fd = None
+
+
+class BoundedLRU(OrderedDict):
+    """Dict that evicts its least recently used keys beyond ``maxsize`` entries."""
+
+    def __init__(self, maxsize=100000):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
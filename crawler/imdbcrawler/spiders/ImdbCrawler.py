@@ -4,41 +4,97 @@ from collections import deque
 from sys import stderr
 from traceback import print_exc
 
-from bs4 import BeautifulSoup
+from scrapy import signals
 from scrapy.http import Request
-from scrapy.linkextractors import LinkExtractor
-from scrapy.spiders import CrawlSpider, Rule
+from scrapy.spiders import CrawlSpider
+
+from ..body_digests import BodyDigestIndex, response_digest
+from ..extraction import ExtractionPool
+from ..items import ImdbcrawlerItem, PageTouchItem
+from ..links import LinkFilter
+from ..metrics import record_timing, timed
+from ..pipelines import pages_flushed
+from ..ratelimit import rate_limit_enabled
+
+
+def response_validators(response):
+    """(ETag, Last-Modified) of a response, for conditional re-fetches."""
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    return (
+        etag.decode('latin-1') if etag else None,
+        last_modified.decode('latin-1') if last_modified else None,
+    )
+
 
-from .imdb_database import IMDBDatabase
+def page_item(response, extracted, date_time):
+    """The stored page for a 200 response and its extract_page output.
+
+    Shared by the spider and the offline re-processing job (imdbcrawler.reprocess).
+    """
+    url = response.url
+    url_hash = hashlib.md5(url.encode()).hexdigest()
+
+    title = extracted['title']
+    text_content = extracted['text']
+    text_content_hash = extracted['text_hash']
+
+    metadata = str(response.headers)
+    etag, last_modified = response_validators(response)
+
+    content_type = response.headers.get('Content-Type', b'').decode('utf-8') or 'Unknown'
+    content_length = response.headers.get('Content-Length', b'').decode('utf-8') if 'Content-Length' in response.headers else str(len(response.body))
+
+    return ImdbcrawlerItem(
+        url_hash=url_hash,
+        url=url,
+        date_time=date_time,
+        content_type=content_type,
+        content_length=content_length,
+        title=title,
+        html=text_content,
+        html_hash=text_content_hash,
+        metadata=metadata,
+        etag=etag,
+        last_modified=last_modified,
+        body_hash=response_digest(response).hex(),
+        **(extracted['entity'] or {}),
+    )
 
 
 class ImdbCrawler(CrawlSpider):
     name = 'imdb_crawler'
     start_urls = []
     allowed_domains = []
+    # 304s answer the conditional GETs sent by ConditionalGetMiddleware
+    handle_httpstatus_list = [304]
 
-    rules = (
-        Rule(LinkExtractor(allow=()), callback='parse_page', follow=True),
-    )
+    # Every request carries parse_page as its callback, which extracts and filters
+    # the links itself (see imdbcrawler.links)
+    rules = ()
 
     custom_settings = {
-        'DUPEFILTER_CLASS': 'scrapy.dupefilters.BaseDupeFilter',
+        # The shared frontier is both the queue and the seen-set for every worker process
+        'SCHEDULER': 'imdbcrawler.frontier.FrontierScheduler',
         'COOKIES_ENABLED': False,
         'ROBOTSTXT_OBEY': True,
         'CONCURRENT_REQUESTS': 32,
         'CONCURRENT_REQUESTS_PER_DOMAIN': 16,
         'CONCURRENT_REQUESTS_PER_IP': 16,
+        # Only used with RATE_LIMIT_ENABLED off; see update_settings
         'AUTOTHROTTLE_ENABLED': True,
         'AUTOTHROTTLE_START_DELAY': 2,
         'AUTOTHROTTLE_MAX_DELAY': 60,
         'HTTPCACHE_ENABLED': True,
         'HTTPCACHE_EXPIRATION_SECS': 3600 * 24,
         'HTTPCACHE_DIR': 'httpcache',
-        'DOWNLOAD_DELAY': 2,
+        # The fleet-wide per-host rate is RateLimitMiddleware's (RATE_LIMIT_RPS); a
+        # per-process delay would only multiply with the number of workers
+        'DOWNLOAD_DELAY': 0,
         'DOWNLOAD_TIMEOUT': 15,
         'RETRY_TIMES': 3,
-        'RETRY_HTTP_CODES': [500, 503, 504, 400, 403, 404, 408],
-        'RANDOMIZE_DOWNLOAD_DELAY': True,
+        # 403s and 404s are permanent, and 429/503 also slow RateLimitMiddleware down
+        'RETRY_HTTP_CODES': [500, 503, 504, 400, 408, 429],
         'DEFAULT_REQUEST_HEADERS': {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
             "Accept-Language": "en-US,en;q=0.5",
@@ -48,31 +104,98 @@ class ImdbCrawler(CrawlSpider):
             "Upgrade-Insecure-Requests": "1",
         },
         'DEPTH_LIMIT': 50,
-        'DOWNLOADER_MIDDLEWARES': {
+        # Runs on the spider's requests after the offsite filter (500), before the
+        # scheduler stores them in the frontier
+        'SPIDER_MIDDLEWARES': {
             'imdbcrawler.middlewares.PriorityMiddleware': 100,
+        },
+        'DOWNLOADER_MIDDLEWARES': {
             'imdbcrawler.middlewares.SpiderTrapMiddleware': 200,
+            'imdbcrawler.middlewares.ConditionalGetMiddleware': 250,
             'imdbcrawler.middlewares.ImdbcrawlerDownloaderMiddleware': 543,
+            # After HttpCacheMiddleware (900), so cache hits spend no tokens
+            'imdbcrawler.ratelimit.RateLimitMiddleware': 950,
+        },
+        'EXTENSIONS': {
+            'imdbcrawler.metrics.CrawlMetrics': 500,
+            'imdbcrawler.supervisor.ControlFile': 510,
+            'imdbcrawler.checkpoint.CheckpointExtension': 520,
+        },
+        'ITEM_PIPELINES': {
+            'imdbcrawler.pipelines.ImdbcrawlerPipeline': 300,
         },
+        # Responses waiting for a free extraction slot count towards this limit, so
+        # raise it to keep the downloader busy while the process pool parses
+        'SCRAPER_SLOT_MAX_ACTIVE_SIZE': 50 * 1024 * 1024,
     }
 
+    @classmethod
+    def update_settings(cls, settings):
+        super().update_settings(settings)
+        if rate_limit_enabled(settings):
+            # The shared bucket already paces each host for the whole fleet; even an
+            # AUTOTHROTTLE_ENABLED given with -s would add a per-process delay on top
+            settings.set('AUTOTHROTTLE_ENABLED', False, priority='cmdline')
+
     def __init__(self, *args, start_url=[], allowed_domain=[], **kwargs):
         super().__init__(*args, **kwargs)
-        self.db = IMDBDatabase()
         self.start_urls = [start_url]
         self.allowed_domains = [allowed_domain]
 
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.extraction_pool = ExtractionPool.from_settings(crawler.settings)
+        crawler.signals.connect(spider.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(spider.pages_flushed, signal=pages_flushed)
+        return spider
+
+    def spider_opened(self, spider):
+        # crawler.stats is only set up once the crawl starts
+        self.body_digests = BodyDigestIndex.from_settings(self.crawler.settings, self.crawler.stats)
+        self.link_filter = LinkFilter(
+            self.allowed_domains,
+            self.crawler.settings.getint('LINK_CACHE_SIZE', 200000),
+            self.crawler.stats,
+        )
+
+    def pages_flushed(self, bodies=()):
+        # Only bodies the pipeline has committed count as stored; one it dropped or
+        # has yet to write must not turn later fetches of the same body into skips
+        for url_hash, body_hash in bodies:
+            self.body_digests.remember(body_hash, url_hash)
+
     def start_requests(self):
         for url in self.start_urls:
             yield Request(url, callback=self.parse_page)
 
-    def parse_page(self, response):
-        try:
-            if response.status == 200:
-                self.save_page(response)
-                links = LinkExtractor(allow=self.allowed_domains).extract_links(response)
-                for link in links:
-                    next_url = link.url
+    def make_frontier_request(self, url, priority=0, revisit=False):
+        # Scheduled recrawls are expected to find the body they stored last time
+        meta = {'revisit': True} if revisit else None
+        return Request(url, callback=self.parse_page, priority=priority, meta=meta)
 
+    async def parse_page(self, response):
+        try:
+            if response.status == 304:
+                yield self.touch_page(response)
+            elif response.status == 200:
+                url_hash = hashlib.md5(response.url.encode()).hexdigest()
+                stored = response.meta.get('stored_validators') or {}
+                with timed(self.crawler.stats, 'fastpath'):
+                    body_hash = response_digest(response).hex()
+                    owner = self.body_digests.lookup(body_hash, url_hash, stored.get('body_hash'))
+                if owner is not None:
+                    # A body already stored: no parsing, and its links are already known
+                    if owner == url_hash:
+                        yield self.touch_page(response)
+                    else:
+                        self.logger.debug(f'Skipping {response.url}: same body as stored page {owner}')
+                    return
+                extracted = await self.extract(response)
+                yield self.save_page(response, extracted)
+                with timed(self.crawler.stats, 'link_filter'):
+                    links = self.link_filter.filter(extracted['links'], response.url)
+                for next_url in links:
                     yield Request(next_url, callback=self.parse_page)
             else:
                 self.log(f'Failed to download page: {response.url} with status code: {response.status}')
@@ -80,40 +203,38 @@ class ImdbCrawler(CrawlSpider):
             self.log(f'Error parsing page {response.url}: {e}')
             print_exc(file=stderr)
 
-    def save_page(self, response):
-        datetime_str = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        url = response.url
-        url_hash = hashlib.md5(url.encode()).hexdigest()
-
-        soup = BeautifulSoup(response.text, 'html.parser')
-        title = soup.title.string if soup.title else 'No Title'
-
-        for script in soup(['script', 'style']):
-            script.extract()
+    def validators(self, response):
+        return response_validators(response)
 
-        text_content = ' '.join(filter(None, (chunk.strip() for line in soup.get_text(separator=' ').splitlines() for chunk in line.split("  "))))
-        text_content_hash = hashlib.md5(text_content.encode()).hexdigest()
-
-        metadata = str(response.headers)
-
-        content_type = response.headers.get('Content-Type', b'').decode('utf-8') or 'Unknown'
-        content_length = response.headers.get('Content-Length', b'').decode('utf-8') if 'Content-Length' in response.headers else str(len(response.body))
-
-        with self.db as db:
-            db.save_page(
-                url_hash,
-                url,
-                datetime_str,
-                content_type,
-                content_length,
-                title,
-                text_content,
-                text_content_hash,
-                metadata
-            )
-            db.update_local_data_and_matrices()
-
-        self.log(f'Saved page {url}')
+    def touch_page(self, response):
+        url = response.url
+        etag, last_modified = self.validators(response)
+        return PageTouchItem(
+            url_hash=hashlib.md5(url.encode()).hexdigest(),
+            url=url,
+            date_time=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            etag=etag,
+            last_modified=last_modified,
+            body_hash=response_digest(response).hex() if response.status == 200 else None,
+        )
+
+    async def extract(self, response):
+        # Parsing, link and text extraction run in the process pool, off the reactor
+        # thread; extraction_wait also covers the time spent queued for a free worker
+        stats = self.crawler.stats
+        with timed(stats, 'extraction_wait'):
+            extracted = await self.extraction_pool.extract(response.body, response.encoding, response.url)
+        for stage, seconds in extracted['timings'].items():
+            record_timing(stats, stage, seconds)
+        return extracted
+
+    def save_page(self, response, extracted):
+        self.log(f'Scraped page {response.url}')
+        return page_item(response, extracted, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+    def closed(self, reason):
+        self.extraction_pool.shutdown()
+        self.body_digests.close()
 
     def __del__(self):
         if hasattr(self, 'connection'):
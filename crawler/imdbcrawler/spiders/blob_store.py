@@ -0,0 +1,179 @@
+import hashlib
+import time
+import zlib
+from collections import Counter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZLIB_DICT_SIZE = 32 * 1024
+ZSTD_DICT_SIZE = 112 * 1024
+
+
+def default_codec():
+    return 'zstd' if zstandard is not None else 'zlib'
+
+
+def content_hash(data):
+    return hashlib.md5(data).hexdigest()
+
+
+def text_key(text):
+    """The key ``BlobStore.put_text`` stores text under by default."""
+    return content_hash((text or '').encode())
+
+
+def build_zlib_dictionary(samples, size=ZLIB_DICT_SIZE, ngram=8, min_share=0.2):
+    """Preset dictionary of the word n-grams shared by many samples (IMDb boilerplate).
+
+    zlib matches most cheaply against the end of the dictionary, so the most common
+    n-grams go last.
+    """
+    counts = Counter()
+    for sample in samples:
+        words = sample.split(b' ')
+        counts.update({b' '.join(words[i:i + ngram]) for i in range(0, max(0, len(words) - ngram + 1), ngram // 2)})
+    common = [gram for gram, count in counts.most_common() if count >= max(2, len(samples) * min_share)]
+    chosen = []
+    used = 0
+    for gram in common:
+        if used + len(gram) + 1 > size:
+            break
+        chosen.append(gram)
+        used += len(gram) + 1
+    return b' '.join(reversed(chosen))
+
+
+class LazyBlob:
+    """Reference to a stored blob that is only fetched and decompressed on ``read()``."""
+
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+        self._value = None
+
+    def read(self):
+        if self._value is None:
+            self._value = self.store.get_text(self.key)
+        return self._value
+
+    def __str__(self):
+        return self.read() or ''
+
+
+class BlobStore:
+    """Content-addressed, compressed storage for page text and headers.
+
+    Blobs are keyed by their content hash and written once, so identical bodies share
+    a row; the owner of the references deletes the ones it no longer needs. After ``train_after`` blobs a compression dictionary is trained from them
+    (zstd when installed, otherwise a zlib preset dictionary) and used for every later
+    blob, which is where most of the saving on templated IMDb pages comes from.
+    """
+
+    def __init__(self, conn, codec=None, level=9, train_after=200):
+        self.conn = conn
+        self.codec = codec or default_codec()
+        self.level = level
+        self.train_after = train_after
+        self.samples = []
+        self.dictionaries = {}
+        self.current_dict_id = None
+
+    def create_tables(self):
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS blobs (
+                content_hash TEXT PRIMARY KEY,
+                codec TEXT,
+                dict_id INTEGER,
+                data BLOB
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS blob_dictionaries (
+                dict_id INTEGER PRIMARY KEY,
+                codec TEXT,
+                data BLOB,
+                created_at REAL
+            )
+        ''')
+        row = cursor.execute(
+            'SELECT MAX(dict_id) FROM blob_dictionaries WHERE codec = ?', (self.codec,)
+        ).fetchone()
+        self.current_dict_id = row[0]
+
+    def _dictionary(self, dict_id):
+        if dict_id not in self.dictionaries:
+            row = self.conn.execute('SELECT codec, data FROM blob_dictionaries WHERE dict_id = ?', (dict_id,)).fetchone()
+            codec, data = row
+            self.dictionaries[dict_id] = zstandard.ZstdCompressionDict(data) if codec == 'zstd' else data
+        return self.dictionaries[dict_id]
+
+    def _train(self):
+        if self.codec == 'zstd':
+            try:
+                data = zstandard.train_dictionary(ZSTD_DICT_SIZE, self.samples).as_bytes()
+            except zstandard.ZstdError:
+                # Too little sample data to train on; keep compressing without a dictionary
+                data = None
+        else:
+            data = build_zlib_dictionary(self.samples)
+        self.samples = []
+        if not data:
+            return
+        cursor = self.conn.execute(
+            'INSERT INTO blob_dictionaries (codec, data, created_at) VALUES (?, ?, ?)',
+            (self.codec, data, time.time())
+        )
+        self.current_dict_id = cursor.lastrowid
+
+    def _compress(self, data):
+        dict_id = self.current_dict_id
+        if self.codec == 'zstd':
+            if dict_id is None:
+                compressor = zstandard.ZstdCompressor(level=self.level)
+            else:
+                compressor = zstandard.ZstdCompressor(level=self.level, dict_data=self._dictionary(dict_id))
+            return compressor.compress(data), dict_id
+        if dict_id is None:
+            return zlib.compress(data, self.level), None
+        compressor = zlib.compressobj(self.level, zdict=self._dictionary(dict_id))
+        return compressor.compress(data) + compressor.flush(), dict_id
+
+    def _decompress(self, codec, dict_id, data):
+        if codec == 'zstd':
+            if dict_id is None:
+                return zstandard.ZstdDecompressor().decompress(data)
+            return zstandard.ZstdDecompressor(dict_data=self._dictionary(dict_id)).decompress(data)
+        if dict_id is None:
+            return zlib.decompress(data)
+        decompressor = zlib.decompressobj(zdict=self._dictionary(dict_id))
+        return decompressor.decompress(data) + decompressor.flush()
+
+    def put_text(self, text, key=None):
+        """Store text under ``key`` (its MD5 by default) unless already present; return the key."""
+        data = (text or '').encode()
+        key = key or text_key(text)
+        if self.conn.execute('SELECT 1 FROM blobs WHERE content_hash = ?', (key,)).fetchone():
+            return key
+        if self.current_dict_id is None:
+            self.samples.append(data)
+            if len(self.samples) >= self.train_after:
+                self._train()
+        compressed, dict_id = self._compress(data)
+        self.conn.execute(
+            'INSERT OR IGNORE INTO blobs (content_hash, codec, dict_id, data) VALUES (?, ?, ?, ?)',
+            (key, self.codec, dict_id, compressed)
+        )
+        return key
+
+    def get_text(self, key):
+        row = self.conn.execute('SELECT codec, dict_id, data FROM blobs WHERE content_hash = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return self._decompress(*row).decode()
+
+    def lazy(self, key):
+        return LazyBlob(self, key) if key is not None else None
@@ -0,0 +1,141 @@
+"""Typed IMDb entity tables next to ``pages``.
+
+Title and name pages are parsed into entities during extraction (see
+imdbcrawler.entities) and upserted here in batches: ``titles`` and ``people`` keyed
+by IMDb id, with a title's genres in ``title_genres`` and its cast and crew in
+``credits``. Questions such as "titles of a genre with their rating and year" or
+"everything a person is credited in" are then indexed lookups instead of scans
+over the stored page text.
+"""
+
+# Item fields of an entity, in the order the pipeline buffers them
+ENTITY_COLUMNS = ('imdb_id', 'entity_type', 'url_hash', 'date_time', 'entity_name', 'title_type', 'year', 'rating',
+                  'rating_count', 'genres', 'credits', 'birth_date')
+
+
+class EntityStore:
+    """Titles, people, genres and credits parsed from crawled pages."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def create_tables(self):
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS titles (
+                imdb_id TEXT PRIMARY KEY,
+                url_hash TEXT,
+                name TEXT,
+                title_type TEXT,
+                year INTEGER,
+                rating REAL,
+                rating_count INTEGER,
+                updated DATETIME
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS people (
+                imdb_id TEXT PRIMARY KEY,
+                url_hash TEXT,
+                name TEXT,
+                birth_date TEXT,
+                updated DATETIME
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS title_genres (
+                title_id TEXT,
+                genre TEXT,
+                PRIMARY KEY (title_id, genre)
+            ) WITHOUT ROWID
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS credits (
+                title_id TEXT,
+                person_id TEXT,
+                role TEXT,
+                PRIMARY KEY (title_id, person_id, role)
+            ) WITHOUT ROWID
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_titles_year ON titles (year)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_titles_rating ON titles (rating)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_title_genres_genre ON title_genres (genre, title_id)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_credits_person ON credits (person_id, title_id)')
+
+    def upsert(self, entities):
+        """Write a batch of ENTITY_COLUMNS rows; must run inside the caller's transaction.
+
+        A re-crawled title replaces its genres and credits, while fields its page no
+        longer provides keep their stored values.
+        """
+        titles = []
+        people = []
+        genres = []
+        credits = []
+        for (imdb_id, entity_type, url_hash, date_time, name, title_type, year, rating, rating_count,
+             entity_genres, entity_credits, birth_date) in entities:
+            if entity_type == 'name':
+                people.append((imdb_id, url_hash, name, birth_date, date_time))
+                continue
+            titles.append((imdb_id, url_hash, name, title_type, year, rating, rating_count, date_time))
+            genres.extend((imdb_id, genre) for genre in entity_genres or ())
+            credits.extend((imdb_id, person_id, role) for person_id, role in entity_credits or ())
+
+        if titles:
+            self.conn.executemany('''
+                INSERT INTO titles (imdb_id, url_hash, name, title_type, year, rating, rating_count, updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (imdb_id) DO UPDATE SET
+                    url_hash = excluded.url_hash,
+                    name = COALESCE(excluded.name, name),
+                    title_type = COALESCE(excluded.title_type, title_type),
+                    year = COALESCE(excluded.year, year),
+                    rating = COALESCE(excluded.rating, rating),
+                    rating_count = COALESCE(excluded.rating_count, rating_count),
+                    updated = excluded.updated
+            ''', titles)
+            title_ids = [(row[0],) for row in titles]
+            self.conn.executemany('DELETE FROM title_genres WHERE title_id = ?', title_ids)
+            self.conn.executemany('DELETE FROM credits WHERE title_id = ?', title_ids)
+            self.conn.executemany('INSERT OR IGNORE INTO title_genres (title_id, genre) VALUES (?, ?)', genres)
+            self.conn.executemany('INSERT OR IGNORE INTO credits (title_id, person_id, role) VALUES (?, ?, ?)', credits)
+        if people:
+            self.conn.executemany('''
+                INSERT INTO people (imdb_id, url_hash, name, birth_date, updated)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (imdb_id) DO UPDATE SET
+                    url_hash = excluded.url_hash,
+                    name = COALESCE(excluded.name, name),
+                    birth_date = COALESCE(excluded.birth_date, birth_date),
+                    updated = excluded.updated
+            ''', people)
+        return len(titles), len(people)
+
+    def find_titles(self, genre=None, year=None, min_rating=None, limit=100):
+        """(imdb_id, name, year, rating, rating_count) of matching titles, best rated first."""
+        query = 'SELECT t.imdb_id, t.name, t.year, t.rating, t.rating_count FROM titles t'
+        conditions = []
+        params = []
+        if genre is not None:
+            query += ' JOIN title_genres g ON g.title_id = t.imdb_id'
+            conditions.append('g.genre = ?')
+            params.append(genre)
+        if year is not None:
+            conditions.append('t.year = ?')
+            params.append(year)
+        if min_rating is not None:
+            conditions.append('t.rating >= ?')
+            params.append(min_rating)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY t.rating IS NULL, t.rating DESC LIMIT ?'
+        params.append(limit)
+        return self.conn.execute(query, params).fetchall()
+
+    def filmography(self, person_id):
+        """(imdb_id, name, year, role) of the titles a person is credited in, newest first."""
+        return self.conn.execute('''
+            SELECT t.imdb_id, t.name, t.year, c.role FROM credits c
+            JOIN titles t ON t.imdb_id = c.title_id
+            WHERE c.person_id = ?
+            ORDER BY t.year DESC
+        ''', (person_id,)).fetchall()
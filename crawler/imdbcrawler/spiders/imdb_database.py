@@ -1,23 +1,136 @@
 import sqlite3
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import time
+
+from ..timings import record_timing, timed
+from .blob_store import BlobStore, text_key
+from .entity_store import EntityStore
+from .freshness import DEFAULT_INTERVAL, RevisitSchedule
+from .near_duplicates import NearDuplicateIndex
+from .search_index import FullTextIndex
+
+PAGE_COLUMNS = ('url_hash', 'url', 'date_time', 'content_type', 'content_length', 'title', 'html', 'html_hash', 'metadata',
+                'etag', 'last_modified', 'body_hash')
+# Rows for touch_pages: a re-fetch that found the page unchanged
+TOUCH_COLUMNS = ('url_hash', 'url', 'date_time', 'etag', 'last_modified', 'body_hash')
+
+# WAL lets readers (the indexer, other workers) run alongside the writer, and with
+# synchronous=NORMAL a commit only fsyncs at checkpoints instead of on every transaction
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -65536',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA busy_timeout = 30000',
+)
 
 class IMDBDatabase:
-    def __init__(self, db_name="imdb_crawler.db", similarity_threshold=0.9):
+    """SQLite page store.
+
+    With ``storage="blob"`` the page text and headers are written to the compressed,
+    content-addressed BlobStore and the pages row only keeps html_hash and
+    metadata_hash references; readers resolve them on demand.
+
+    With ``vector_model_dir`` every stored page is also appended to the shared,
+    memory-mapped TfidfModel in that directory for ``related``/``similar`` queries.
+    Near-duplicate checks only switch from the MinHash estimate to its top-k cosine
+    similarity when ``vector_dedup`` is also set.
+
+    With a Scrapy ``stats`` collector, ``save_pages`` records the similarity,
+    sqlite_write and vector_append stage timings.
+
+    Every page keeps its ETag, Last-Modified and raw body hash for conditional
+    re-fetches, and ``revisits`` (a RevisitSchedule) tracks when each one is due again.
+
+    Titles and people parsed from IMDb pages go to the typed tables of ``entities``
+    (an EntityStore) through ``save_entities``, and ``search`` (a FullTextIndex) is
+    kept current by triggers on ``pages``.
+
+    Every row written or touched gets the next ``seq`` from the page_sequence counter
+    inside its write transaction, so seq follows commit order across processes and
+    ``iter_pages`` can resume after any seq without skipping rows committed later.
+    """
+
+    def __init__(self, db_name="imdb_crawler.db", similarity_threshold=0.9, storage="raw", vector_model_dir=None, stats=None,
+                 revisit_intervals=(3600, DEFAULT_INTERVAL, 30 * 24 * 3600), vector_dedup=False):
         self.db_name = db_name
         self.conn = None
         self.cursor = None
-        self.html_vectorizer = TfidfVectorizer()
         self.similarity_threshold = similarity_threshold
+        self.storage = storage
+        self.near_duplicates = None
+        self.blobs = None
+        self.vector_model_dir = vector_model_dir
+        self.vector_dedup = vector_dedup
+        self.vectors = None
+        self.similarity = None
+        self.stats = stats
+        self.revisit_intervals = revisit_intervals
+        self.revisits = None
+        self.entities = None
+        self.search = None
 
     def __enter__(self):
+        return self.open()
+
+    def open(self, readonly=False):
+        """Connect and create or migrate the tables; ``readonly`` only connects, for
+        reading a database another process is writing (get_all_data, iter_pages)."""
         db_file = self.db_name
-        self.conn = sqlite3.connect(db_file)
+        if readonly:
+            self.conn = sqlite3.connect(f'file:{db_file}?mode=ro', uri=True, timeout=30)
+            self.conn.execute('PRAGMA busy_timeout = 30000')
+            self.cursor = self.conn.cursor()
+            self.blobs = BlobStore(self.conn)
+            return self
+        self.conn = sqlite3.connect(db_file, timeout=30)
+        for pragma in PRAGMAS:
+            self.conn.execute(pragma)
         self.cursor = self.conn.cursor()
+        self.near_duplicates = NearDuplicateIndex(self.conn, self.similarity_threshold)
+        self.blobs = BlobStore(self.conn)
+        min_interval, initial_interval, max_interval = self.revisit_intervals
+        self.revisits = RevisitSchedule(self.conn, min_interval, max_interval, initial_interval)
+        self.entities = EntityStore(self.conn)
+        self.search = FullTextIndex(self.conn)
         self._create_table()
-        self.update_local_data_and_matrices()
+        self.update_near_duplicate_index()
+        if self.vector_model_dir is not None:
+            self.open_vector_model()
         return self
 
+    def open_vector_model(self, chunk_size=1000):
+        # numpy is only needed once a vector model is configured
+        from .similarity import SimilarityIndex
+        from .vector_model import TfidfModel
+
+        self.vectors = TfidfModel(self.vector_model_dir).open()
+        self.similarity = SimilarityIndex(self.vectors)
+        if len(self.vectors) == 0 and self.cursor.execute('SELECT 1 FROM pages LIMIT 1').fetchone():
+            # First use against an existing database: build the model from the stored
+            # pages; build() only runs for the first of the workers opening it at once
+            self.vectors.build(self._vector_rows(chunk_size))
+
+    def _vector_rows(self, chunk_size):
+        batch = []
+        for _, row in self.iter_pages(chunk_size):
+            page = dict(zip(PAGE_COLUMNS, row))
+            batch.append((page['url_hash'], page['html']))
+            if len(batch) >= chunk_size:
+                yield batch
+                batch = []
+        yield batch
+
+    def close(self):
+        if self.vectors is not None:
+            self.vectors.close()
+            self.vectors = None
+            self.similarity = None
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+            self.cursor = None
+
     def _create_table(self):
         self.cursor.execute('''
             CREATE TABLE IF NOT EXISTS pages (
@@ -32,43 +145,310 @@ class IMDBDatabase:
                 metadata TEXT
             )
         ''')
+        self._add_missing_columns('pages', {
+            'metadata_hash': 'TEXT',
+            'etag': 'TEXT',
+            'last_modified': 'TEXT',
+            'body_hash': 'TEXT',
+            'seq': 'INTEGER',
+        })
+        self.cursor.execute('CREATE TABLE IF NOT EXISTS page_sequence (seq INTEGER NOT NULL)')
+        if self.cursor.execute('SELECT 1 FROM page_sequence').fetchone() is None:
+            # Rows from before the sequence existed keep their insertion order
+            self.cursor.execute('UPDATE pages SET seq = rowid WHERE seq IS NULL')
+            self.cursor.execute('INSERT INTO page_sequence (seq) SELECT IFNULL(MAX(seq), 0) FROM pages')
+        self.cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_pages_seq ON pages (seq)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_pages_date_time ON pages (date_time)')
+        # Looked up by the spider's pre-parse fast path (imdbcrawler.body_digests)
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_pages_body_hash ON pages (body_hash)')
+        self.near_duplicates.create_tables()
+        self.blobs.create_tables()
+        if not self.cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_pages_metadata_hash'").fetchone():
+            # Lets release_blobs check metadata references without a table scan
+            self.cursor.execute('CREATE INDEX idx_pages_metadata_hash ON pages (metadata_hash)')
+            # Earlier versions left the blobs of rejected and overwritten pages behind
+            self.collect_blobs()
+        self.revisits.create_tables()
+        self.entities.create_tables()
+        self.search.create_tables()
         self.conn.commit()
 
-    def get_all_data(self):
-        self.cursor.execute('''
-            SELECT * FROM pages
+    def _add_missing_columns(self, table, columns):
+        existing = {row[1] for row in self.cursor.execute(f'PRAGMA table_info({table})').fetchall()}
+        for name, column_type in columns.items():
+            if name not in existing:
+                self.cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+
+    def get_all_data(self, lazy=False):
+        """All page rows in PAGE_COLUMNS order.
+
+        Blob-stored text and headers are decompressed here, or, with ``lazy=True``,
+        returned as LazyBlob references that decompress on ``read()``.
+        """
+        self.cursor.execute(f'''
+            SELECT {", ".join(PAGE_COLUMNS)}, metadata_hash FROM pages
         ''')
-        return self.cursor.fetchall()
-
-    def update_local_data_and_matrices(self):
-        self.cursor.execute('SELECT html FROM pages')
-        html_pages = [row[0] for row in self.cursor.fetchall()]
-        if html_pages:
-            self.html_tfidf_matrix = self.html_vectorizer.fit_transform(html_pages)
-        else:
-            self.html_tfidf_matrix = None
-
-    def compute_cosine_similarity(self, new_html):
-        if self.html_tfidf_matrix is not None:
-            new_html_tfidf = self.html_vectorizer.transform([new_html])
-            cosine_similarities = cosine_similarity(new_html_tfidf, self.html_tfidf_matrix)
-            return cosine_similarities.max()
-        else:
+        return [self._resolve_row(row, lazy) for row in self.cursor.fetchall()]
+
+    def iter_pages(self, chunk_size=500, since_seq=0, lazy=False):
+        """Yield (seq, row) pairs in seq order after ``since_seq``, in bounded chunks.
+
+        A row rewritten or touched since gets a new seq, so it comes up again.
+        """
+        columns = f'seq, {", ".join(PAGE_COLUMNS)}, metadata_hash'
+        cursor = self.conn.cursor()
+        last_seq = since_seq
+        while True:
+            rows = cursor.execute(
+                f'SELECT {columns} FROM pages WHERE seq > ? ORDER BY seq LIMIT ?', (last_seq, chunk_size)
+            ).fetchall()
+            for seq, *row in rows:
+                yield seq, self._resolve_row(row, lazy)
+            if len(rows) < chunk_size:
+                return
+            last_seq = rows[-1][0]
+
+    def reserve_seq(self, count):
+        """First of ``count`` consecutive new seq values.
+
+        Call it inside the write transaction that uses them: the counter update takes
+        the database's write lock, so the values are only visible in commit order.
+        """
+        self.cursor.execute('UPDATE page_sequence SET seq = seq + ?', (count,))
+        return self.cursor.execute('SELECT seq FROM page_sequence').fetchone()[0] - count + 1
+
+    def _resolve_row(self, row, lazy=False):
+        *page, metadata_hash = row
+        html_index = PAGE_COLUMNS.index('html')
+        metadata_index = PAGE_COLUMNS.index('metadata')
+        if page[html_index] is None:
+            html_hash = page[PAGE_COLUMNS.index('html_hash')]
+            page[html_index] = self.blobs.lazy(html_hash) if lazy else self.blobs.get_text(html_hash)
+        if page[metadata_index] is None and metadata_hash is not None:
+            page[metadata_index] = self.blobs.lazy(metadata_hash) if lazy else self.blobs.get_text(metadata_hash)
+        return tuple(page)
+
+    def get_html(self, url_hash):
+        row = self.cursor.execute('SELECT html, html_hash FROM pages WHERE url_hash = ?', (url_hash,)).fetchone()
+        if row is None:
             return None
+        return self._page_text(*row)
 
-    def save_page(self, url_hash, url, date_time, content_type, content_length, title, html, html_hash, metadata):
-        similarity = self.compute_cosine_similarity(html)
-        if similarity is None or similarity < self.similarity_threshold:
-            self.cursor.execute('''
-                INSERT OR IGNORE INTO pages (url_hash, url, date_time, content_type, content_length, title, html, html_hash, metadata)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (url_hash, url, date_time, content_type, content_length, title, html, html_hash, metadata))
-        else:
-            self.cursor.execute('''
-                UPDATE pages SET date_time = ?, content_type = ?, content_length = ?, title = ?, html = ?, html_hash = ?, metadata = ?
-                WHERE url_hash = ?
-            ''', (date_time, content_type, content_length, title, html, html_hash, metadata, url_hash))
-        self.conn.commit()
+    def _page_text(self, html, html_hash):
+        return html if html is not None else self.blobs.get_text(html_hash)
+
+    def _blob_keys(self, url_hashes):
+        """html_hash and metadata_hash of the stored rows, for release_blobs once they change."""
+        keys = []
+        for start in range(0, len(url_hashes), 500):
+            chunk = url_hashes[start:start + 500]
+            for row in self.cursor.execute(
+                f'SELECT html_hash, metadata_hash FROM pages WHERE url_hash IN ({",".join("?" * len(chunk))})',
+                chunk
+            ).fetchall():
+                keys.extend(key for key in row if key is not None)
+        return keys
+
+    def release_blobs(self, keys):
+        """Delete the blobs among ``keys`` that no page refers to any more."""
+        keys = list(set(keys))
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            self.cursor.execute(f'''
+                DELETE FROM blobs WHERE content_hash IN ({",".join("?" * len(chunk))})
+                    AND NOT EXISTS (SELECT 1 FROM pages WHERE html_hash = blobs.content_hash)
+                    AND NOT EXISTS (SELECT 1 FROM pages WHERE metadata_hash = blobs.content_hash)
+            ''', chunk)
+
+    def collect_blobs(self):
+        """Delete every blob no page refers to; returns how many were deleted."""
+        return self.cursor.execute('''
+            DELETE FROM blobs WHERE NOT EXISTS (SELECT 1 FROM pages WHERE html_hash = blobs.content_hash)
+                AND NOT EXISTS (SELECT 1 FROM pages WHERE metadata_hash = blobs.content_hash)
+        ''').rowcount
+
+    def update_near_duplicate_index(self):
+        # Only pages newer than the last indexed rowid are read, so this is a no-op once caught up
+        if self.near_duplicates.backfill(self._page_text):
+            self.conn.commit()
+
+    def similar_pages(self, text, k=10):
+        """Top-k (url_hash, score) stored pages most similar to text."""
+        return self.similarity.query(text, k) if self.similarity is not None else []
+
+    def related_pages(self, url_hash, k=10):
+        """Top-k (url_hash, score) stored pages most similar to a stored page."""
+        return self.similarity.related(url_hash, k) if self.similarity is not None else []
+
+    def compute_similarity(self, new_html, pending=None, signature=None):
+        if signature is None:
+            signature = self.near_duplicates.signature(new_html)
+        return self.near_duplicates.max_similarity(signature, pending), signature
+
+    def save_page(self, url_hash, url, date_time, content_type, content_length, title, html, html_hash, metadata,
+                  etag=None, last_modified=None, body_hash=None):
+        self.save_pages([(url_hash, url, date_time, content_type, content_length, title, html, html_hash, metadata,
+                          etag, last_modified, body_hash)])
+
+    def _stored_html_hashes(self, url_hashes):
+        stored = {}
+        for start in range(0, len(url_hashes), 500):
+            chunk = url_hashes[start:start + 500]
+            stored.update(self.cursor.execute(
+                f'SELECT url_hash, html_hash FROM pages WHERE url_hash IN ({",".join("?" * len(chunk))})',
+                chunk
+            ).fetchall())
+        return stored
+
+    def touch_pages(self, touches):
+        """Record re-fetches (TOUCH_COLUMNS rows) that found their pages unchanged."""
+        with self.conn:
+            self._touch(touches)
+
+    def _touch(self, touches):
+        # Only the fetch time moves; a 304 that omits a validator keeps the stored one
+        seq = self.reserve_seq(len(touches))
+        self.cursor.executemany('''
+            UPDATE pages SET date_time = ?, etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified),
+                body_hash = COALESCE(?, body_hash), seq = ?
+            WHERE url_hash = ?
+        ''', [
+            (date_time, etag, last_modified, body_hash, seq + i, url_hash)
+            for i, (url_hash, _, date_time, etag, last_modified, body_hash) in enumerate(touches)
+        ])
+        self.revisits.record((url_hash, url, False) for url_hash, url, *_ in touches)
+        if self.stats is not None:
+            self.stats.inc_value('pages/unchanged', len(touches))
+
+    def save_entities(self, entities):
+        """Upsert a batch of entity rows (in ENTITY_COLUMNS order) in a single transaction."""
+        with timed(self.stats, 'entity_write', len(entities)):
+            with self.conn:
+                titles, people = self.entities.upsert(entities)
+        if self.stats is not None:
+            self.stats.inc_value('entities/titles', titles)
+            self.stats.inc_value('entities/people', people)
+
+    def save_pages(self, pages, signatures=None):
+        """Write a batch of page rows (in PAGE_COLUMNS order) in a single transaction.
+
+        A page that is already stored overwrites its own row, or, when its text hash is
+        unchanged or already belongs to another row, is only touched; either way the
+        visit feeds the revisit schedule.
+        ``signatures`` maps url_hash to MinHash signatures computed elsewhere, such as
+        in the worker processes of imdbcrawler.reprocess. Returns the url_hashes of the
+        pages that were written.
+        """
+        signatures = signatures or {}
+        html_hash_index = PAGE_COLUMNS.index('html_hash')
+        previous = self._stored_html_hashes([page[0] for page in pages])
+        touches = [
+            (page[0], page[1], page[2], *page[-3:]) for page in pages
+            if previous.get(page[0]) == page[html_hash_index]
+        ]
+        pages = [page for page in pages if previous.get(page[0]) != page[html_hash_index]]
+        inserts = []
+        updates = []
+        indexed = {}
+        texts = {}
+        pending = {}
+        cosine_scores = None
+        similarity_seconds = 0.0
+        if self.vector_dedup and self.similarity is not None and pages:
+            with timed(self.stats, 'similarity', len(pages)):
+                cosine_scores = self.similarity.max_similarities([page[PAGE_COLUMNS.index('html')] for page in pages])
+        write_start = time.perf_counter()
+        # Blobs are only written for rows that end up stored
+        blob_texts = {}
+        with self.conn:
+            first_seq = self.reserve_seq(len(pages)) if pages else 0
+            replaced = self._blob_keys([page[0] for page in pages if page[0] in previous])
+            for i, page in enumerate(pages):
+                (url_hash, url, date_time, content_type, content_length, title, html, html_hash, metadata,
+                 etag, last_modified, body_hash) = page
+                similarity_start = time.perf_counter()
+                if cosine_scores is None:
+                    similarity, signature = self.compute_similarity(html, pending, signatures.get(url_hash))
+                else:
+                    similarity, signature = cosine_scores[i], signatures.get(url_hash) or self.near_duplicates.signature(html)
+                similarity_seconds += time.perf_counter() - similarity_start
+                metadata_hash = None
+                if self.storage == 'blob':
+                    metadata_hash = text_key(metadata)
+                    blob_texts[url_hash] = ((html, html_hash), (metadata, metadata_hash))
+                    html = metadata = None
+                validators = (etag, last_modified, body_hash, first_seq + i)
+                if url_hash not in previous and (similarity is None or similarity < self.similarity_threshold):
+                    inserts.append((url_hash, url, date_time, content_type, content_length, title, html, html_hash, metadata, metadata_hash, *validators))
+                else:
+                    # Near-duplicates and changed re-fetches overwrite the row in place
+                    updates.append((date_time, content_type, content_length, title, html, html_hash, metadata, metadata_hash, *validators, url_hash))
+                indexed[url_hash] = (html_hash, signature)
+                texts[url_hash] = page[PAGE_COLUMNS.index('html')]
+                self.near_duplicates.remember(pending, signature)
+
+            if inserts:
+                self.cursor.executemany('''
+                    INSERT OR IGNORE INTO pages (url_hash, url, date_time, content_type, content_length, title, html, html_hash, metadata, metadata_hash,
+                                                 etag, last_modified, body_hash, seq)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', inserts)
+            if updates:
+                # Like the inserts, a rewrite to text another row already holds is ignored
+                self.cursor.executemany('''
+                    UPDATE OR IGNORE pages SET date_time = ?, content_type = ?, content_length = ?, title = ?, html = ?, html_hash = ?, metadata = ?, metadata_hash = ?,
+                        etag = ?, last_modified = ?, body_hash = ?, seq = ?
+                    WHERE url_hash = ?
+                ''', updates)
+            stored = self._index_pages(indexed)
+            stored_hashes = set(stored)
+            for url_hash in stored:
+                for text, key in blob_texts.get(url_hash, ()):
+                    self.blobs.put_text(text, key)
+            # Overwritten rows give up the blobs they pointed to
+            self.release_blobs(replaced)
+            self.revisits.record(
+                (url_hash, url, True if url_hash in previous else None)
+                for url_hash, url, *_ in pages if url_hash in stored_hashes
+            )
+            # A changed re-fetch whose new text is stored under another URL keeps its
+            # old row, which is only touched, as if the page had not changed
+            touches += [
+                (page[0], page[1], page[2], *page[-3:]) for page in pages
+                if page[0] in previous and page[0] not in stored_hashes
+            ]
+            if touches:
+                self._touch(touches)
+        # The write stage covers blob compression, the statements and the commit
+        record_timing(self.stats, 'sqlite_write', time.perf_counter() - write_start - similarity_seconds, len(pages))
+        if cosine_scores is None:
+            record_timing(self.stats, 'similarity', similarity_seconds, len(pages))
+        if self.stats is not None:
+            self.stats.inc_value('pages/inserted', len(inserts))
+            changed = sum(1 for page in pages if page[0] in previous)
+            self.stats.inc_value('pages/changed', sum(1 for page in pages if page[0] in previous and page[0] in stored_hashes))
+            self.stats.inc_value('pages/near_duplicate_updates', len(updates) - changed)
+        if self.vectors is not None:
+            with timed(self.stats, 'vector_append', len(stored)):
+                self.vectors.append((url_hash, texts[url_hash]) for url_hash in stored)
+        return stored
+
+    def _index_pages(self, signatures):
+        # Rows may have been ignored by the UNIQUE constraints, so only index what was stored
+        stored = []
+        url_hashes = list(signatures)
+        for start in range(0, len(url_hashes), 500):
+            chunk = url_hashes[start:start + 500]
+            self.cursor.execute(
+                f'SELECT rowid, url_hash, html_hash FROM pages WHERE url_hash IN ({",".join("?" * len(chunk))})',
+                chunk
+            )
+            for page_rowid, url_hash, html_hash in self.cursor.fetchall():
+                stored_html_hash, signature = signatures[url_hash]
+                if html_hash == stored_html_hash:
+                    self.near_duplicates.add(page_rowid, url_hash, signature)
+                    stored.append(url_hash)
+        return stored
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.conn.close()
+        self.close()
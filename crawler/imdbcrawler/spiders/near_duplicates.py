@@ -0,0 +1,210 @@
+import hashlib
+import re
+from array import array
+
+MAX_HASH = (1 << 64) - 1
+TOKEN_RE = re.compile(r'\w+')
+
+
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+
+def _signed(value):
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def optimal_bands(threshold, num_perm):
+    """Pick the (bands, rows) split whose LSH S-curve crosses closest to the threshold."""
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        crossing = (1.0 / bands) ** (1.0 / rows)
+        # Prefer crossing slightly below the threshold so true duplicates are not missed
+        error = abs(crossing - threshold) + (0.05 if crossing > threshold else 0)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class NearDuplicateIndex:
+    """Persistent MinHash/LSH index over page text, stored next to the pages table.
+
+    Signatures use one-permutation hashing with densification, so building one is a
+    single pass over the page's shingles, and lookups only touch the LSH buckets the
+    page falls into. Per-page cost does not depend on how many pages are stored.
+
+    A text shorter than one shingle has no signature: it is never a near-duplicate
+    and is not indexed, so empty pages do not all collapse into one.
+    """
+
+    def __init__(self, conn, threshold=0.9, num_perm=128, shingle_size=3):
+        self.conn = conn
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = optimal_bands(threshold, num_perm)
+
+    def create_tables(self):
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS page_signatures (
+                page_rowid INTEGER PRIMARY KEY,
+                url_hash TEXT,
+                signature BLOB
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS lsh_buckets (
+                band INTEGER,
+                bucket INTEGER,
+                page_rowid INTEGER
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_lsh_buckets ON lsh_buckets (band, bucket)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_lsh_buckets_page ON lsh_buckets (page_rowid)')
+
+    def shingles(self, text):
+        tokens = TOKEN_RE.findall(text.lower())
+        size = self.shingle_size
+        return {' '.join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+    def signature(self, text):
+        """MinHash signature of text, or None if it has no shingles."""
+        shingles = self.shingles(text or '')
+        if not shingles:
+            return None
+        num_perm = self.num_perm
+        bins = [MAX_HASH] * num_perm
+        for shingle in shingles:
+            value = _hash64(shingle.encode())
+            slot = value % num_perm
+            if value < bins[slot]:
+                bins[slot] = value
+
+        filled = [value != MAX_HASH for value in bins]
+        if not all(filled):
+            # Densification: borrow each empty bin from the next originally filled one
+            # (circularly), salted with the distance so borrowed values differ per bin
+            dense = list(bins)
+            for i in range(num_perm):
+                if filled[i]:
+                    continue
+                offset = 1
+                while not filled[(i + offset) % num_perm]:
+                    offset += 1
+                source = bins[(i + offset) % num_perm]
+                dense[i] = _hash64(source.to_bytes(8, 'little') + offset.to_bytes(4, 'little'))
+            bins = dense
+        return array('Q', bins)
+
+    def band_keys(self, signature):
+        rows = self.rows
+        for band in range(self.bands):
+            chunk = signature[band * rows:(band + 1) * rows].tobytes()
+            yield band, _signed(_hash64(chunk))
+
+    @staticmethod
+    def estimate(signature_a, signature_b):
+        matches = sum(1 for a, b in zip(signature_a, signature_b) if a == b)
+        return matches / len(signature_a)
+
+    def candidates(self, signature):
+        """Rowids of the pages sharing at least one band with signature, each once.
+
+        Every bucket is read in full, so a popular bucket (IMDb's templated pages)
+        cannot crowd out the true duplicates; the pages sharing the most bands, the
+        likeliest duplicates, come first.
+        """
+        keys = list(self.band_keys(signature))
+        rows = self.conn.execute(
+            f'''
+            SELECT page_rowid FROM lsh_buckets
+            WHERE {" OR ".join(["(band = ? AND bucket = ?)"] * len(keys))}
+            GROUP BY page_rowid ORDER BY COUNT(*) DESC
+            ''',
+            [value for key in keys for value in key]
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def max_similarity(self, signature, pending=None):
+        """Highest estimated similarity to any indexed page, or None if nothing is close.
+
+        ``pending`` holds signatures of pages in the current write batch that are not
+        indexed yet, as built by ``remember``. Candidates are scored in batches and
+        the search stops at the first one at or above the threshold.
+        """
+        if signature is None:
+            return None
+        best = None
+        candidates = self.candidates(signature)
+        for start in range(0, len(candidates), 500):
+            chunk = candidates[start:start + 500]
+            rows = self.conn.execute(
+                f'SELECT signature FROM page_signatures WHERE page_rowid IN ({",".join("?" * len(chunk))})', chunk
+            ).fetchall()
+            for row in rows:
+                stored = array('Q')
+                stored.frombytes(row[0])
+                score = self.estimate(signature, stored)
+                if best is None or score > best:
+                    best = score
+            if best is not None and best >= self.threshold:
+                return best
+        if pending:
+            seen = set()
+            for key in self.band_keys(signature):
+                for stored in pending.get(key, ()):
+                    if id(stored) in seen:
+                        continue
+                    seen.add(id(stored))
+                    score = self.estimate(signature, stored)
+                    if best is None or score > best:
+                        best = score
+        return best
+
+    def remember(self, pending, signature):
+        if signature is None:
+            return
+        for key in self.band_keys(signature):
+            pending.setdefault(key, []).append(signature)
+
+    def add(self, page_rowid, url_hash, signature):
+        cursor = self.conn.cursor()
+        cursor.execute('DELETE FROM lsh_buckets WHERE page_rowid = ?', (page_rowid,))
+        # Pages without a signature keep a NULL row, so backfill does not revisit them
+        cursor.execute(
+            'INSERT OR REPLACE INTO page_signatures (page_rowid, url_hash, signature) VALUES (?, ?, ?)',
+            (page_rowid, url_hash, None if signature is None else signature.tobytes())
+        )
+        if signature is None:
+            return
+        cursor.executemany(
+            'INSERT INTO lsh_buckets (band, bucket, page_rowid) VALUES (?, ?, ?)',
+            [(band, bucket, page_rowid) for band, bucket in self.band_keys(signature)]
+        )
+
+    def backfill(self, page_text, batch_size=500):
+        """Index pages stored before the index existed, resuming from the highest indexed rowid.
+
+        ``page_text(html, html_hash)`` returns a row's text, wherever it is stored.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT IFNULL(MAX(page_rowid), 0) FROM page_signatures')
+        last_rowid = cursor.fetchone()[0]
+        indexed = 0
+        while True:
+            cursor.execute(
+                'SELECT rowid, url_hash, html, html_hash FROM pages WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                (last_rowid, batch_size)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            for page_rowid, url_hash, html, html_hash in rows:
+                self.add(page_rowid, url_hash, self.signature(page_text(html, html_hash) or ''))
+                last_rowid = page_rowid
+            indexed += len(rows)
+        return indexed
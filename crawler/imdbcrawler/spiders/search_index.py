@@ -0,0 +1,92 @@
+"""SQLite FTS5 full-text index over the stored pages.
+
+``pages_fts`` is an external-content FTS5 table over pages.title and pages.html, so
+the text is not stored twice. Triggers on ``pages`` keep it in step with every
+insert, rewrite and delete inside the writer's own transaction, which makes a page
+searchable as soon as the pipeline commits it, with no separate reindex. The
+triggers also bump ``search_state.generation``, which readers compare to tell
+whether cached results are stale.
+
+Pages stored with ``storage="blob"`` keep no text in pages.html and are only
+indexed by title; ``title_only_pages`` counts them so the search service can warn.
+"""
+import re
+
+# Same boosts as the Lucene Queryer: html matches weigh ten times title matches
+BM25_WEIGHTS = (0.5, 5.0)
+QUERY_TERMS = re.compile(r'"([^"]+)"|(\w+)')
+
+
+def match_expression(query):
+    """FTS5 MATCH expression for a user query, or None if it has no terms.
+
+    Words are ORed like Lucene's default operator and "quoted text" stays a phrase;
+    everything is quoted so user input can never be a syntax error.
+    """
+    terms = []
+    for phrase, word in QUERY_TERMS.findall(query):
+        words = re.findall(r'\w+', phrase) if phrase else [word]
+        if words:
+            terms.append('"' + ' '.join(words) + '"')
+    return ' OR '.join(terms) or None
+
+
+class FullTextIndex:
+    """The pages_fts table, its triggers and BM25-ranked queries over it."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def create_tables(self):
+        exists = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'pages_fts'").fetchone()
+        self.conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(
+                title, html, content = 'pages', content_rowid = 'rowid', tokenize = 'porter unicode61'
+            )
+        ''')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS search_state (id INTEGER PRIMARY KEY CHECK (id = 0), generation INTEGER)')
+        self.conn.execute('INSERT OR IGNORE INTO search_state (id, generation) VALUES (0, 0)')
+        self.conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS pages_fts_insert AFTER INSERT ON pages BEGIN
+                INSERT INTO pages_fts (rowid, title, html) VALUES (new.rowid, new.title, new.html);
+                UPDATE search_state SET generation = generation + 1 WHERE id = 0;
+            END
+        ''')
+        self.conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS pages_fts_delete AFTER DELETE ON pages BEGIN
+                INSERT INTO pages_fts (pages_fts, rowid, title, html) VALUES ('delete', old.rowid, old.title, old.html);
+                UPDATE search_state SET generation = generation + 1 WHERE id = 0;
+            END
+        ''')
+        # Touches of unchanged pages only move date_time and the validators, so skip them
+        self.conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS pages_fts_update AFTER UPDATE OF title, html ON pages BEGIN
+                INSERT INTO pages_fts (pages_fts, rowid, title, html) VALUES ('delete', old.rowid, old.title, old.html);
+                INSERT INTO pages_fts (rowid, title, html) VALUES (new.rowid, new.title, new.html);
+                UPDATE search_state SET generation = generation + 1 WHERE id = 0;
+            END
+        ''')
+        if not exists:
+            # First use against an existing database: index the pages stored so far
+            self.conn.execute("INSERT INTO pages_fts (pages_fts) VALUES ('rebuild')")
+
+    def generation(self):
+        """Counter bumped by every indexed write; equal values mean identical results."""
+        row = self.conn.execute('SELECT generation FROM search_state WHERE id = 0').fetchone()
+        return row[0] if row is not None else 0
+
+    def title_only_pages(self):
+        """Number of pages whose text lives in the blob store, out of reach of pages_fts."""
+        return self.conn.execute('SELECT COUNT(*) FROM pages WHERE html IS NULL AND html_hash IS NOT NULL').fetchone()[0]
+
+    def search(self, query, limit=20, offset=0, snippet_tokens=24, highlight=('<b>', '</b>')):
+        """(url, title, snippet, score) of the best matches, lowest (best) BM25 score first."""
+        expression = match_expression(query)
+        if expression is None:
+            return []
+        return self.conn.execute('''
+            SELECT p.url, p.title, snippet(pages_fts, 1, ?, ?, '...', ?), bm25(pages_fts, ?, ?) AS score
+            FROM pages_fts JOIN pages p ON p.rowid = pages_fts.rowid
+            WHERE pages_fts MATCH ?
+            ORDER BY score LIMIT ? OFFSET ?
+        ''', (*highlight, snippet_tokens, *BM25_WEIGHTS, expression, limit, offset)).fetchall()
@@ -0,0 +1,201 @@
+import numpy as np
+
+
+def sparse_dot(columns_a, weights_a, columns_b, weights_b):
+    _, index_a, index_b = np.intersect1d(columns_a, columns_b, assume_unique=True, return_indices=True)
+    return float(np.dot(weights_a[index_a], weights_b[index_b]))
+
+
+def _top_k(rows, scores, k):
+    if len(rows) > k:
+        keep = np.argpartition(scores, -k)[-k:]
+        rows, scores = rows[keep], scores[keep]
+    order = np.argsort(-scores, kind='stable')
+    return rows[order], scores[order]
+
+
+def _stack(vectors):
+    """Concatenate (columns, weights) query vectors into COO (query_ids, columns, weights)."""
+    lengths = [len(columns) for columns, _ in vectors]
+    query_ids = np.repeat(np.arange(len(vectors)), lengths)
+    if not query_ids.size:
+        return query_ids, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    columns = np.concatenate([np.asarray(columns, dtype=np.int64) for columns, _ in vectors])
+    weights = np.concatenate([np.asarray(weights, dtype=np.float64) for _, weights in vectors])
+    return query_ids, columns, weights
+
+
+def _product(query_ids, weights, starts, ends, post_rows, post_weights, skip):
+    """Sparse product of a batch of queries with posting lists, as (query_ids, rows, scores).
+
+    Query term i matches the postings in ``[starts[i], ends[i])``. Every posting is
+    gathered once for the whole batch and the contributions are summed per
+    (query, row) pair; rows flagged in ``skip`` are left out.
+    """
+    lengths = ends - starts
+    owners = np.repeat(np.arange(len(starts)), lengths)
+    positions = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    rows = np.asarray(post_rows[positions], dtype=np.int64)
+    live = ~skip[rows]
+    owners, rows, positions = owners[live], rows[live], positions[live]
+    scale = max(len(skip), 1)
+    pairs, inverse = np.unique(query_ids[owners] * scale + rows, return_inverse=True)
+    scores = np.bincount(inverse, weights=post_weights[positions] * weights[owners], minlength=len(pairs))
+    return pairs // scale, pairs % scale, scores
+
+
+def _split(hits, count):
+    """Per-query (rows, scores) from the (query_ids, rows, scores) of a batch product."""
+    query_ids, rows, scores = hits
+    bounds = np.searchsorted(query_ids, np.arange(count + 1))
+    return [(rows[start:end], scores[start:end]) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+class SimilarityIndex:
+    """Top-k cosine similarity queries over a TfidfModel.
+
+    The compacted base is searched through its inverted index term-at-a-time, highest
+    impact query terms first. Once no unseen page could still reach the current top-k
+    (the k-th best score is at least the sum of the remaining terms' maximum
+    contributions), the remaining terms only rescore the candidates already found, so
+    long posting lists of common terms are binary-searched rather than scanned. The
+    small append-only delta is scored through the model's term-sorted delta postings.
+    ``query_batch`` and ``max_similarities`` score a whole batch as one sparse product
+    of the stacked query vectors with each segment's postings instead.
+
+    Rows superseded by a later row for the same url_hash (a page appended to the delta
+    again) are skipped, so only the latest text of a page can match.
+
+    Each public query runs under ``model.reading()``, so the base, delta, IDF and
+    delta norms it scores against all come from one state of the model, even while
+    other processes append to it or the background compactor swaps generations.
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def _score_base(self, base, columns, weights, k, skip):
+        term_max = base['term_max']
+        in_base = columns < len(term_max)
+        columns, weights = columns[in_base], weights[in_base]
+        if len(base['indptr']) <= 1 or not len(columns):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        bounds = weights * term_max[columns]
+        order = np.argsort(-bounds, kind='stable')
+        columns, weights, bounds = columns[order], weights[order], bounds[order]
+        remaining = np.cumsum(bounds[::-1])[::-1]
+        post_indptr, post_rows, post_weights = base['post_indptr'], base['post_rows'], base['post_weights']
+
+        rows = np.empty(0, dtype=np.int64)
+        scores = np.empty(0, dtype=np.float64)
+        term = 0
+        while term < len(columns):
+            if len(rows) >= k and np.partition(scores, -k)[-k] >= remaining[term]:
+                break
+            start, end = post_indptr[columns[term]], post_indptr[columns[term] + 1]
+            term_rows = np.asarray(post_rows[start:end])
+            live = ~skip[term_rows]
+            rows, inverse = np.unique(np.concatenate([rows, term_rows[live]]), return_inverse=True)
+            contributions = np.concatenate([scores, post_weights[start:end][live] * weights[term]])
+            scores = np.bincount(inverse, weights=contributions, minlength=len(rows))
+            term += 1
+
+        for term in range(term, len(columns)):
+            # Drop candidates that can no longer reach the top-k, then rescore the rest
+            if len(rows) > k:
+                kth = np.partition(scores, -k)[-k]
+                alive = scores + remaining[term] >= kth
+                rows, scores = rows[alive], scores[alive]
+            start, end = post_indptr[columns[term]], post_indptr[columns[term] + 1]
+            term_rows = post_rows[start:end]
+            positions = np.searchsorted(term_rows, rows)
+            found = positions < len(term_rows)
+            found[found] = term_rows[positions[found]] == rows[found]
+            scores[found] += post_weights[start:end][positions[found]] * weights[term]
+        return rows, scores
+
+    def _score_base_batch(self, base, vectors, skip):
+        query_ids, columns, weights = _stack(vectors)
+        in_base = columns < len(base['term_max'])
+        query_ids, columns, weights = query_ids[in_base], columns[in_base], weights[in_base]
+        post_indptr = np.asarray(base['post_indptr'])
+        return _split(_product(query_ids, weights, post_indptr[columns], post_indptr[columns + 1],
+                               base['post_rows'], base['post_weights'], skip), len(vectors))
+
+    def _score_delta(self, vectors, skip):
+        terms, rows, post_weights = self.model.delta_postings()
+        query_ids, columns, weights = _stack(vectors)
+        starts = np.searchsorted(terms, columns, side='left')
+        ends = np.searchsorted(terms, columns, side='right')
+        return _split(_product(query_ids, weights, starts, ends, rows, post_weights, skip), len(vectors))
+
+    def _merge(self, base_hits, delta_hits, limit):
+        """Top (key, score) pairs over base and delta hits that skip superseded rows."""
+        base_rows, base_scores = base_hits
+        delta_rows, delta_scores = delta_hits
+        keys = np.concatenate([np.asarray(self.model.base['keys'])[base_rows],
+                               np.asarray(self.model.delta['keys'])[delta_rows]])
+        positions, scores = _top_k(np.arange(len(keys)), np.concatenate([base_scores, delta_scores]), limit)
+        return [(keys[position].decode(), float(score)) for position, score in zip(positions, scores)]
+
+    def query_vector(self, columns, weights, k=10, exclude=None):
+        """Top-k (url_hash, score) pairs for an L2-normalised (columns, weights) vector."""
+        with self.model.reading():
+            return self._query_vector(columns, weights, k, exclude)
+
+    def _query_vector(self, columns, weights, k=10, exclude=None):
+        model = self.model
+        base_skip, delta_skip = model.superseded()
+        columns = np.asarray(columns)
+        weights = np.asarray(weights, dtype=np.float64)
+        # One extra result leaves room for the excluded page itself
+        limit = k + (1 if exclude is not None else 0)
+
+        base_hits = self._score_base(model.base, columns, weights, limit, base_skip)
+        (delta_hits,) = self._score_delta([(columns, weights)], delta_skip)
+        results = self._merge(base_hits, delta_hits, limit)
+        return [(key, score) for key, score in results if key != exclude][:k]
+
+    def query(self, text, k=10):
+        with self.model.reading():
+            return self._query_vector(*self.model.transform(text), k=k)
+
+    def query_batch(self, texts, k=10):
+        """Top-k results for several texts, scored as one sparse product per segment."""
+        with self.model.reading():
+            return self._query_batch([self.model.transform(text or '') for text in texts], k)
+
+    def _query_batch(self, vectors, k):
+        model = self.model
+        base_skip, delta_skip = model.superseded()
+        base_hits = self._score_base_batch(model.base, vectors, base_skip)
+        delta_hits = self._score_delta(vectors, delta_skip)
+        return [self._merge(base, delta, k) for base, delta in zip(base_hits, delta_hits)]
+
+    def related(self, url_hash, k=10):
+        """Pages most similar to a stored page, excluding the page itself."""
+        with self.model.reading():
+            vector = self.model.vector_for_key(url_hash)
+            if vector is None:
+                return []
+            return self._query_vector(*vector, k=k, exclude=url_hash)
+
+    def max_similarities(self, texts):
+        """Best cosine score of each text against the store and the texts before it.
+
+        Scores are None when nothing shares a term with the text, which matches the
+        "no pages stored yet" result of the near-duplicate check.
+        """
+        with self.model.reading():
+            vectors = [self.model.transform(text or '') for text in texts]
+            tops = self._query_batch(vectors, k=1)
+        best_scores = []
+        for i, ((columns, weights), top) in enumerate(zip(vectors, tops)):
+            best = top[0][1] if top else None
+            for earlier_columns, earlier_weights in vectors[:i]:
+                score = sparse_dot(columns, weights, earlier_columns, earlier_weights)
+                if score > 0 and (best is None or score > best):
+                    best = score
+            best_scores.append(best)
+        return best_scores
@@ -0,0 +1,470 @@
+import fcntl
+import os
+import re
+import shutil
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+
+# Same tokenisation as scikit-learn's TfidfVectorizer defaults
+TOKEN_RE = re.compile(r"(?u)\b\w\w+\b")
+KEY_DTYPE = 'S32'
+
+BASE_ARRAYS = (
+    'indptr', 'indices', 'counts', 'norms', 'keys', 'idf', 'doc_freq',
+    # Inverted index (CSC) of final TF-IDF weights, for similarity queries
+    'post_indptr', 'post_rows', 'post_weights', 'term_max',
+)
+DELTA_FILES = {
+    'indices': np.int32,
+    'counts': np.float32,
+    'keys': KEY_DTYPE,
+    'ends': np.int64,
+}
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def smooth_idf(doc_freq, num_docs):
+    return (np.log((1 + num_docs) / (1 + doc_freq)) + 1).astype(np.float32)
+
+
+def _read_lines(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return f.read().splitlines()
+
+
+def _memmap(path, dtype):
+    # np.memmap refuses empty files, and an empty delta is the common case
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
+
+class TfidfModel:
+    """TF-IDF vectors persisted as memory-mappable arrays shared by all crawler processes.
+
+    A generation directory holds the compacted base: the vocabulary, IDF weights and a
+    CSR matrix of raw term counts (``indptr``/``indices``/``counts``) with per-row norms
+    and url_hash keys, each stored as a .npy file loaded with ``mmap_mode='r'``, so
+    every process shares one copy through the page cache. New rows are appended to
+    flat binary delta files under a file lock, and ``compact`` periodically folds
+    them into a new generation, refreshing document frequencies and IDF. Delta norms
+    are not stored: the IDF of delta-only terms moves as rows arrive, so they are
+    recomputed from the current IDF whenever the delta changes.
+
+    Weights are computed at query time as ``count * idf / norm``, so an IDF refresh
+    never rewrites the count matrix.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.generation = None
+        self.vocabulary = {}
+        self.terms = []
+        self.base = {}
+        self.delta = {}
+        self.delta_size = None
+        self._delta_norms = None
+        self._delta_postings = None
+        self._delta_key_rows = None
+        self._superseded = None
+        self._base_key_order = None
+        self.lock = threading.Lock()
+        self.lock_file = None
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.lock_file = open(os.path.join(self.directory, 'lock'), 'a+')
+        with self._locked():
+            if not os.path.exists(self._current_path()):
+                self._write_generation(1, self._empty_base(), [])
+        self.refresh(force=True)
+        return self
+
+    def close(self):
+        self.base = {}
+        self.delta = {}
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    @contextmanager
+    def _locked(self):
+        # flock excludes other processes, the thread lock the background compactor
+        with self.lock:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def _current_path(self):
+        return os.path.join(self.directory, 'CURRENT')
+
+    def _generation_dir(self, generation):
+        return os.path.join(self.directory, f'gen-{generation:06d}')
+
+    def _delta_path(self, name):
+        return os.path.join(self._generation_dir(self.generation), f'delta.{name}.bin')
+
+    def _read_generation(self):
+        with open(self._current_path(), encoding='utf-8') as f:
+            return int(f.read().strip())
+
+    @staticmethod
+    def _empty_base():
+        return {
+            'indptr': np.zeros(1, dtype=np.int64),
+            'indices': np.empty(0, dtype=np.int32),
+            'counts': np.empty(0, dtype=np.float32),
+            'norms': np.empty(0, dtype=np.float32),
+            'keys': np.empty(0, dtype=KEY_DTYPE),
+            'idf': np.empty(0, dtype=np.float32),
+            'doc_freq': np.empty(0, dtype=np.int64),
+            'post_indptr': np.zeros(1, dtype=np.int64),
+            'post_rows': np.empty(0, dtype=np.int32),
+            'post_weights': np.empty(0, dtype=np.float32),
+            'term_max': np.empty(0, dtype=np.float32),
+        }
+
+    def _write_generation(self, generation, arrays, terms):
+        path = self._generation_dir(generation)
+        tmp_path = f'{path}.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in BASE_ARRAYS:
+            np.save(os.path.join(tmp_path, f'{name}.npy'), arrays[name])
+        with open(os.path.join(tmp_path, 'vocabulary.txt'), 'w', encoding='utf-8') as f:
+            f.writelines(f'{term}\n' for term in terms)
+        os.replace(tmp_path, path)
+        current_tmp = f'{self._current_path()}.tmp'
+        with open(current_tmp, 'w', encoding='utf-8') as f:
+            f.write(str(generation))
+        os.replace(current_tmp, self._current_path())
+
+    def refresh(self, force=False):
+        """Pick up a new generation or rows appended by other processes."""
+        generation = self._read_generation()
+        if force or generation != self.generation:
+            self.generation = generation
+            path = self._generation_dir(generation)
+            self.base = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in BASE_ARRAYS}
+            self.terms = _read_lines(os.path.join(path, 'vocabulary.txt'))
+            self.vocabulary = {term: column for column, term in enumerate(self.terms)}
+            self.delta_size = None
+            self._base_key_order = None
+        size = tuple(
+            os.path.getsize(path) if os.path.exists(path) else 0
+            for path in (self._delta_path('ends'), self._delta_path('vocabulary'))
+        )
+        if size != self.delta_size:
+            self.delta_size = size
+            self._delta_norms = None
+            self._delta_postings = None
+            self._delta_key_rows = None
+            self._superseded = None
+            self.delta = {name: _memmap(self._delta_path(name), dtype) for name, dtype in DELTA_FILES.items()}
+            for term in _read_lines(self._delta_path('vocabulary'))[len(self.terms) - len(self.base['idf']):]:
+                self.vocabulary[term] = len(self.terms)
+                self.terms.append(term)
+
+    @contextmanager
+    def reading(self):
+        """Hold the lock over a refreshed model, for readers that need one consistent state.
+
+        Appends and compactions, here or in other processes, wait until it is released.
+        """
+        with self._locked():
+            self.refresh()
+            yield self
+
+    @property
+    def num_base_rows(self):
+        return len(self.base['indptr']) - 1
+
+    @property
+    def num_delta_rows(self):
+        return len(self.delta['ends'])
+
+    def __len__(self):
+        return self.num_base_rows + self.num_delta_rows
+
+    def idf(self):
+        """IDF for every known column; terms first seen in the delta get the df=1 weight."""
+        idf = np.asarray(self.base['idf'])
+        missing = len(self.terms) - len(idf)
+        if missing > 0:
+            idf = np.concatenate([idf, smooth_idf(np.ones(missing), max(1, len(self)))])
+        return idf
+
+    def term_counts(self, text, add_terms=False):
+        """Return (columns, counts) for text; unknown terms are dropped unless add_terms."""
+        counts = Counter(tokenize(text))
+        columns = []
+        values = []
+        new_terms = []
+        for term, count in counts.items():
+            column = self.vocabulary.get(term)
+            if column is None:
+                if not add_terms:
+                    continue
+                column = len(self.terms)
+                self.vocabulary[term] = column
+                self.terms.append(term)
+                new_terms.append(term)
+            columns.append(column)
+            values.append(count)
+        order = np.argsort(columns)
+        return np.asarray(columns, dtype=np.int32)[order], np.asarray(values, dtype=np.float32)[order], new_terms
+
+    def transform(self, text):
+        """L2-normalised TF-IDF query vector of text as (columns, weights)."""
+        columns, counts, _ = self.term_counts(text)
+        weights = counts * self.idf()[columns]
+        norm = np.sqrt(np.dot(weights, weights))
+        return columns, (weights / norm if norm else weights)
+
+    def append(self, rows):
+        """Append (url_hash, text) rows to the delta segment."""
+        rows = list(rows)
+        if not rows:
+            return
+        with self._locked():
+            self._append(rows)
+
+    def build(self, batches):
+        """Fill an empty model from batches of (url_hash, text) rows and compact it.
+
+        Runs under the file lock and re-checks emptiness once it holds it, so when
+        several processes open the same model at once only the first builds it.
+        Returns False if the model already had rows.
+        """
+        with self._locked():
+            self.refresh()
+            if len(self):
+                return False
+            for rows in batches:
+                if rows:
+                    self._append(rows)
+            self._compact()
+        return True
+
+    def _append(self, rows):
+        # Another process may have grown the vocabulary since our last refresh
+        self.refresh()
+        vectors = []
+        new_terms = []
+        for key, text in rows:
+            columns, counts, added = self.term_counts(text or '', add_terms=True)
+            vectors.append((key, columns, counts))
+            new_terms.extend(added)
+
+        if new_terms:
+            with open(self._delta_path('vocabulary'), 'a', encoding='utf-8') as f:
+                f.writelines(f'{term}\n' for term in new_terms)
+        offset = len(self.delta['indices'])
+        ends = []
+        for key, columns, counts in vectors:
+            offset += len(columns)
+            ends.append(offset)
+        with open(self._delta_path('indices'), 'ab') as f:
+            for _, columns, _ in vectors:
+                f.write(columns.tobytes())
+        with open(self._delta_path('counts'), 'ab') as f:
+            for _, _, counts in vectors:
+                f.write(counts.tobytes())
+        with open(self._delta_path('keys'), 'ab') as f:
+            f.write(np.asarray([key.encode() for key, _, _ in vectors], dtype=KEY_DTYPE).tobytes())
+        # Row ends are written last: readers only see rows whose end offset exists
+        with open(self._delta_path('ends'), 'ab') as f:
+            f.write(np.asarray(ends, dtype=np.int64).tobytes())
+        self.refresh()
+
+    def delta_rows_for(self, positions):
+        """Delta row numbers owning the given positions in the delta indices array."""
+        return np.searchsorted(np.asarray(self.delta['ends']), positions, side='right')
+
+    def delta_norms(self):
+        """L2 norms of the delta rows under the current IDF, cached until the delta changes."""
+        if self._delta_norms is None:
+            ends = np.asarray(self.delta['ends'])
+            if not len(ends):
+                self._delta_norms = np.empty(0, dtype=np.float64)
+            else:
+                indices = np.asarray(self.delta['indices'][:ends[-1]])
+                weights = np.asarray(self.delta['counts'][:ends[-1]]) * self.idf()[indices]
+                rows = self.delta_rows_for(np.arange(len(indices)))
+                self._delta_norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=len(ends)))
+        return self._delta_norms
+
+    def delta_postings(self):
+        """Delta (terms, rows, weights) sorted by term, cached until the delta changes.
+
+        Weights are final ``count * idf / norm`` values, so a query looks up each of
+        its terms with a binary search instead of scanning the whole delta.
+        """
+        if self._delta_postings is None:
+            ends = np.asarray(self.delta['ends'])
+            indices = np.asarray(self.delta['indices'][:ends[-1]] if len(ends) else [], dtype=np.int32)
+            counts = np.asarray(self.delta['counts'][:len(indices)], dtype=np.float64)
+            rows = self.delta_rows_for(np.arange(len(indices)))
+            norms = self.delta_norms()[rows]
+            weights = counts * self.idf()[indices] / np.where(norms > 0, norms, 1)
+            order = np.argsort(indices, kind='stable')
+            self._delta_postings = indices[order], rows[order], weights[order]
+        return self._delta_postings
+
+    def _delta_rows_by_key(self):
+        if self._delta_key_rows is None:
+            # Later rows overwrite earlier ones, so every key maps to its latest row
+            self._delta_key_rows = {key: row for row, key in enumerate(np.asarray(self.delta['keys']).tolist())}
+        return self._delta_key_rows
+
+    def _base_row(self, encoded_keys):
+        """Base row of each encoded key, or -1; base keys are unique after compaction."""
+        if self._base_key_order is None:
+            self._base_key_order = np.argsort(np.asarray(self.base['keys']), kind='stable')
+        sorted_keys = np.asarray(self.base['keys'])[self._base_key_order]
+        positions = np.searchsorted(sorted_keys, encoded_keys)
+        found = positions < len(sorted_keys)
+        found[found] = sorted_keys[positions[found]] == np.asarray(encoded_keys)[found]
+        return np.where(found, self._base_key_order[np.minimum(positions, max(len(sorted_keys) - 1, 0))], -1)
+
+    def superseded(self):
+        """Boolean (base, delta) masks of rows replaced by a later row for the same key.
+
+        Cached until the delta changes; queries skip these rows so a page appended again
+        is only ever scored with its latest text.
+        """
+        if self._superseded is None:
+            latest = self._delta_rows_by_key()
+            delta = np.ones(self.num_delta_rows, dtype=bool)
+            delta[list(latest.values())] = False
+            base = np.zeros(self.num_base_rows, dtype=bool)
+            if latest and self.num_base_rows:
+                rows = self._base_row(np.asarray(list(latest), dtype=KEY_DTYPE))
+                base[rows[rows >= 0]] = True
+            self._superseded = base, delta
+        return self._superseded
+
+    def row(self, index):
+        """Return (key, columns, counts, norm) for a row across base and delta."""
+        if index < self.num_base_rows:
+            start, end = self.base['indptr'][index], self.base['indptr'][index + 1]
+            return (self.base['keys'][index].decode(), self.base['indices'][start:end],
+                    self.base['counts'][start:end], self.base['norms'][index])
+        index -= self.num_base_rows
+        start = self.delta['ends'][index - 1] if index else 0
+        end = self.delta['ends'][index]
+        return (self.delta['keys'][index].decode(), self.delta['indices'][start:end],
+                self.delta['counts'][start:end], self.delta_norms()[index])
+
+    def row_for_key(self, key):
+        """Index of the latest row stored for key across base and delta, or None."""
+        encoded = key.encode()
+        delta_row = self._delta_rows_by_key().get(encoded)
+        if delta_row is not None:
+            return self.num_base_rows + delta_row
+        if not self.num_base_rows:
+            return None
+        base_row = int(self._base_row(np.asarray([encoded], dtype=KEY_DTYPE))[0])
+        return base_row if base_row >= 0 else None
+
+    def vector_for_key(self, key):
+        """L2-normalised TF-IDF (columns, weights) of the latest row stored for key."""
+        index = self.row_for_key(key)
+        if index is None:
+            return None
+        _, columns, counts, norm = self.row(index)
+        weights = np.asarray(counts) * self.idf()[columns]
+        return np.asarray(columns), weights / norm if norm else weights
+
+    def needs_compaction(self, max_delta_rows=5000):
+        with self._locked():
+            self.refresh()
+            return self.num_delta_rows >= max_delta_rows
+
+    def compact(self):
+        """Fold the delta into a new base generation and recompute DF, IDF and norms.
+
+        When a url_hash was appended more than once only its latest row is kept.
+        """
+        with self._locked():
+            self._compact()
+
+    def _compact(self):
+        self.refresh()
+        delta_ends = np.asarray(self.delta['ends'])
+        delta_indptr = np.concatenate([[0], delta_ends]).astype(np.int64)
+        indptr = np.concatenate([np.asarray(self.base['indptr']), delta_indptr[1:] + self.base['indptr'][-1]])
+        indices = np.concatenate([np.asarray(self.base['indices']), np.asarray(self.delta['indices'][:delta_indptr[-1]])])
+        counts = np.concatenate([np.asarray(self.base['counts']), np.asarray(self.delta['counts'][:delta_indptr[-1]])])
+        keys = np.concatenate([np.asarray(self.base['keys']), np.asarray(self.delta['keys'][:len(delta_ends)])])
+
+        # Keep the last row for every key
+        _, last_from_end = np.unique(keys[::-1], return_index=True)
+        keep = np.sort(len(keys) - 1 - last_from_end)
+        lengths = np.diff(indptr)[keep]
+        starts = indptr[:-1][keep]
+        gather = np.concatenate([np.arange(start, start + length) for start, length in zip(starts, lengths)]) if len(keep) else np.empty(0, dtype=np.int64)
+        indices = indices[gather].astype(np.int32)
+        counts = counts[gather].astype(np.float32)
+        keys = keys[keep]
+        indptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+        num_terms = len(self.terms)
+        doc_freq = np.bincount(indices, minlength=num_terms).astype(np.int64)
+        idf = smooth_idf(doc_freq, len(keys))
+        row_of_value = np.repeat(np.arange(len(keys)), lengths)
+        norms = np.sqrt(np.bincount(row_of_value, weights=(counts * idf[indices]) ** 2, minlength=len(keys))).astype(np.float32)
+
+        # Postings sorted by term, then row, with weights already normalised per row
+        weights = counts * idf[indices] / np.where(norms > 0, norms, 1)[row_of_value]
+        order = np.lexsort((row_of_value, indices))
+        post_indptr = np.concatenate([[0], np.cumsum(doc_freq)]).astype(np.int64)
+        term_max = np.zeros(num_terms, dtype=np.float32)
+        np.maximum.at(term_max, indices, weights.astype(np.float32))
+
+        previous = self.generation
+        self._write_generation(previous + 1, {
+            'indptr': indptr,
+            'indices': indices,
+            'counts': counts,
+            'norms': norms,
+            'keys': keys,
+            'idf': idf,
+            'doc_freq': doc_freq,
+            'post_indptr': post_indptr,
+            'post_rows': row_of_value[order].astype(np.int32),
+            'post_weights': weights[order].astype(np.float32),
+            'term_max': term_max,
+        }, self.terms)
+        self.refresh()
+        # Processes still mapping the old files keep them alive until they refresh
+        shutil.rmtree(self._generation_dir(previous), ignore_errors=True)
+
+
+class BackgroundCompactor(threading.Thread):
+    """Compacts a TfidfModel every ``interval`` seconds once enough delta rows pile up."""
+
+    def __init__(self, model, interval=300, max_delta_rows=5000):
+        super().__init__(daemon=True)
+        self.model = model
+        self.interval = interval
+        self.max_delta_rows = max_delta_rows
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if self.model.needs_compaction(self.max_delta_rows):
+                self.model.compact()
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,358 @@
+"""Adaptive fleet supervisor for main.py --supervise.
+
+The supervisor watches every worker's metrics snapshots (see imdbcrawler.metrics)
+and the host's CPU load, and steers two knobs with an AIMD controller: how many
+run_crawler.py processes are alive, and each worker's per-domain concurrency. The
+domain's politeness budget (``max_rps`` requests/sec across the whole fleet, set
+with main.py --max-rps) is spread by giving each worker a download delay of
+workers / max_rps, and capped by the per-host bucket all workers share (see
+imdbcrawler.ratelimit).
+
+Workers pick up concurrency and delay changes from a small JSON control file
+through ``ControlFile``, a Scrapy extension, without restarting. Crashed workers,
+and hung ones that sent no frontier heartbeat for a lease, have their claimed URLs
+released and their frontier partitions handed to the remaining workers before a
+replacement is started; URLs they had dispatched but not yet stored in the pages
+database are queued again. Partitions only move when the set of workers changes.
+"""
+import json
+import os
+import subprocess
+import time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from .frontier import Frontier
+from .metrics import read_latest_snapshot
+
+THROTTLE_STATUSES = (429, 503)
+
+
+def write_control(path, concurrency, delay):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'concurrency': concurrency, 'delay': delay}, f)
+    os.replace(tmp_path, path)
+
+
+def cpu_load():
+    """One-minute load average per core (0 where the platform has no load average)."""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        return 0.0
+
+
+class AIMDController:
+    """Additive-increase / multiplicative-decrease over (workers, concurrency).
+
+    While the fleet stays under the request budget with no throttling, errors or CPU
+    pressure it grows by one step per tick: concurrency first, then another worker
+    once concurrency is maxed out (or stopped paying off) and the CPU has headroom.
+    A step that did not raise pages/sec is undone and that knob is left alone for
+    ``probe_every`` ticks. A 429/503 or error-rate spike cuts concurrency (and, once
+    that is at the minimum, the worker count) by ``backoff``; CPU saturation sheds a
+    worker.
+    """
+
+    def __init__(self, min_workers=1, max_workers=4, min_concurrency=1, max_concurrency=16, max_rps=8.0,
+                 throttle_threshold=0.02, error_threshold=0.1, cpu_high=0.9, backoff=0.5,
+                 probe_every=10, initial_workers=None, initial_concurrency=None):
+        self.min_workers = min_workers
+        self.max_workers = max(min_workers, max_workers)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max(min_concurrency, max_concurrency)
+        self.max_rps = max_rps
+        self.throttle_threshold = throttle_threshold
+        self.error_threshold = error_threshold
+        self.cpu_high = cpu_high
+        self.backoff = backoff
+        self.probe_every = probe_every
+        self.workers = min(self.max_workers, max(min_workers, initial_workers or min_workers))
+        self.concurrency = min(self.max_concurrency, max(min_concurrency, initial_concurrency or min_concurrency))
+        self.last_step = None
+        self.last_rate = None
+        self.saturated = set()
+        self.ticks = 0
+
+    def download_delay(self):
+        """Per-worker delay that keeps the whole fleet within max_rps."""
+        return self.workers / self.max_rps if self.max_rps else 0.0
+
+    def update(self, sample):
+        """Adjust and return (workers, concurrency) from one tick's fleet sample.
+
+        ``sample`` holds pages_per_sec, requests_per_sec, throttle_rate, error_rate
+        and cpu_load.
+        """
+        rate = sample['pages_per_sec']
+        self.ticks += 1
+        if self.ticks % self.probe_every == 0:
+            self.saturated.clear()
+        if sample['throttle_rate'] > self.throttle_threshold or sample['error_rate'] > self.error_threshold:
+            if self.concurrency > self.min_concurrency:
+                self.concurrency = max(self.min_concurrency, int(self.concurrency * self.backoff))
+            else:
+                self.workers = max(self.min_workers, int(self.workers * self.backoff))
+            self.last_step = None
+            self.saturated.clear()
+        elif sample['cpu_load'] > self.cpu_high and self.workers > self.min_workers:
+            self.workers -= 1
+            self.last_step = None
+            self.saturated.add('workers')
+        elif self.last_step is not None and self.last_rate is not None and rate <= self.last_rate * 1.05:
+            # The last increase bought nothing: step back and hold there
+            if self.last_step == 'workers':
+                self.workers -= 1
+            else:
+                self.concurrency -= 1
+            self.saturated.add(self.last_step)
+            self.last_step = None
+        elif sample['requests_per_sec'] < self.max_rps * 0.9:
+            if self.concurrency < self.max_concurrency and 'concurrency' not in self.saturated:
+                self.concurrency += 1
+                self.last_step = 'concurrency'
+            elif (self.workers < self.max_workers and 'workers' not in self.saturated
+                    and sample['cpu_load'] < self.cpu_high * 0.75):
+                self.workers += 1
+                self.last_step = 'workers'
+            else:
+                self.last_step = None
+        else:
+            self.last_step = None
+        self.last_rate = rate
+        return self.workers, self.concurrency
+
+
+class WorkerProcess:
+    def __init__(self, worker_id, process):
+        self.worker_id = worker_id
+        self.process = process
+        self.stopping = False
+        self.previous = None
+
+
+class Supervisor:
+    """Runs and resizes the worker fleet until the frontier is drained.
+
+    ``command(worker_id)`` returns the argv of a worker; it should pass the control
+    file as SUPERVISOR_CONTROL_FILE and the metrics directory as METRICS_DIR.
+    ``launch(argv)`` starts it: subprocess.Popen, or WorkerLauncher.launch to fork
+    it from a preloaded forkserver (see imdbcrawler.launcher).
+    """
+
+    def __init__(self, command, controller, frontier_db, metrics_dir, control_path, interval=10, max_restarts=5,
+                 launch=subprocess.Popen, lease_timeout=300):
+        self.command = command
+        self.launch = launch
+        self.controller = controller
+        self.frontier_db = frontier_db
+        self.metrics_dir = metrics_dir
+        self.control_path = control_path
+        self.interval = interval
+        self.max_restarts = max_restarts
+        self.lease_timeout = lease_timeout
+        self.workers = {}
+        # Worker ids the frontier partitions were last split over
+        self.assigned = []
+        self.crashes = 0
+
+    def live_ids(self):
+        return sorted(worker_id for worker_id, worker in self.workers.items() if not worker.stopping)
+
+    def stalled_ids(self, frontier):
+        """Live workers whose last heartbeat is more than a lease old: hung ones."""
+        cutoff = time.time() - self.lease_timeout
+        heartbeats = frontier.heartbeats()
+        return [worker_id for worker_id in self.live_ids() if heartbeats.get(worker_id, cutoff) < cutoff]
+
+    def rebalance(self, crashed=()):
+        """Release lost workers' claims and, if the live workers changed, split the
+        partitions over them; returns the frontier's outstanding URL count.
+
+        A worker only marks a URL done once its outcome is stored, so the claims a
+        crashed (or killed, hung) worker leaves behind are exactly the URLs it lost.
+        """
+        with Frontier(self.frontier_db) as frontier:
+            lost = list(crashed)
+            for worker_id in self.stalled_ids(frontier):
+                print(f"[supervisor] worker {worker_id} sent no heartbeat for {self.lease_timeout:.0f}s, killing it")
+                self.kill_worker(worker_id)
+                lost.append(worker_id)
+            for worker_id in lost:
+                requeued = frontier.release(worker_id)
+                print(f"[supervisor] requeued {requeued} unsaved URLs of worker {worker_id}")
+            live = self.live_ids()
+            if live and live != self.assigned:
+                # Only newly started workers get a heartbeat on their behalf, as a grace lease
+                frontier.assign_partitions(live, started=[worker_id for worker_id in live if worker_id not in self.assigned])
+                self.assigned = live
+            return frontier.outstanding_count()
+
+    def start_worker(self):
+        worker_id = next(i for i in range(len(self.workers) + 1) if i not in self.workers)
+        process = self.launch(self.command(worker_id))
+        self.workers[worker_id] = WorkerProcess(worker_id, process)
+        print(f"[supervisor] started worker {worker_id} (pid {process.pid})")
+
+    def kill_worker(self, worker_id):
+        # A hung worker may not handle SIGTERM; it counts as a crash
+        worker = self.workers.pop(worker_id)
+        worker.process.kill()
+        worker.process.wait()
+        self.crashes += 1
+
+    def stop_worker(self, worker_id):
+        worker = self.workers[worker_id]
+        worker.stopping = True
+        # Scrapy shuts down gracefully on SIGTERM and releases its claims
+        worker.process.terminate()
+        print(f"[supervisor] stopping worker {worker_id}")
+
+    def reap(self):
+        """Forget exited workers and return the ids of the ones that crashed."""
+        crashed = []
+        for worker_id, worker in list(self.workers.items()):
+            returncode = worker.process.poll()
+            if returncode is None:
+                continue
+            del self.workers[worker_id]
+            if returncode != 0 and not worker.stopping:
+                crashed.append(worker_id)
+                print(f"[supervisor] worker {worker_id} crashed with exit code {returncode}")
+            else:
+                print(f"[supervisor] worker {worker_id} exited")
+        return crashed
+
+    def sample(self, elapsed):
+        """Fleet pages/sec, requests/sec, throttle and error rates since the last tick."""
+        totals = {'pages': 0, 'requests': 0, 'throttled': 0, 'errors': 0}
+        for worker in self.workers.values():
+            snapshot = read_latest_snapshot(os.path.join(self.metrics_dir, f'worker-{worker.worker_id}.jsonl'))
+            if snapshot is None or snapshot.get('pid') != worker.process.pid:
+                continue
+            stats = snapshot['stats']
+            current = {
+                'pages': stats.get('item_scraped_count', 0),
+                'requests': stats.get('downloader/response_count', 0),
+                'throttled': sum(stats.get(f'downloader/response_status_count/{status}', 0) for status in THROTTLE_STATUSES),
+                'errors': stats.get('downloader/exception_count', 0) + stats.get('log_count/ERROR', 0),
+            }
+            previous = worker.previous or dict.fromkeys(current, 0)
+            for key in totals:
+                totals[key] += current[key] - previous[key]
+            worker.previous = current
+        requests = max(1, totals['requests'])
+        return {
+            'pages_per_sec': totals['pages'] / elapsed,
+            'requests_per_sec': totals['requests'] / elapsed,
+            'throttle_rate': totals['throttled'] / requests,
+            'error_rate': totals['errors'] / requests,
+            'cpu_load': cpu_load(),
+        }
+
+    def resize(self, target):
+        live = self.live_ids()
+        changed = False
+        while len(live) < target:
+            self.start_worker()
+            live = self.live_ids()
+            changed = True
+        for worker_id in reversed(live[target:]):
+            self.stop_worker(worker_id)
+            changed = True
+        return changed
+
+    def apply_control(self):
+        write_control(self.control_path, self.controller.concurrency, self.controller.download_delay())
+
+    def run(self, on_tick=None):
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        self.apply_control()
+        self.resize(self.controller.workers)
+        self.rebalance()
+        last_tick = time.monotonic()
+        while self.workers:
+            time.sleep(self.interval)
+            crashed = self.reap()
+            self.crashes += len(crashed)
+            outstanding = self.rebalance(crashed)
+            now = time.monotonic()
+            sample = self.sample(now - last_tick)
+            last_tick = now
+            if on_tick is not None:
+                on_tick()
+            if outstanding == 0:
+                # Drained: let the remaining workers finish on their own
+                continue
+
+            workers, concurrency = self.controller.update(sample)
+            print(f"[supervisor] {sample['pages_per_sec']:.2f} pages/s, {sample['requests_per_sec']:.2f} req/s, "
+                  f"throttled {sample['throttle_rate']:.1%}, errors {sample['error_rate']:.1%}, "
+                  f"cpu {sample['cpu_load']:.2f} -> workers={workers} concurrency={concurrency}")
+            self.apply_control()
+            if self.crashes > self.max_restarts:
+                # Keep the fleet we have rather than crash-looping
+                workers = min(workers, len(self.live_ids()))
+            if self.resize(workers):
+                self.rebalance()
+
+
+class ControlFile:
+    """Scrapy extension that applies the supervisor's concurrency and delay to the
+    downloader at runtime.
+
+    The file named by SUPERVISOR_CONTROL_FILE is polled every
+    SUPERVISOR_CONTROL_INTERVAL seconds; existing download slots are updated in place
+    and new slots inherit the values through the spider's download_delay and
+    max_concurrent_requests attributes.
+    """
+
+    def __init__(self, crawler, path, interval):
+        self.crawler = crawler
+        self.path = path
+        self.interval = interval
+        self.mtime = None
+        self.poll_loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('SUPERVISOR_CONTROL_FILE')
+        if not path:
+            raise NotConfigured
+        extension = cls(crawler, path, crawler.settings.getfloat('SUPERVISOR_CONTROL_INTERVAL', 2))
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        self.poll_loop = task.LoopingCall(self.apply, spider)
+        self.poll_loop.start(self.interval, now=True)
+
+    def spider_closed(self, spider):
+        if self.poll_loop is not None and self.poll_loop.running:
+            self.poll_loop.stop()
+
+    def apply(self, spider):
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self.mtime:
+                return
+            with open(self.path, encoding='utf-8') as f:
+                control = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.mtime = mtime
+        concurrency = int(control['concurrency'])
+        delay = float(control['delay'])
+        spider.max_concurrent_requests = concurrency
+        spider.download_delay = delay
+        downloader = self.crawler.engine.downloader
+        downloader.total_concurrency = max(downloader.total_concurrency, concurrency)
+        for slot in downloader.slots.values():
+            slot.concurrency = concurrency
+            slot.delay = delay
+        self.crawler.stats.set_value('supervisor/concurrency', concurrency)
+        self.crawler.stats.set_value('supervisor/download_delay', delay)
@@ -0,0 +1,28 @@
+"""Per-stage timing helpers shared by the crawler and its storage layer.
+
+Kept free of Scrapy and Twisted imports so that init_db.py, the shard merger and
+the offline tools can use IMDBDatabase without loading the crawler stack;
+imdbcrawler.metrics re-exports them alongside the CrawlMetrics extension.
+"""
+import time
+from contextlib import contextmanager
+
+TIMING_PREFIX = 'timing/'
+
+
+def record_timing(stats, stage, seconds, count=1):
+    if stats is None:
+        return
+    stats.inc_value(f'{TIMING_PREFIX}{stage}/count', count)
+    stats.inc_value(f'{TIMING_PREFIX}{stage}/seconds', seconds)
+    stats.max_value(f'{TIMING_PREFIX}{stage}/max_seconds', seconds / max(1, count))
+
+
+@contextmanager
+def timed(stats, stage, count=1):
+    """Record the wall time of the with-block as ``count`` calls of ``stage``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(stats, stage, time.perf_counter() - start, count)
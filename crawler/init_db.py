@@ -1,5 +1,5 @@
 # init_db.py
-from imdbcrawler.spiders.ImdbCrawler import IMDBDatabase
+from imdbcrawler.spiders.imdb_database import IMDBDatabase
 
 def initialize_database():
     with IMDBDatabase() as db:
@@ -1,66 +1,46 @@
+import argparse
+import glob
+import json
 import random
+import shutil
 import subprocess
 import os
 import time
-from urllib.parse import urlparse, urljoin
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service as ChromeService
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
-from bs4 import BeautifulSoup
-import speedtest
-import requests
-
-def is_valid_url(url, allowed_domain):
-    """Check if the URL belongs to the allowed domain."""
-    parsed_url = urlparse(url)
-    return allowed_domain in parsed_url.netloc
-
-def get_start_urls(size=5, root_url="https://www.imdb.com"):
-    allowed_domain = urlparse(root_url).netloc
-    user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-
-    headers = {'User-Agent': user_agent}
 
-    try:
-        response = requests.get(root_url, headers=headers)
-        print(f"Response code for {root_url}: {response.status_code}")
-        if response.status_code != 200:
-            print(f"Failed to access {root_url}, response code: {response.status_code}")
-            return []
-    except Exception as e:
-        print(f"An error occurred while checking the root URL: {e}")
-        return []
-
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-    chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument(f"user-agent={user_agent}")
+from scrapy.utils.project import get_project_settings
 
-    service = ChromeService(ChromeDriverManager().install())
-    driver = webdriver.Chrome(service=service, options=chrome_options)
-
-    try:
-        driver.get(root_url)
-        soup = BeautifulSoup(driver.page_source, 'html.parser')
-        driver.quit()
-    except Exception as e:
-        print(f"An error occurred while getting the start URLs: {e}")
-        driver.quit()
-        return []
+from imdbcrawler.checkpoint import resume_frontier
+from imdbcrawler.frontier import Frontier
+from imdbcrawler.launcher import WorkerLauncher
+from imdbcrawler.metrics import aggregate_snapshots
+from imdbcrawler.shards import MergeThread, ShardMerger
+from imdbcrawler.seeds import SeedGenerator, pending_urls, spread_across_prefixes
+from imdbcrawler.spiders.imdb_database import IMDBDatabase
+from imdbcrawler.supervisor import AIMDController, Supervisor
 
-    urls = [urljoin(root_url, a['href']) for a in soup.find_all('a', href=True) if is_valid_url(urljoin(root_url, a['href']), allowed_domain)]
+FRONTIER_DB = "frontier.db"
+IMDB_DB = "imdb_crawler.db"
+SEEDS_CACHE = "seeds_cache.json"
+SEEDS_TTL = 24 * 3600
+METRICS_DIR = "metrics"
+METRICS_INTERVAL = 10
+# Worker N serves its metrics on http://127.0.0.1:<METRICS_BASE_PORT + N>/metrics
+METRICS_BASE_PORT = 9410
+CONTROL_FILE = os.path.join(METRICS_DIR, "control.json")
+CHECKPOINT_DIR = os.path.join("crawls", "checkpoints")
+CHECKPOINT_INTERVAL = 60
+SPIDERTRAP_STATE_DIR = os.path.join("crawls", "spidertrap")
+SHARD_DIR = os.path.join("crawls", "shards")
+# Every worker draws from the same per-host token buckets (imdbcrawler.ratelimit)
+RATE_LIMIT_DB = os.path.join("crawls", "rate_limit.db")
 
-    if len(urls) == 0:
+def get_start_urls(size=5, root_url="https://www.imdb.com", pending=None):
+    """Seeds from sitemaps/robots.txt or the root page, spread over URL-prefix clusters."""
+    generator = SeedGenerator(root_url, SEEDS_CACHE, SEEDS_TTL)
+    full_urls = generator.seeds(size, pending)
+    if len(full_urls) == 0:
         print("No valid URLs found.")
         return []
-
-    if size > len(urls):
-        size = len(urls)
-        print(f"Size is too large, setting it to {size}.")
-
-    full_urls = random.sample(urls, size)
     print(f"Found {len(full_urls)} URLs.")
     return full_urls
 
@@ -70,6 +50,9 @@ def available_threads():
 
 def perform_speed_test():
     try:
+        # Optional, and slow to import; only needed when the speed test is run
+        import speedtest
+
         st = speedtest.Speedtest()
         download_speed = st.download() / 1000000
         upload_speed = st.upload() / 1000000
@@ -82,25 +65,200 @@ def perform_speed_test():
         upload_speed = 50
     return download_speed, upload_speed
 
+def report_metrics():
+    """Merge the workers' latest snapshots, save them and print a per-stage summary."""
+    aggregate = aggregate_snapshots(METRICS_DIR)
+    if not aggregate['workers']:
+        return aggregate
+    with open(os.path.join(METRICS_DIR, "aggregate.json"), "w", encoding="utf-8") as f:
+        json.dump(aggregate, f, indent=2)
+
+    stats = aggregate['stats']
+    print(f"[metrics] workers={aggregate['workers']} "
+          f"responses={stats.get('downloader/response_count', 0)} "
+          f"items={stats.get('item_scraped_count', 0)} "
+          f"scheduler={stats.get('queue/scheduler', 0)} "
+          f"extraction_pending={stats.get('queue/extraction_pending', 0)}")
+    lookups = stats.get('fastpath/lookups', 0)
+    if lookups:
+        # Each hit is a body that skipped parsing, extraction and the similarity pass
+        print(f"[metrics] fastpath lookups={lookups} "
+              f"hit_rate={1 - stats.get('fastpath/misses', 0) / lookups:.1%} "
+              f"unchanged={stats.get('fastpath/hits/unchanged', 0)} "
+              f"duplicate={stats.get('fastpath/hits/duplicate', 0)}")
+    for stage, summary in aggregate['stages'].items():
+        print(f"[metrics]   {stage:<16} n={summary['count']:<8} mean={summary['mean_ms']:.2f}ms "
+              f"max={summary['max_ms']:.2f}ms total={summary['total_s']:.1f}s")
+    return aggregate
+
+def worker_command(worker_id, url, allowed_domain, extraction_workers, extra_settings=()):
+    return [
+        "python", "run_crawler.py", url, allowed_domain,
+        f"EXTRACTION_WORKERS={extraction_workers}",
+        f"FRONTIER_DB={FRONTIER_DB}",
+        f"FRONTIER_WORKER_ID={worker_id}",
+        f"METRICS_DIR={METRICS_DIR}",
+        f"METRICS_INTERVAL={METRICS_INTERVAL}",
+        f"METRICS_PORT={METRICS_BASE_PORT + worker_id}",
+        f"CHECKPOINT_DIR={CHECKPOINT_DIR}",
+        f"CHECKPOINT_INTERVAL={CHECKPOINT_INTERVAL}",
+        f"SPIDERTRAP_STATE_DIR={SPIDERTRAP_STATE_DIR}",
+        f"RATE_LIMIT_DB={RATE_LIMIT_DB}",
+        *extra_settings,
+    ]
+
+def due_revisits(limit=None):
+    """Stored pages whose revisit time has come, most overdue first."""
+    if not os.path.exists(IMDB_DB):
+        return []
+    with IMDBDatabase(IMDB_DB) as db:
+        return db.revisits.due(limit=limit)
+
+def supervise(args, start_urls, allowed_domain, extra_settings=(), launch=subprocess.Popen):
+    """Run the fleet under the adaptive supervisor instead of a fixed worker count."""
+    controller = AIMDController(
+        min_workers=1,
+        max_workers=args.max_workers,
+        max_concurrency=args.max_concurrency,
+        max_rps=args.max_rps,
+        initial_workers=min(args.max_workers, len(start_urls)),
+    )
+    extraction_workers = max(1, os.cpu_count() // max(1, args.max_workers))
+    # The supervisor owns the request rate, so AutoThrottle must not fight it
+    extra_settings = (f"SUPERVISOR_CONTROL_FILE={CONTROL_FILE}", "AUTOTHROTTLE_ENABLED=False", *extra_settings)
+
+    def command(worker_id):
+        url = start_urls[worker_id % len(start_urls)]
+        return worker_command(worker_id, url, allowed_domain, extraction_workers, extra_settings)
+
+    supervisor = Supervisor(command, controller, FRONTIER_DB, METRICS_DIR, CONTROL_FILE, METRICS_INTERVAL, launch=launch,
+                            lease_timeout=get_project_settings().getfloat('FRONTIER_LEASE_TIMEOUT', 300))
+    supervisor.run(on_tick=report_metrics)
+    report_metrics()
+
+def run_workers(start_urls, allowed_domain, extra_settings=(), launch=subprocess.Popen):
+    """One worker per start URL, until they all finish."""
+    processes = []
+    num_workers = len(start_urls)
+
+    # Share the cores between the workers' extraction pools instead of oversubscribing
+    extraction_workers = max(1, os.cpu_count() // max(1, num_workers))
+
+    for worker_id, url in enumerate(start_urls):
+        cmd = worker_command(worker_id, url, allowed_domain, extraction_workers, extra_settings)
+        processes.append(launch(cmd))
+
+    running = dict(enumerate(processes))
+    while running:
+        time.sleep(METRICS_INTERVAL)
+        for index, p in list(running.items()):
+            if p.poll() is not None:
+                print(f"Process with start_url_index {index} completed.")
+                del running[index]
+        report_metrics()
+
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the previous crawl from its frontier and checkpoints")
+    parser.add_argument("--recrawl", action="store_true",
+                        help="revisit the stored pages that are due, with conditional GETs")
+    parser.add_argument("--recrawl-limit", type=int, default=None, help="revisit at most this many pages")
+    parser.add_argument("--supervise", action="store_true",
+                        help="adapt the worker count and concurrency to the measured throughput")
+    parser.add_argument("--max-workers", type=int, default=max(1, (os.cpu_count() or 1) - 1))
+    parser.add_argument("--max-concurrency", type=int, default=16, help="per-domain concurrency ceiling per worker")
+    parser.add_argument("--max-rps", type=float, default=8.0, help="politeness budget: requests/sec per host for the whole fleet")
+    parser.add_argument("--no-preload", action="store_true",
+                        help="start workers as plain subprocesses instead of forking them from a preloaded forkserver")
+    parser.add_argument("--shards", action="store_true",
+                        help="give each worker its own database and merge them into the main one in the background")
+    args = parser.parse_args()
+
     try:
         random.seed(42)
 
         subprocess.run(["python", "init_db.py"], check=True)
         print("Database initialized successfully.")
 
-        processes = []
         #_,_ = perform_speed_test()
-        start_urls = get_start_urls(int(available_threads()-5), "https://www.imdb.com")
+        # The HTTP cache would answer revisits from disk instead of asking the site
+        extra_settings = (f"RATE_LIMIT_RPS={args.max_rps}",)
+        if args.recrawl:
+            extra_settings += ("HTTPCACHE_ENABLED=False",)
+        merger = None
+        if args.shards:
+            extra_settings += (f"IMDB_DB_SHARD_DIR={SHARD_DIR}",)
+            # Merged pages are written the way the workers' pipelines write them
+            merger = ShardMerger(IMDB_DB, SHARD_DIR, get_project_settings().get('IMDB_DB_STORAGE', 'raw'))
+            # Revisits, resume and the seen-set all read the main database
+            merger.merge()
+        if args.recrawl:
+            due = due_revisits(args.recrawl_limit)
+            if not due:
+                print("No pages are due for a revisit.")
+                return
+            print(f"Recrawl: {len(due)} pages due for a revisit.")
+            shutil.rmtree(CHECKPOINT_DIR, ignore_errors=True)
+        elif args.resume:
+            # Keep the frontier's queue and seen-set; only put back what the
+            # interrupted workers lost and skip everything already in pages
+            with Frontier(FRONTIER_DB) as frontier:
+                requeued = resume_frontier(frontier, IMDB_DB)
+            print(f"Resuming: {requeued} interrupted URLs queued again.")
+        else:
+            shutil.rmtree(CHECKPOINT_DIR, ignore_errors=True)
+            shutil.rmtree(SPIDERTRAP_STATE_DIR, ignore_errors=True)
+
         allowed_domain = 'www.imdb.com'
+        if args.recrawl:
+            pending = []
+            start_urls = spread_across_prefixes(due, max(1, int(available_threads()-5)))
+        else:
+            # URLs queued but never fetched by the previous run are carried over
+            pending = pending_urls(FRONTIER_DB, IMDB_DB)
+            start_urls = get_start_urls(max(1, int(available_threads()-5)), "https://www.imdb.com", pending)
+
+        num_workers = len(start_urls)
+
+        # Every worker pulls from the shared frontier; each URL hash partition is
+        # owned by exactly one worker, so no page is fetched twice
+        with Frontier(FRONTIER_DB) as frontier:
+            if args.recrawl:
+                # The seen-set stays, so only the due pages and links new to it are fetched
+                frontier.mark_stored(IMDB_DB)
+                frontier.revisit(due)
+            elif not args.resume:
+                frontier.reset()
+            frontier.assign_partitions(max(1, num_workers))
+            frontier.push_urls(start_urls)
+            if not args.resume and not args.recrawl:
+                frontier.push_urls(pending)
+
+        # Snapshots from a previous run would be merged into this run's totals
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        for path in glob.glob(os.path.join(METRICS_DIR, "worker-*.jsonl")):
+            os.remove(path)
 
-        for url in start_urls:
-            cmd = ["python", "run_crawler.py", url, allowed_domain]
-            processes.append(subprocess.Popen(cmd))
+        merge_thread = None
+        if merger is not None:
+            merge_thread = MergeThread(merger, METRICS_INTERVAL)
+            merge_thread.start()
 
-        for p in processes:
-            p.wait()
-            print(f"Process with start_url_index {processes.index(p)} completed.")
+        # Workers fork from a server that has imported Scrapy and the project once
+        launch = subprocess.Popen if args.no_preload else WorkerLauncher().launch
+        try:
+            if args.supervise:
+                if start_urls:
+                    supervise(args, start_urls, allowed_domain, extra_settings, launch)
+            else:
+                run_workers(start_urls, allowed_domain, extra_settings, launch)
+        finally:
+            if merge_thread is not None:
+                merge_thread.stop()
+                merge_thread.join()
+                merged = merger.merge()
+                print(f"Merged {sum(merged.values())} pages from {len(merged)} shards into {IMDB_DB}.")
 
     except subprocess.CalledProcessError as e:
         print(f"An error occurred while running a subprocess: {e}")
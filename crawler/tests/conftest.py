@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The tests import imdbcrawler and the benchmarks' simulator from the project directory
+CRAWLER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CRAWLER_DIR)
+sys.path.insert(0, os.path.join(CRAWLER_DIR, 'benchmarks'))
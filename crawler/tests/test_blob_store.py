@@ -0,0 +1,107 @@
+import hashlib
+import importlib.util
+import sqlite3
+
+import pytest
+
+from imdbcrawler.spiders.blob_store import BlobStore, LazyBlob, build_zlib_dictionary, text_key
+from imdbcrawler.spiders.imdb_database import IMDBDatabase
+
+CODECS = ['zlib', pytest.param('zstd', marks=pytest.mark.skipif(
+    importlib.util.find_spec('zstandard') is None, reason='zstandard is not installed'))]
+BOILERPLATE = ' '.join(f'imdb-nav-{n}' for n in range(200))
+
+
+def text(n):
+    return f'{BOILERPLATE} title {n} ' + ' '.join(f'cast{n}-{i}' for i in range(40))
+
+
+@pytest.fixture(params=CODECS)
+def store(request):
+    conn = sqlite3.connect(':memory:')
+    store = BlobStore(conn, codec=request.param, train_after=20)
+    store.create_tables()
+    yield store
+    conn.close()
+
+
+def count(store, table='blobs'):
+    return store.conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def test_round_trip_and_content_addressing(store):
+    key = store.put_text(text(1))
+    assert key == text_key(text(1))
+    assert store.put_text(text(1)) == key and count(store) == 1
+    assert store.get_text(key) == text(1)
+    assert store.put_text(None) == text_key('') and store.get_text(text_key('')) == ''
+    assert store.get_text('missing') is None
+
+
+def test_a_dictionary_is_trained_and_used_for_later_blobs(store):
+    keys = [store.put_text(text(n)) for n in range(19)]
+    assert store.current_dict_id is None
+    keys += [store.put_text(text(n)) for n in range(19, 40)]
+    assert store.current_dict_id is not None and count(store, 'blob_dictionaries') == 1
+    plain, trained = (store.conn.execute('SELECT LENGTH(data) FROM blobs WHERE content_hash = ?', (keys[n],)).fetchone()[0]
+                      for n in (0, 39))
+    assert trained < plain
+    # A fresh store on the same database decompresses with the stored dictionary
+    reopened = BlobStore(store.conn, codec=store.codec)
+    reopened.create_tables()
+    assert reopened.current_dict_id == store.current_dict_id
+    assert [reopened.get_text(key) for key in keys] == [text(n) for n in range(40)]
+
+
+def test_zlib_dictionary_keeps_the_most_common_ngrams_last():
+    everywhere = 'navbar home movies tv shows celebs awards watchlist'
+    half = 'top rated movies by genre most popular titles'
+    samples = [
+        f'{everywhere} {half if n % 2 else "plain"} unique{n} page body words here'.encode() for n in range(10)
+    ]
+    dictionary = build_zlib_dictionary(samples, size=1000)
+    assert b'unique' not in dictionary
+    assert dictionary.find(b'rated') < dictionary.rfind(b'navbar')
+    assert len(build_zlib_dictionary(samples, size=60)) <= 60
+
+
+def test_lazy_blobs_decompress_once_on_read(store, monkeypatch):
+    key = store.put_text(text(1))
+    reads = []
+    get_text = store.get_text
+    monkeypatch.setattr(store, 'get_text', lambda key: reads.append(key) or get_text(key))
+    blob = store.lazy(key)
+    assert isinstance(blob, LazyBlob) and reads == []
+    assert blob.read() == str(blob) == text(1)
+    assert reads == [key]
+    assert store.lazy(None) is None
+
+
+def page(name, body, date_time='2024-01-01 00:00:00'):
+    return (f'hash-{name}', f'https://example.com/{name}', date_time, 'text/html', len(body), name, body,
+            hashlib.md5(body.encode()).hexdigest(), f'{{"page": "{name}"}}', None, None, None)
+
+
+def test_blob_pages_only_keep_the_blobs_they_refer_to(tmp_path):
+    with IMDBDatabase(str(tmp_path / 'pages.db'), storage='blob') as db:
+        db.save_pages([page('a', text(1))])
+        assert count(db) == 2
+        # Near-duplicates and rows lost to the UNIQUE constraints write nothing
+        db.save_pages([page('b', text(1) + ' tail'), page('c', text(1))])
+        assert count(db) == 2
+        # A rewrite gives up its old text
+        db.save_pages([page('a', text(2), '2024-02-01 00:00:00')])
+        assert count(db) == 2
+        assert db.get_html('hash-a') == text(2)
+        assert db.collect_blobs() == 0
+
+
+def test_orphans_from_earlier_versions_are_collected(tmp_path):
+    db_name = str(tmp_path / 'pages.db')
+    with IMDBDatabase(db_name, storage='blob') as db:
+        db.save_pages([page('a', text(1))])
+        db.blobs.put_text('left behind by a rejected page')
+        db.conn.execute('DROP INDEX idx_pages_metadata_hash')
+        db.conn.commit()
+    with IMDBDatabase(db_name, storage='blob') as db:
+        assert count(db) == 2 and db.get_html('hash-a') == text(1)
@@ -0,0 +1,42 @@
+import asyncio
+import hashlib
+
+import pytest
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.test import get_crawler
+
+from imdbcrawler.items import ImdbcrawlerItem
+from imdbcrawler.pipelines import pages_flushed
+from imdbcrawler.spiders.ImdbCrawler import ImdbCrawler
+
+BODY = b'<html><head><title>Shared</title></head><body><p>the same template body</p></body></html>'
+
+
+@pytest.fixture
+def spider(tmp_path):
+    crawler = get_crawler(ImdbCrawler, {'IMDB_DB_NAME': str(tmp_path / 'pages.db'), 'EXTRACTION_WORKERS': 0})
+    spider = ImdbCrawler.from_crawler(crawler)
+    spider.spider_opened(spider)
+    yield spider
+    spider.closed('finished')
+
+
+def parse(spider, url):
+    response = HtmlResponse(url, body=BODY, request=Request(url))
+
+    async def collect():
+        return [output async for output in spider.parse_page(response)]
+
+    return asyncio.run(collect())
+
+
+def test_bodies_count_as_stored_once_the_pipeline_commits_them(spider):
+    first = parse(spider, 'https://example.com/a')
+    assert [type(output) for output in first] == [ImdbcrawlerItem]
+    # Not flushed yet (or dropped by the pipeline): the same body is parsed again
+    assert [type(output) for output in parse(spider, 'https://example.com/b')] == [ImdbcrawlerItem]
+
+    url_hash = hashlib.md5(b'https://example.com/a').hexdigest()
+    spider.crawler.signals.send_catch_log(pages_flushed, spider=spider, bodies=[(url_hash, first[0]['body_hash'])])
+    assert parse(spider, 'https://example.com/c') == []
+    assert spider.crawler.stats.get_value('fastpath/hits/duplicate') == 1
@@ -0,0 +1,93 @@
+import hashlib
+
+import pytest
+from scrapy import Spider
+from scrapy.http import Request
+from scrapy.utils.test import get_crawler
+
+from imdbcrawler.checkpoint import (CheckpointExtension, before_checkpoint, checkpoint_path, read_checkpoint,
+                                    resume_frontier, write_checkpoint)
+from imdbcrawler.frontier import CLAIMED, DONE, PENDING, Frontier, FrontierScheduler
+from imdbcrawler.spiders.imdb_database import IMDBDatabase
+
+
+class RetrySpider(Spider):
+    name = 'retries'
+
+    def parse_page(self, response):
+        pass
+
+
+def test_checkpoints_round_trip_and_bad_files_read_as_none(tmp_path):
+    path = str(tmp_path / 'worker-0.ckpt')
+    assert read_checkpoint(path) is None
+    write_checkpoint(path, {'time': 1.0, 'local_queue': [], 'stats': {'a': 1}})
+    assert read_checkpoint(path) == {'time': 1.0, 'local_queue': [], 'stats': {'a': 1}}
+    with open(path, 'wb') as f:
+        f.write(b'truncated')
+    assert read_checkpoint(path) is None
+
+
+@pytest.fixture
+def settings(tmp_path):
+    return {'CHECKPOINT_DIR': str(tmp_path / 'checkpoints'), 'FRONTIER_DB': str(tmp_path / 'frontier.db'),
+            'FRONTIER_PARTITIONS': 4, 'FRONTIER_WORKER_ID': 2}
+
+
+def start(settings):
+    crawler = get_crawler(RetrySpider, settings)
+    spider = RetrySpider()
+    extension = CheckpointExtension.from_crawler(crawler)
+    scheduler = FrontierScheduler.from_crawler(crawler)
+    scheduler.open(spider)
+    extension.spider_opened(spider)
+    return crawler, spider, extension, scheduler
+
+
+def stop(spider, extension, scheduler):
+    extension.spider_closed(spider)
+    scheduler.close('shutdown')
+
+
+def test_a_restarted_worker_resumes_its_queue_and_counters(settings):
+    crawler, spider, extension, scheduler = start(settings)
+    crawler.signals.connect(lambda spider: {'custom': 'state'}, signal=before_checkpoint, weak=False)
+    scheduler.enqueue_request(Request('https://example.com/retry', callback=spider.parse_page, dont_filter=True))
+    crawler.stats.inc_value('spidertrap/dropped', 3)
+    crawler.stats.inc_value('downloader/request_count', 7)
+    stop(spider, extension, scheduler)
+
+    state = read_checkpoint(checkpoint_path(settings['CHECKPOINT_DIR'], 2))
+    assert state['worker'] == 2 and state['custom'] == 'state'
+    assert [request['url'] for request in state['local_queue']] == ['https://example.com/retry']
+    assert state['stats']['spidertrap/dropped'] == 3
+
+    crawler, spider, extension, scheduler = start(settings)
+    try:
+        assert [request.url for request in scheduler.local_queue] == ['https://example.com/retry']
+        assert scheduler.local_queue[0].callback == spider.parse_page
+        # Middleware decisions carry over; per-run counters start again
+        assert crawler.stats.get_value('spidertrap/dropped') == 3
+        assert crawler.stats.get_value('downloader/request_count') is None
+    finally:
+        stop(spider, extension, scheduler)
+
+
+def test_resume_requeues_lost_claims_and_skips_stored_pages(tmp_path):
+    urls = [f'https://example.com/{n}' for n in range(4)]
+    db_name = str(tmp_path / 'pages.db')
+    stored_only = 'https://example.com/from-another-crawl'
+    with IMDBDatabase(db_name) as db:
+        for n, url in enumerate((urls[0], stored_only)):
+            text = ' '.join(f'page{n}-word{i}' for i in range(20))
+            db.save_page(hashlib.md5(url.encode()).hexdigest(), url, '2024-01-01 00:00:00', 'text/html', len(text),
+                         'stored', text, f'html-{n}', '{}')
+    with Frontier(str(tmp_path / 'frontier.db'), partitions=4) as frontier:
+        frontier.assign_partitions(1)
+        frontier.push_urls(urls)
+        assert len(frontier.claim(0, 10)) == 4
+        # The fleet was killed holding every claim
+        assert resume_frontier(frontier, db_name) == 4
+        states = dict(frontier.conn.execute('SELECT url, state FROM frontier').fetchall())
+    assert states == {urls[0]: DONE, urls[1]: PENDING, urls[2]: PENDING, urls[3]: PENDING, stored_only: DONE}
+    assert CLAIMED not in states.values()
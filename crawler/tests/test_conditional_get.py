@@ -0,0 +1,74 @@
+import hashlib
+
+import pytest
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import HtmlResponse, Request
+
+from imdbcrawler.frontier import Frontier
+from imdbcrawler.middlewares import ConditionalGetMiddleware, SpiderTrapMiddleware
+from imdbcrawler.spiders.imdb_database import IMDBDatabase
+
+
+def url_hash(url):
+    return hashlib.md5(url.encode()).hexdigest()
+
+
+@pytest.fixture
+def db_name(tmp_path):
+    db_name = str(tmp_path / 'pages.db')
+    with IMDBDatabase(db_name) as db:
+        for n in range(3):
+            url = f'https://example.com/{n}'
+            text = ' '.join(f'page{n}-word{i}' for i in range(20))
+            db.save_page(url_hash(url), url, '2024-01-01 00:00:00', 'text/html', len(text), url, text,
+                         f'html-{n}', '{}', etag=f'"etag-{n}"', body_hash=f'body-{n}')
+    return db_name
+
+
+def test_claimed_batch_is_looked_up_with_one_query(db_name):
+    middleware = ConditionalGetMiddleware(db_name)
+    urls = [f'https://example.com/{n}' for n in range(5)]
+    middleware.frontier_claimed([url_hash(url) for url in urls], spider=None)
+    queries = []
+    middleware.conn.set_trace_callback(queries.append)
+
+    requests = [Request(url) for url in urls]
+    for request in requests:
+        middleware.process_request(request, None)
+    assert queries == []
+    assert [request.headers.get('If-None-Match') for request in requests] == [
+        b'"etag-0"', b'"etag-1"', b'"etag-2"', None, None
+    ]
+    assert requests[1].meta['stored_validators']['body_hash'] == 'body-1'
+    assert 'stored_validators' not in requests[3].meta
+
+    # A request from outside the batch falls back to its own lookup
+    request = Request('https://example.com/2')
+    middleware.process_request(request, None)
+    assert len(queries) == 1 and request.headers.get('If-None-Match') == b'"etag-2"'
+    middleware.spider_closed(None)
+
+
+def response(url, request):
+    return HtmlResponse(url, body=b'<html><body>same body</body></html>', request=request)
+
+
+def test_only_scheduled_revisits_may_see_a_stored_body_again():
+    middleware = SpiderTrapMiddleware()
+    first = Request('https://example.com/a', meta={'stored_validators': {'body_hash': 'x'}})
+    middleware.check_response(first, response(first.url, first))
+    # Stored validators alone (a page linked again) no longer exempt the body
+    again = Request('https://example.com/b', meta={'stored_validators': {'body_hash': 'x'}})
+    with pytest.raises(IgnoreRequest):
+        middleware.check_response(again, response(again.url, again))
+    revisit = Request('https://example.com/a', meta={'revisit': True})
+    assert middleware.check_response(revisit, response(revisit.url, revisit)) is not None
+
+
+def test_revisit_rows_are_claimed_as_revisits(tmp_path):
+    with Frontier(str(tmp_path / 'frontier.db'), partitions=4) as frontier:
+        frontier.assign_partitions(1)
+        frontier.push_urls(['https://example.com/new'])
+        frontier.revisit(['https://example.com/stored'])
+        rows = {row[1]: row[5] for row in frontier.claim(0, 10)}
+    assert rows == {'https://example.com/new': 0, 'https://example.com/stored': 1}
@@ -0,0 +1,96 @@
+import json
+import sqlite3
+
+import pytest
+
+from imdbcrawler.entities import page_entity, section_role
+from imdbcrawler.extraction import extract_page, lxml
+from imdbcrawler.spiders.entity_store import EntityStore
+
+URL = 'https://www.imdb.com/title/tt0000001/'
+PARSERS = [pytest.param('lxml', marks=pytest.mark.skipif(lxml is None, reason='lxml is not installed')), 'html.parser']
+JSON_LD = {
+    '@type': 'Movie', 'name': 'Schindler&apos;s List', 'genre': ['Drama', 'History'], 'datePublished': '1993-12-15',
+    'aggregateRating': {'ratingValue': '9.0', 'ratingCount': '1,400,000'},
+    'actor': [{'@type': 'Person', 'url': '/name/nm0000553/'}],
+    'director': [{'@type': 'Person', 'url': '/name/nm0000229/'}],
+}
+BODY = f'''<html><head><title>Schindler's List (1993) - IMDb</title>
+<script type="application/ld+json">{json.dumps(JSON_LD)}</script></head><body>
+<h1>Schindler's List</h1>
+<ul>
+  <li><span class="ipc-metadata-list-item__label">Director</span><a href="/name/nm0000229/?ref_=tt_ov_dr">Steven Spielberg</a></li>
+  <li><span class="ipc-metadata-list-item__label">Writers</span><a href="/name/nm0447745/?ref_=tt_ov_wr">Thomas Keneally</a></li>
+</ul>
+<h2>Top cast</h2>
+<a href="/name/nm0000553/?ref_=tt_cl_t_1">Liam Neeson</a><a href="/name/nm0000146/?ref_=tt_cl_t_2">Ralph Fiennes</a>
+<h2>More like this</h2>
+<a href="/title/tt0120815/">Saving Private Ryan</a><a href="/name/nm0000158/">Tom Hanks</a>
+</body></html>'''
+
+
+@pytest.mark.parametrize('parser', PARSERS)
+def test_credits_take_the_role_of_their_section(parser):
+    entity = extract_page(BODY.encode(), 'utf-8', parser, url=URL)['entity']
+    assert entity['entity_name'] == "Schindler's List"
+    assert (entity['year'], entity['rating'], entity['rating_count']) == (1993, 9.0, 1400000)
+    assert entity['genres'] == ['Drama', 'History']
+    # The JSON-LD director and actor are not linked again; Tom Hanks is only "more like this"
+    assert entity['credits'] == [
+        ('nm0000553', 'actor'), ('nm0000229', 'director'), ('nm0447745', 'writer'), ('nm0000146', 'cast'),
+    ]
+
+
+@pytest.mark.parametrize('section, role', [
+    ('Directed by', 'director'),
+    ('Writing Credits', 'writer'),
+    ('Stars', 'cast'),
+    ('Full Cast & Crew', 'cast'),
+    ('Produced by', 'producer'),
+    ('More like this', None),
+    ('', None),
+])
+def test_section_role(section, role):
+    assert section_role(section) == role
+
+
+def test_pages_without_json_ld_fall_back_to_the_markup():
+    entity = page_entity(URL, ['not json'], [('/name/nm0000001/', 'Cast'), ('/name/nm0000002/', 'Photos')], ' Heading ')
+    assert entity['entity_name'] == 'Heading' and entity['credits'] == [('nm0000001', 'cast')]
+    person = page_entity('https://www.imdb.com/name/nm0000001/', [json.dumps({'@type': 'Person', 'name': 'A',
+                                                                                'birthDate': '1952-06-07'})])
+    assert (person['entity_type'], person['imdb_id'], person['birth_date']) == ('name', 'nm0000001', '1952-06-07')
+    assert page_entity('https://www.imdb.com/chart/top/', []) is None
+
+
+def title(imdb_id, date_time, name='Title', rating=None, genres=(), credits=()):
+    return (imdb_id, 'title', f'hash-{imdb_id}', date_time, name, 'Movie', 1993, rating, None, list(genres),
+            list(credits), None)
+
+
+@pytest.fixture
+def store():
+    conn = sqlite3.connect(':memory:')
+    store = EntityStore(conn)
+    store.create_tables()
+    yield store
+    conn.close()
+
+
+def test_recrawled_titles_replace_their_credits_and_keep_missing_fields(store):
+    store.upsert([title('tt1', '2024-01-01', rating=8.5, genres=['Drama'], credits=[('nm1', 'director'), ('nm2', 'cast')]),
+                  ('nm1', 'name', 'hash-nm1', '2024-01-01', 'Director One', None, None, None, None, [], [], '1950-01-01')])
+    assert store.upsert([title('tt1', '2024-02-01', name=None, genres=['History'], credits=[('nm1', 'writer')])]) == (1, 0)
+    assert store.find_titles() == [('tt1', 'Title', 1993, 8.5, None)]
+    assert store.find_titles(genre='Drama') == [] and store.find_titles(genre='History')[0][0] == 'tt1'
+    assert store.filmography('nm1') == [('tt1', 'Title', 1993, 'writer')] and store.filmography('nm2') == []
+    store.upsert([('nm1', 'name', 'hash-nm1', '2024-02-01', None, None, None, None, None, [], [], None)])
+    assert store.conn.execute('SELECT name, birth_date, updated FROM people').fetchall() == [
+        ('Director One', '1950-01-01', '2024-02-01')]
+
+
+def test_find_titles_filters_and_orders_by_rating(store):
+    store.upsert([title('tt1', '2024-01-01', rating=7.0), title('tt2', '2024-01-01', rating=9.0), title('tt3', '2024-01-01')])
+    assert [row[0] for row in store.find_titles()] == ['tt2', 'tt1', 'tt3']
+    assert [row[0] for row in store.find_titles(min_rating=8)] == ['tt2']
+    assert store.find_titles(year=2000) == [] and len(store.find_titles(limit=1)) == 1
@@ -0,0 +1,89 @@
+import io
+import json
+import sqlite3
+
+import pytest
+
+from imdbcrawler.export import export, page_records, write_feed
+from imdbcrawler.spiders.imdb_database import IMDBDatabase
+
+
+def page(n, date_time, text=None):
+    text = text or ' '.join(f'page{n}-word{i}' for i in range(50))
+    return (f'hash-{n}', f'http://example.com/{n}', date_time, 'text/html', len(text), f'page {n}', text,
+            f'html-{n}-{len(text)}', '{}', None, None, None)
+
+
+@pytest.fixture
+def db(tmp_path):
+    with IMDBDatabase(str(tmp_path / 'pages.db')) as db:
+        yield db
+
+
+def exported(db, watermark):
+    out = io.BytesIO()
+    count, watermark = export(db, out, watermark=watermark)
+    return [json.loads(line)['url'] for line in out.getvalue().splitlines()], watermark
+
+
+def test_export_resumes_after_its_watermark(db):
+    db.save_pages([page(1, '2024-01-01 00:00:00'), page(2, '2024-01-02 00:00:00')])
+    urls, watermark = exported(db, None)
+    assert urls == ['http://example.com/1', 'http://example.com/2']
+    assert exported(db, watermark) == ([], watermark)
+
+
+def test_page_committed_later_with_an_older_date_time_is_exported(db):
+    db.save_pages([page(1, '2024-01-02 00:00:00')])
+    _, watermark = exported(db, None)
+    # A slower writer commits a page it scraped before the exported one
+    db.save_pages([page(2, '2024-01-01 00:00:00')])
+    urls, _ = exported(db, watermark)
+    assert urls == ['http://example.com/2']
+
+
+def test_rewritten_and_touched_pages_are_exported_again(db):
+    db.save_pages([page(1, '2024-01-01 00:00:00'), page(2, '2024-01-01 00:00:00')])
+    _, watermark = exported(db, None)
+    db.save_pages([page(1, '2024-01-03 00:00:00', 'rewritten ' * 50)])
+    db.touch_pages([('hash-2', 'http://example.com/2', '2024-01-04 00:00:00', None, None, None)])
+    urls, _ = exported(db, watermark)
+    assert urls == ['http://example.com/1', 'http://example.com/2']
+
+
+def test_watermark_without_seq_starts_over(db):
+    db.save_pages([page(1, '2024-01-01 00:00:00')])
+    legacy = {'date_time': '2024-01-01 00:00:00', 'rowid': 1}
+    assert [watermark for watermark, _ in page_records(db, watermark=legacy)] == [{'seq': 1}]
+
+
+def test_existing_rows_get_a_seq_in_insertion_order(tmp_path):
+    path = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE pages (url_hash TEXT PRIMARY KEY, url TEXT UNIQUE, date_time DATETIME, content_type TEXT,
+                            content_length INTEGER, title TEXT, html TEXT, html_hash TEXT UNIQUE, metadata TEXT)
+    ''')
+    conn.executemany('INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', [page(2, '2024-01-01 00:00:00')[:9],
+                                                                             page(1, '2024-01-02 00:00:00')[:9]])
+    conn.commit()
+    conn.close()
+    with IMDBDatabase(path) as db:
+        db.save_pages([page(3, '2024-01-01 00:00:00')])
+        assert [(seq, row[0]) for seq, row in db.iter_pages(chunk_size=2)] == [(1, 'hash-2'), (2, 'hash-1'), (3, 'hash-3')]
+
+
+def test_each_run_writes_its_own_range_feed(db, tmp_path):
+    out = str(tmp_path / 'pages.jsonl')
+    db.save_pages([page(1, '2024-01-01 00:00:00'), page(2, '2024-01-02 00:00:00')])
+    count, watermark, first = write_feed(db, out)
+    assert count == 2 and first == str(tmp_path / 'pages.000000000001-000000000002.jsonl')
+    db.save_pages([page(3, '2024-01-03 00:00:00')])
+    # The first feed has not been indexed (deleted) yet; the next run must not overwrite it
+    count, watermark, second = write_feed(db, out, watermark=watermark)
+    assert count == 1 and second == str(tmp_path / 'pages.000000000003-000000000003.jsonl')
+    with open(first, 'rb') as f:
+        assert [json.loads(line)['url'] for line in f] == ['http://example.com/1', 'http://example.com/2']
+    assert write_feed(db, out, watermark=watermark) == (0, watermark, None)
+    assert sorted(path.name for path in tmp_path.glob('pages.*.jsonl*')) == [
+        'pages.000000000001-000000000002.jsonl', 'pages.000000000003-000000000003.jsonl']
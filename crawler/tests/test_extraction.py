@@ -0,0 +1,75 @@
+import asyncio
+import hashlib
+
+import pytest
+
+from imdbcrawler.extraction import ExtractionPool, extract_page, lxml
+
+PARSERS = [pytest.param('lxml', marks=pytest.mark.skipif(lxml is None, reason='lxml is not installed')), 'html.parser']
+BODY = '''<html><head><title>Café Society</title><base href="https://www.imdb.com/title/">
+<style>.x { color: red }</style><script>var hidden = "script text";</script></head>
+<body><h1>Café   Society</h1>
+<p>A comedy
+   in   two acts</p><!-- a comment -->
+<a href="tt0000001/?ref_=nv">First</a> <a href="/chart/top">Top</a> <a href="tt0000001/">Again</a>
+</body></html>'''.encode('utf-8')
+
+
+@pytest.mark.parametrize('parser', PARSERS)
+def test_extract_page(parser):
+    extracted = extract_page(BODY, 'utf-8', parser, url='https://www.imdb.com/find')
+    assert extracted['title'] == 'Café Society'
+    # Scripts and styles are dropped and whitespace runs are folded
+    assert 'script text' not in extracted['text'] and 'color' not in extracted['text']
+    assert 'A comedy in two acts' in extracted['text']
+    assert extracted['text_hash'] == hashlib.md5(extracted['text'].encode()).hexdigest()
+    # Links resolve against <base>, lose tracking parameters and are unique per page
+    assert extracted['links'] == ['https://www.imdb.com/title/tt0000001/', 'https://www.imdb.com/chart/top']
+    assert extracted['entity'] is None
+    assert set(extracted['timings']) == {'parse', 'extract_links', 'extract_entities', 'extract_text'}
+
+
+def test_empty_bodies_and_pages_without_a_url():
+    extracted = extract_page(b'', 'utf-8', 'lxml')
+    assert (extracted['title'], extracted['text'], extracted['links']) == ('No Title', '', [])
+    assert extract_page(BODY, 'utf-8', 'html.parser')['links'] == []
+
+
+@pytest.mark.parametrize('max_workers', [0, 2])
+def test_pool_results_match_inline_extraction(max_workers):
+    pool = ExtractionPool(max_workers=max_workers, max_pending=2, parser='html.parser')
+    urls = [f'https://www.imdb.com/title/tt000000{n}/' for n in range(6)]
+
+    async def extract_all():
+        return await asyncio.gather(*(pool.extract(BODY, 'utf-8', url) for url in urls))
+
+    try:
+        results = asyncio.run(extract_all())
+    finally:
+        pool.shutdown()
+    expected = [extract_page(BODY, 'utf-8', 'html.parser', url) for url in urls]
+    for result, inline in zip(results, expected):
+        assert {key: value for key, value in result.items() if key != 'timings'} == \
+            {key: value for key, value in inline.items() if key != 'timings'}
+    assert pool.executor is None and pool.pending == 0
+
+
+def test_pending_extractions_are_bounded():
+    pool = ExtractionPool(max_workers=1, max_pending=2, parser='html.parser')
+    peak = 0
+
+    async def extract(url):
+        nonlocal peak
+        task = asyncio.ensure_future(pool.extract(BODY, 'utf-8', url))
+        await asyncio.sleep(0)
+        peak = max(peak, pool.pending)
+        return await task
+
+    async def extract_all():
+        return await asyncio.gather(*(extract(f'https://www.imdb.com/title/tt000000{n}/') for n in range(5)))
+
+    try:
+        assert len(asyncio.run(extract_all())) == 5
+    finally:
+        pool.shutdown()
+    assert peak == 2
@@ -0,0 +1,86 @@
+import time
+
+import pytest
+
+from imdbcrawler.checkpoint import resume_frontier
+from imdbcrawler.frontier import CLAIMED, DONE, PENDING, Frontier, url_hash_for
+from imdbcrawler.spiders.imdb_database import IMDBDatabase
+
+
+@pytest.fixture
+def frontier(tmp_path):
+    with Frontier(str(tmp_path / 'frontier.db'), partitions=4) as frontier:
+        yield frontier
+
+
+def states(frontier):
+    return dict(frontier.conn.execute('SELECT url, state FROM frontier').fetchall())
+
+
+def test_claims_stay_claimed_until_marked_done(frontier):
+    frontier.assign_partitions(1)
+    frontier.push_urls(['https://example.com/a', 'https://example.com/b'])
+    rows = frontier.claim(0, 10)
+    assert len(rows) == 2
+    assert set(states(frontier).values()) == {CLAIMED}
+    frontier.mark_done([rows[0][0]])
+    assert sorted(states(frontier).values()) == [CLAIMED, DONE]
+
+
+def test_expired_leases_are_reclaimed_and_renewed_ones_kept(frontier):
+    frontier.assign_partitions([0, 1])
+    frontier.push_urls([f'https://example.com/{n}' for n in range(20)])
+    frontier.claim(0, 100)
+    frontier.claim(1, 100)
+    frontier.conn.execute('UPDATE frontier SET claimed_at = ?', (time.time() - 1000,))
+    frontier.heartbeat(0)
+    assert frontier.reclaim_expired(300) == frontier.conn.execute(
+        'SELECT COUNT(*) FROM frontier WHERE worker = 1').fetchone()[0]
+    rows = frontier.conn.execute('SELECT worker, state FROM frontier').fetchall()
+    assert all(state == (CLAIMED if worker == 0 else PENDING) for worker, state in rows)
+
+
+def test_outstanding_count_ignores_dead_owners_and_own_claims(frontier):
+    frontier.assign_partitions([0, 1])
+    frontier.push_urls([f'https://example.com/{n}' for n in range(40)])
+    owned_by_1 = frontier.pending_count(1)
+    assert 0 < owned_by_1 < 40
+    claimed = len(frontier.claim(0, 100))
+    assert frontier.outstanding_count() == 40
+    # Worker 0 is idle: its own claims are handled, worker 1's partitions are not
+    assert frontier.outstanding_count(300, worker=0) == owned_by_1
+    frontier.conn.execute('UPDATE frontier_workers SET heartbeat = ? WHERE worker = 1', (time.time() - 1000,))
+    assert frontier.outstanding_count(300, worker=0) == 0
+    assert frontier.outstanding_count(300, worker=1) == claimed
+
+
+def test_release_returns_claims_to_the_queue(frontier):
+    frontier.assign_partitions(1)
+    frontier.push_urls(['https://example.com/a'])
+    frontier.claim(0, 10)
+    frontier.release(0)
+    assert states(frontier) == {'https://example.com/a': PENDING}
+    assert frontier.claim(0, 10)[0][4] == 1
+
+
+def test_resume_requeues_only_urls_without_a_stored_outcome(frontier, tmp_path):
+    frontier.assign_partitions(1)
+    frontier.push_urls([f'https://example.com/{n}' for n in range(4)])
+    rows = frontier.claim(0, 10)
+    # Two outcomes were stored (a redirect or a robots.txt drop stores no page),
+    # then the worker died holding the other two claims
+    frontier.mark_done([row[0] for row in rows[:2]])
+    assert resume_frontier(frontier, str(tmp_path / 'missing.db')) == 2
+    assert sorted(states(frontier).values()) == [PENDING, PENDING, DONE, DONE]
+
+
+def test_resume_skips_pending_urls_already_stored(frontier, tmp_path):
+    db_name = str(tmp_path / 'pages.db')
+    text = ' '.join(f'word{n}' for n in range(20))
+    with IMDBDatabase(db_name) as db:
+        db.save_page(url_hash_for('https://example.com/a'), 'https://example.com/a', '2024-01-01 00:00:00',
+                     'text/html', len(text), 'a', text, 'html-a', '{}')
+    frontier.assign_partitions(1)
+    frontier.push_urls(['https://example.com/a', 'https://example.com/b'])
+    assert resume_frontier(frontier, db_name) == 0
+    assert states(frontier) == {'https://example.com/a': DONE, 'https://example.com/b': PENDING}
@@ -0,0 +1,53 @@
+import os
+import signal
+import socket
+import sqlite3
+import sys
+
+import pytest
+
+from imdbcrawler.launcher import WorkerLauncher, crawl_args
+
+KEYWORDS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'keywords.json')
+SETTINGS = ['RATE_LIMIT_ENABLED=False', 'ROBOTSTXT_OBEY=False', 'RETRY_ENABLED=False', 'EXTRACTION_WORKERS=0',
+            'IMDB_VECTOR_MODEL_DIR=', 'LOG_LEVEL=ERROR', f'PRIORITY_KEYWORDS_FILE={KEYWORDS}']
+
+
+@pytest.fixture
+def launcher(tmp_path, monkeypatch):
+    # Workers start in the launching process's directory, where their databases go
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('SCRAPY_SETTINGS_MODULE', 'imdbcrawler.settings')
+    return WorkerLauncher(['scrapy.cmdline', 'imdbcrawler.spiders.ImdbCrawler'])
+
+
+def command(start_url, *settings):
+    return [sys.executable, 'run_crawler.py', start_url, '127.0.0.1', *settings]
+
+
+def test_crawl_args():
+    assert crawl_args('https://www.imdb.com/', 'www.imdb.com', ['A=1']) == [
+        'scrapy', 'crawl', 'imdb_crawler', '-a', 'start_url=https://www.imdb.com/', '-a', 'allowed_domain=www.imdb.com',
+        '-s', 'A=1',
+    ]
+
+
+def test_forked_workers_report_their_exit_status(launcher, tmp_path):
+    # Nothing listens on port 9: the only request fails and the crawl finishes
+    worker = launcher.launch(command('http://127.0.0.1:9/', *SETTINGS))
+    assert worker.pid and worker.wait(60) == 0 and worker.returncode == worker.poll() == 0
+    with sqlite3.connect(str(tmp_path / 'frontier.db')) as conn:
+        assert conn.execute('SELECT url FROM frontier').fetchall() == [('http://127.0.0.1:9/',)]
+    # scrapy's usage error
+    assert launcher.launch(command('http://127.0.0.1:9/', 'NOT_A_SETTING')).wait(60) == 2
+
+
+def test_a_hung_worker_can_be_killed(launcher):
+    with socket.socket() as server:
+        # Accepts connections into the backlog but never answers
+        server.bind(('127.0.0.1', 0))
+        server.listen()
+        worker = launcher.launch(command(f'http://127.0.0.1:{server.getsockname()[1]}/', *SETTINGS))
+        assert worker.wait(2) is None and worker.poll() is None
+        worker.kill()
+        assert worker.wait(30) == -signal.SIGKILL
@@ -0,0 +1,47 @@
+import pytest
+
+from imdbcrawler.links import LinkFilter, canonicalize, page_links
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('HTTPS://WWW.IMDb.com:443/title/tt0111161/', 'https://www.imdb.com/title/tt0111161/'),
+    ('http://www.imdb.com:80', 'http://www.imdb.com/'),
+    ('http://www.imdb.com:8080/a', 'http://www.imdb.com:8080/a'),
+    ('https://www.imdb.com/title/tt0111161/?ref_=nv_sr_1#cast', 'https://www.imdb.com/title/tt0111161/'),
+    ('https://www.imdb.com/chart/top?pf_rd_m=A&utm_source=x&page=2&fbclid=y', 'https://www.imdb.com/chart/top?page=2'),
+    ('https://www.imdb.com/search?b=2&a=1&a=0', 'https://www.imdb.com/search?a=0&a=1&b=2'),
+    ('https://www.imdb.com/find?q=', 'https://www.imdb.com/find?q='),
+    ('  https://www.imdb.com/name/nm0000151/  ', 'https://www.imdb.com/name/nm0000151/'),
+    ('mailto:someone@imdb.com', None),
+    ('javascript:void(0)', None),
+    ('http://[::1', None),
+])
+def test_canonicalize(url, expected):
+    assert canonicalize(url) == expected
+
+
+def test_canonical_form_is_stable():
+    url = canonicalize('https://www.imdb.com/search/title/?genres=drama&ref_=x&title_type=feature')
+    assert canonicalize(url) == url
+
+
+def test_page_links_resolve_and_deduplicate():
+    hrefs = ['/title/tt1/?ref_=a', '/title/tt1/?ref_=b', 'tt2/#plot', '//www.imdb.com/name/nm1/', 'mailto:x@y']
+    assert page_links(hrefs, 'https://www.imdb.com/title/') == [
+        'https://www.imdb.com/title/tt1/',
+        'https://www.imdb.com/title/tt2/',
+        'https://www.imdb.com/name/nm1/',
+    ]
+
+
+def test_link_filter_keeps_fresh_on_site_pages():
+    link_filter = LinkFilter(['imdb.com'], cache_size=10)
+    links = [
+        'https://www.imdb.com/title/tt1/',
+        'https://m.imdb.com/title/tt2/',
+        'https://notimdb.com/title/tt3/',
+        'https://www.imdb.com/poster.jpg',
+        'https://www.imdb.com/',
+    ]
+    assert link_filter.filter(links, source='https://www.imdb.com:443/') == links[:2]
+    assert link_filter.filter(links[:2] + ['https://www.imdb.com/title/tt4/']) == ['https://www.imdb.com/title/tt4/']
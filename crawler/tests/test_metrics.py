@@ -0,0 +1,75 @@
+import json
+import time
+
+import pytest
+from scrapy import Spider
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request, Response
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from imdbcrawler.metrics import CrawlMetrics, aggregate_snapshots, read_latest_snapshot, stage_summary
+from imdbcrawler.timings import record_timing, timed
+
+
+@pytest.fixture
+def stats():
+    return MemoryStatsCollector(get_crawler(Spider))
+
+
+def test_timings_accumulate_per_stage(stats, monkeypatch):
+    record_timing(stats, 'parse', 0.2)
+    record_timing(stats, 'sqlite_write', 0.3, count=3)
+    clock = iter([10.0, 10.5])
+    monkeypatch.setattr(time, 'perf_counter', lambda: next(clock))
+    with pytest.raises(ValueError), timed(stats, 'parse'):
+        raise ValueError
+    assert stats.get_value('timing/parse/count') == 2
+    assert stats.get_value('timing/parse/seconds') == pytest.approx(0.7)
+    assert stats.get_value('timing/parse/max_seconds') == 0.5
+    # A batch records its mean as the per-call maximum
+    assert stats.get_value('timing/sqlite_write/max_seconds') == pytest.approx(0.1)
+    assert stage_summary(stats.get_stats()) == {
+        'parse': {'count': 2, 'mean_ms': 350.0, 'max_ms': 500.0, 'total_s': 0.7},
+        'sqlite_write': {'count': 3, 'mean_ms': 100.0, 'max_ms': 100.0, 'total_s': 0.3},
+    }
+    # Storage used outside a crawl has no stats collector to record into
+    record_timing(None, 'parse', 1.0)
+
+
+def snapshot(worker, stats):
+    return json.dumps({'worker': worker, 'stats': stats}) + '\n'
+
+
+def test_worker_snapshots_are_aggregated(tmp_path):
+    (tmp_path / 'worker-0.jsonl').write_text(
+        snapshot(0, {'item_scraped_count': 1}) +
+        snapshot(0, {'item_scraped_count': 10, 'timing/parse/count': 10, 'timing/parse/seconds': 1.0,
+                     'timing/parse/max_seconds': 0.3, 'fastpath/hit_rate': 0.5, 'finish_reason': 'finished'}))
+    # Worker 1 was killed halfway through its last line
+    (tmp_path / 'worker-1.jsonl').write_text(
+        snapshot(1, {'item_scraped_count': 5, 'timing/parse/count': 5, 'timing/parse/seconds': 1.5,
+                     'timing/parse/max_seconds': 0.4, 'memusage/max': 100}) + '{"worker": 1, "sta')
+    assert read_latest_snapshot(str(tmp_path / 'worker-1.jsonl'))['stats']['item_scraped_count'] == 5
+    assert read_latest_snapshot(str(tmp_path / 'missing.jsonl')) is None
+
+    merged = aggregate_snapshots(str(tmp_path))
+    assert merged['workers'] == 2
+    assert merged['stats'] == {'item_scraped_count': 15, 'timing/parse/count': 15, 'timing/parse/seconds': 2.5,
+                               'timing/parse/max_seconds': 0.4, 'memusage/max': 100}
+    assert merged['stages']['parse'] == {'count': 15, 'mean_ms': 166.667, 'max_ms': 400.0, 'total_s': 2.5}
+
+
+def test_extension_writes_snapshots_and_times_downloads(tmp_path):
+    crawler = get_crawler(Spider, {'METRICS_DIR': str(tmp_path), 'FRONTIER_WORKER_ID': 3})
+    metrics = CrawlMetrics.from_crawler(crawler)
+    request = Request('https://example.com', meta={'download_latency': 0.25})
+    metrics.response_received(Response(request.url), request, None)
+    metrics.response_received(Response(request.url), Request(request.url), None)
+    metrics.write_snapshot()
+    metrics.write_snapshot(sample_queues=False)
+    latest = read_latest_snapshot(str(tmp_path / 'worker-3.jsonl'))
+    assert latest['worker'] == 3
+    assert latest['stages']['download'] == {'count': 1, 'mean_ms': 250.0, 'max_ms': 250.0, 'total_s': 0.25}
+    with pytest.raises(NotConfigured):
+        CrawlMetrics.from_crawler(get_crawler(Spider, {'METRICS_ENABLED': False}))
@@ -0,0 +1,63 @@
+import sqlite3
+
+import pytest
+
+from imdbcrawler.spiders.imdb_database import IMDBDatabase
+from imdbcrawler.spiders.near_duplicates import NearDuplicateIndex
+
+TEMPLATE = ' '.join(f'word{n}' for n in range(300))
+
+
+@pytest.fixture
+def index():
+    conn = sqlite3.connect(':memory:')
+    index = NearDuplicateIndex(conn, threshold=0.9)
+    index.create_tables()
+    yield index
+    conn.close()
+
+
+def page(url, text):
+    url_hash = f'hash-{url}'
+    return (url_hash, url, '2024-01-01 00:00:00', 'text/html', len(text), url, text, f'html-{url}', '{}', None, None, None)
+
+
+def test_texts_without_shingles_have_no_signature(index):
+    assert index.signature('') is None
+    assert index.signature('two words') is None
+    assert index.signature('three whole words') is not None
+
+
+def test_unsigned_pages_are_never_near_duplicates(index):
+    index.add(1, 'a', index.signature(''))
+    assert index.max_similarity(index.signature('')) is None
+    assert index.candidates(index.signature(TEMPLATE)) == []
+
+
+def test_identical_text_scores_one(index):
+    signature = index.signature(TEMPLATE)
+    index.add(1, 'a', signature)
+    assert index.max_similarity(index.signature(TEMPLATE)) == 1.0
+
+
+def test_popular_buckets_do_not_hide_the_duplicate(index):
+    # Templated pages fill every bucket the new page falls into; only one is an exact copy
+    for rowid in range(1, 201):
+        index.add(rowid, f'template-{rowid}', index.signature(f'{TEMPLATE} tail{rowid}'))
+    text = f'{TEMPLATE} unique tail of the duplicate page'
+    index.add(500, 'duplicate', index.signature(text))
+    assert 500 in index.candidates(index.signature(text))
+    assert index.max_similarity(index.signature(text)) == 1.0
+
+
+def test_empty_pages_are_all_stored(tmp_path):
+    with IMDBDatabase(str(tmp_path / 'pages.db')) as db:
+        db.save_pages([page('https://example.com/a', ''), page('https://example.com/b', '')])
+        assert db.cursor.execute('SELECT COUNT(*) FROM pages').fetchone()[0] == 2
+
+
+def test_near_duplicate_is_not_inserted(tmp_path):
+    with IMDBDatabase(str(tmp_path / 'pages.db')) as db:
+        db.save_pages([page('https://example.com/a', TEMPLATE)])
+        db.save_pages([page('https://example.com/b', TEMPLATE + ' word300')])
+        assert db.cursor.execute('SELECT COUNT(*) FROM pages').fetchone()[0] == 1
@@ -0,0 +1,142 @@
+import hashlib
+import sqlite3
+
+import pytest
+from scrapy import Spider
+from scrapy.utils.test import get_crawler
+
+from imdbcrawler.items import ImdbcrawlerItem, PageTouchItem
+from imdbcrawler.pipelines import ImdbcrawlerPipeline, pages_flush_failed, pages_flushed
+from imdbcrawler.spiders.imdb_database import IMDBDatabase, PAGE_COLUMNS
+
+
+def page(name, text, date_time='2024-01-01 00:00:00', body_hash=None):
+    text = ' '.join(f'{text}-word{i}' for i in range(30))
+    return (f'hash-{name}', f'https://example.com/{name}', date_time, 'text/html', len(text), name, text,
+            hashlib.md5(text.encode()).hexdigest(), '{}', None, None, body_hash)
+
+
+def rows(db):
+    return {url_hash: (date_time, html_hash) for url_hash, date_time, html_hash in
+            db.conn.execute('SELECT url_hash, date_time, html_hash FROM pages')}
+
+
+def test_pages_converging_on_stored_text_keep_the_batch(tmp_path):
+    with IMDBDatabase(str(tmp_path / 'pages.db')) as db:
+        db.save_pages([page('a', 'alpha'), page('b', 'beta')])
+        before = rows(db)
+        # b now serves a's text; c and d are unrelated pages in the same batch
+        db.save_pages([page('b', 'alpha', '2024-02-01 00:00:00'), page('c', 'gamma'), page('d', 'delta')])
+        after = rows(db)
+    assert after['hash-a'] == before['hash-a']
+    assert after['hash-b'] == ('2024-02-01 00:00:00', before['hash-b'][1])
+    assert {'hash-c', 'hash-d'} <= set(after)
+
+
+def test_a_rewrite_to_text_inserted_in_the_same_batch_is_touched(tmp_path):
+    with IMDBDatabase(str(tmp_path / 'pages.db')) as db:
+        db.save_pages([page('a', 'alpha')])
+        before = rows(db)
+        db.save_pages([page('c', 'gamma'), page('a', 'gamma', '2024-02-01 00:00:00')])
+        after = rows(db)
+    assert after['hash-a'] == ('2024-02-01 00:00:00', before['hash-a'][1])
+    assert after['hash-c'][1] == page('c', 'gamma')[7]
+
+
+class Signals:
+    def __init__(self):
+        self.sent = []
+        self.kwargs = []
+
+    def send_catch_log(self, signal, **kwargs):
+        self.sent.append(signal)
+        self.kwargs.append(kwargs)
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    pipeline = ImdbcrawlerPipeline(str(tmp_path / 'pages.db'), batch_size=100, flush_interval=60)
+    pipeline.signals = Signals()
+    pipeline.spider = Spider('test')
+    pipeline.db.open()
+    yield pipeline
+    pipeline.db.close()
+
+
+def test_a_failed_flush_keeps_its_rows_and_holds_back_the_frontier(pipeline, monkeypatch):
+    pipeline.buffer = [page('a', 'alpha'), page('b', 'beta')]
+    save_pages = pipeline.db.save_pages
+
+    def locked(pages):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(pipeline.db, 'save_pages', locked)
+    pipeline.flush()
+    assert pipeline.signals.sent == [pages_flush_failed]
+    assert len(pipeline.buffer) == 2
+
+    monkeypatch.setattr(pipeline.db, 'save_pages', save_pages)
+    pipeline.buffer.append(page('c', 'gamma'))
+    pipeline.flush()
+    assert pipeline.signals.sent == [pages_flush_failed, pages_flushed]
+    assert pipeline.buffer == [] and set(rows(pipeline.db)) == {'hash-a', 'hash-b', 'hash-c'}
+
+
+def test_flushes_report_the_bodies_they_committed(pipeline, monkeypatch):
+    pipeline.buffer = [page('a', 'alpha', body_hash='body-a')]
+    touch_pages = pipeline.db.touch_pages
+
+    def locked(touches):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(pipeline.db, 'touch_pages', locked)
+    pipeline.touches = [('hash-a', 'https://example.com/a', '2024-01-02 00:00:00', None, None, 'body-a2')]
+    pipeline.flush()
+    assert pipeline.signals.sent == [pages_flush_failed]
+
+    monkeypatch.setattr(pipeline.db, 'touch_pages', touch_pages)
+    # b has the same text as a, so it is not stored and its body is not reported
+    pipeline.buffer = [page('b', 'alpha', body_hash='body-b'), page('c', 'gamma', body_hash='body-c')]
+    pipeline.flush()
+    assert pipeline.signals.sent == [pages_flush_failed, pages_flushed]
+    assert pipeline.signals.kwargs[-1]['bodies'] == [('hash-a', 'body-a'), ('hash-c', 'body-c'), ('hash-a', 'body-a2')]
+    pipeline.flush()
+    assert pipeline.signals.kwargs[-1]['bodies'] == []
+
+
+def item(name, text, **fields):
+    return ImdbcrawlerItem(**dict(zip(PAGE_COLUMNS, page(name, text))), **fields)
+
+
+def test_items_are_written_in_batches(tmp_path):
+    crawler = get_crawler(Spider, {'IMDB_DB_NAME': str(tmp_path / 'pages.db'), 'IMDB_DB_BATCH_SIZE': 3,
+                                   'IMDB_DB_FLUSH_INTERVAL': 60})
+    pipeline = ImdbcrawlerPipeline.from_crawler(crawler)
+    spider = Spider('test')
+    pipeline.open_spider(spider)
+    statements = []
+    pipeline.db.conn.set_trace_callback(statements.append)
+
+    pipeline.process_item(item('a', 'alpha', imdb_id='tt1', entity_type='title', entity_name='Alpha'), spider)
+    pipeline.process_item(item('b', 'beta'), spider)
+    assert statements == [] and rows(pipeline.db) == {}
+    # A touch counts towards the batch like a page
+    pipeline.process_item(PageTouchItem(url_hash='hash-x', url='https://example.com/x', date_time='2024-01-02 00:00:00'), spider)
+    assert set(rows(pipeline.db)) == {'hash-a', 'hash-b'}
+    assert pipeline.buffer == pipeline.touches == pipeline.entities == []
+    assert pipeline.db.entities.find_titles() == [('tt1', 'Alpha', None, None, None)]
+    # One transaction each for the pages, the touches and the entities of the batch
+    assert statements.count('COMMIT') == 3
+
+    pipeline.process_item(item('c', 'gamma'), spider)
+    pipeline.flush_if_stale()
+    assert 'hash-c' not in rows(pipeline.db)
+    pipeline.last_flush -= 60
+    pipeline.flush_if_stale()
+    assert 'hash-c' in rows(pipeline.db)
+
+    pipeline.process_item(item('d', 'delta'), spider)
+    pipeline.close_spider(spider)
+    with IMDBDatabase(str(tmp_path / 'pages.db')) as db:
+        assert set(rows(db)) == {'hash-a', 'hash-b', 'hash-c', 'hash-d'}
+    assert crawler.stats.get_value('timing/db_flush/count') == 3
@@ -0,0 +1,89 @@
+import json
+import os
+import pytest
+from scrapy import Spider
+from scrapy.http import Request
+from scrapy.utils.test import get_crawler
+
+from imdbcrawler.frontier import Frontier, FrontierScheduler
+from imdbcrawler.keyword_matcher import KeywordMatcher
+from imdbcrawler.middlewares import PriorityMiddleware
+
+
+@pytest.fixture
+def keywords(tmp_path):
+    path = str(tmp_path / 'keywords.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'high': {'title': ['movie', 'episode']}, 'middle': ['news'], 'low': ['privacy', 'help']}, f)
+    return path
+
+
+def priority(middleware, url):
+    return middleware.prioritize(Request(url)).priority
+
+
+def test_keyword_levels_set_the_priority(keywords):
+    middleware = PriorityMiddleware(keywords)
+    assert priority(middleware, 'https://www.imdb.com/title/tt0000001/') == 1
+    assert priority(middleware, 'https://www.imdb.com/news/ni00000001/') == 0
+    assert priority(middleware, 'https://www.imdb.com/privacy') == -1
+    assert priority(middleware, 'https://www.imdb.com/chart/top/') == 0
+    # The highest level found wins, in the query string too
+    assert priority(middleware, 'https://www.imdb.com/help/?ref=movie') == 1
+
+
+def test_keywords_are_reloaded_when_the_file_changes(keywords):
+    middleware = PriorityMiddleware(keywords, reload_interval=0)
+    assert priority(middleware, 'https://www.imdb.com/privacy') == -1
+    with open(keywords, 'w', encoding='utf-8') as f:
+        json.dump({'high': ['privacy']}, f)
+    os.utime(keywords, (0, os.stat(keywords).st_mtime + 5))
+    assert priority(middleware, 'https://www.imdb.com/privacy') == 1
+
+
+def test_matcher_reports_the_highest_value():
+    matcher = KeywordMatcher([('he', 0), ('she', 2), ('hers', 1)])
+    assert matcher.best_match('ushers') == (2, 'she')
+    assert matcher.best_match('nothing') == (None, None)
+
+
+class LinkSpider(Spider):
+    name = 'links'
+
+    def parse_page(self, response):
+        pass
+
+
+@pytest.fixture
+def scheduler(tmp_path):
+    crawler = get_crawler(LinkSpider)
+    spider = LinkSpider()
+    scheduler = FrontierScheduler(crawler, Frontier(str(tmp_path / 'frontier.db'), partitions=4), 0, batch_size=10)
+    scheduler.frontier.open()
+    scheduler.frontier.assign_partitions(1)
+    scheduler.spider = spider
+    yield scheduler
+    scheduler.frontier.close()
+
+
+def test_spider_requests_reach_the_frontier_with_their_priority(keywords, scheduler):
+    middleware = PriorityMiddleware(keywords)
+    urls = ['https://www.imdb.com/privacy', 'https://www.imdb.com/chart/top/', 'https://www.imdb.com/title/tt0000001/']
+    output = [{'url': 'an item'}] + [Request(url, callback=scheduler.spider.parse_page) for url in urls]
+    for request in middleware.process_spider_output(None, output, scheduler.spider):
+        if isinstance(request, Request):
+            scheduler.enqueue_request(request)
+    scheduler._flush_outgoing()
+    stored = dict(scheduler.frontier.conn.execute('SELECT url, priority FROM frontier').fetchall())
+    assert stored == dict(zip(urls, [-1, 0, 1]))
+
+
+def test_higher_keyword_levels_are_claimed_first(keywords, scheduler):
+    middleware = PriorityMiddleware(keywords)
+    urls = ['https://www.imdb.com/help/', 'https://www.imdb.com/chart/top/', 'https://www.imdb.com/title/tt0000001/']
+    for request in middleware.process_spider_output(None, [Request(url, callback=scheduler.spider.parse_page)
+                                                            for url in urls], scheduler.spider):
+        scheduler.enqueue_request(request)
+    scheduler.batch_size = 1
+    claimed = [scheduler.next_request() for _ in urls]
+    assert [(request.url, request.priority) for request in claimed] == [(urls[2], 1), (urls[1], 0), (urls[0], -1)]
@@ -0,0 +1,105 @@
+import datetime
+
+import pytest
+from scrapy.settings import Settings
+
+from imdbcrawler.ratelimit import HostRateLimiter, retry_after_seconds
+from imdbcrawler.spiders.ImdbCrawler import ImdbCrawler
+
+HOST = 'www.imdb.com'
+
+
+@pytest.fixture
+def limiter(tmp_path):
+    with HostRateLimiter(str(tmp_path / 'rate_limit.db'), rate=2.0, backoff=0.5, recovery=0.25) as limiter:
+        yield limiter
+
+
+def waits(limiter, times, host=HOST):
+    return [limiter.acquire(host, now=now)[0] for now in times]
+
+
+def test_requests_reserve_consecutive_slots(limiter):
+    assert waits(limiter, [100.0, 100.0, 100.0]) == [0.0, 0.5, 1.0]
+    # Once the reserved slots have passed the bucket is idle again
+    assert waits(limiter, [102.0, 102.1]) == pytest.approx([0.0, 0.4])
+    assert waits(limiter, [102.1], host='m.imdb.com') == [0.0]
+
+
+def test_bursts_take_slots_ahead_of_time(tmp_path):
+    with HostRateLimiter(str(tmp_path / 'rate_limit.db'), rate=1.0, burst=3) as limiter:
+        assert waits(limiter, [0.0, 0.0, 0.0, 0.0, 0.0]) == [0.0, 0.0, 0.0, 1.0, 2.0]
+
+
+def test_workers_share_the_bucket(limiter):
+    with HostRateLimiter(limiter.db_name, rate=2.0) as other:
+        assert limiter.acquire(HOST, now=10.0)[0] == 0.0
+        assert other.acquire(HOST, now=10.0)[0] == 0.5
+        assert limiter.acquire(HOST, now=10.0)[0] == 1.0
+
+
+def test_a_lowered_rate_applies_to_stored_buckets(limiter):
+    limiter.acquire(HOST, now=0.0)
+    with HostRateLimiter(limiter.db_name, rate=0.5) as slower:
+        assert slower.acquire(HOST, now=10.0) == (0.0, 0.5)
+        assert slower.acquire(HOST, now=10.0) == (2.0, 0.5)
+
+
+def test_penalize_halves_the_rate_and_blocks_the_host(limiter):
+    limiter.acquire(HOST, now=10.0)
+    assert limiter.penalize(HOST, now=10.0) == 1.0
+    assert limiter.blocked_for(HOST, now=10.0) == 1.0
+    assert limiter.acquire(HOST, now=10.0) == (1.0, 1.0)
+    # More throttled responses from the same burst extend the pause without cutting the rate
+    assert limiter.penalize(HOST, retry_after=5.0, now=10.5) == 1.0
+    assert limiter.blocked_for(HOST, now=10.5) == 5.0
+    assert limiter.acquire(HOST, now=10.5)[0] == 5.0
+
+
+def test_pauses_and_rates_are_bounded(limiter):
+    limiter.penalize(HOST, retry_after=10_000.0, now=0.0)
+    assert limiter.blocked_for(HOST, now=0.0) == limiter.max_backoff
+    now = 0.0
+    for _ in range(10):
+        now += limiter.max_backoff + 1
+        rate = limiter.penalize(HOST, now=now)
+    assert rate == limiter.min_rate == 2.0 / 64
+
+
+def test_reward_recovers_up_to_the_configured_rate(limiter):
+    limiter.acquire(HOST, now=0.0)
+    limiter.penalize(HOST, now=0.0)
+    rates = []
+    for _ in range(3):
+        limiter.reward(HOST)
+        rates.append(limiter.rates()[HOST])
+    assert rates == [1.5, 2.0, 2.0]
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('120', 120.0),
+    (b'5', 5.0),
+    ('-3', 0.0),
+    ('Wed, 21 Oct 2015 07:28:30 GMT', 30.0),
+    ('Wed, 21 Oct 2015 07:27:00 GMT', 0.0),
+    ('soon', None),
+    ('', None),
+    (None, None),
+])
+def test_retry_after_seconds(value, expected):
+    now = datetime.datetime(2015, 10, 21, 7, 28, tzinfo=datetime.timezone.utc).timestamp()
+    assert retry_after_seconds(value, now=now) == expected
+
+
+@pytest.mark.parametrize('overrides, autothrottle', [
+    ({}, False),
+    ({'AUTOTHROTTLE_ENABLED': True}, False),
+    ({'RATE_LIMIT_ENABLED': False}, True),
+    ({'RATE_LIMIT_RPS': 0}, True),
+])
+def test_autothrottle_is_off_while_the_bucket_paces_the_crawl(overrides, autothrottle):
+    settings = Settings()
+    settings.setdict(overrides, priority='cmdline')
+    ImdbCrawler.update_settings(settings)
+    assert settings.getbool('AUTOTHROTTLE_ENABLED') is autothrottle
+    assert 403 not in settings.getlist('RETRY_HTTP_CODES')
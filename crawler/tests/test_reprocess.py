@@ -0,0 +1,86 @@
+import json
+import os
+import sqlite3
+
+import pytest
+from scrapy import Spider
+from scrapy.extensions.httpcache import FilesystemCacheStorage
+from scrapy.http import HtmlResponse, Request, Response
+from scrapy.utils.test import get_crawler
+
+from imdbcrawler.export import load_watermark
+from imdbcrawler.reprocess import Reprocessor
+from imdbcrawler.spiders.imdb_database import IMDBDatabase
+
+TITLE = 'https://www.imdb.com/title/tt0000001/'
+JSON_LD = json.dumps({'@type': 'Movie', 'name': 'First', 'datePublished': '1999-01-01'})
+
+
+def body(n, words=60):
+    text = ' '.join(f'page{n}-word{i}' for i in range(words))
+    return (f'<html><head><title>Page {n}</title><script type="application/ld+json">{JSON_LD}</script></head>'
+            f'<body><h1>Page {n}</h1><p>{text}</p></body></html>').encode()
+
+
+class Cache:
+    """Responses stored the way the spider's HTTPCACHE_ENABLED run leaves them."""
+
+    def __init__(self, directory, gzip):
+        crawler = get_crawler(Spider, {'HTTPCACHE_DIR': directory, 'HTTPCACHE_GZIP': gzip})
+        self.spider = Spider.from_crawler(crawler, name='imdb_crawler')
+        self.storage = FilesystemCacheStorage(crawler.settings)
+        self.storage.open_spider(self.spider)
+        self.dir = os.path.join(self.storage.cachedir, self.spider.name)
+
+    def store(self, url, content, status=200, cls=HtmlResponse, mtime=None):
+        request = Request(url)
+        self.storage.store_response(self.spider, request, cls(url, status=status, body=content, request=request,
+                                                              headers={'Content-Type': 'text/html; charset=utf-8'}))
+        if mtime is not None:
+            path = self.storage._get_request_path(self.spider, request)
+            os.utime(os.path.join(path, 'pickled_meta'), (mtime, mtime))
+
+
+def urls(db_name):
+    with sqlite3.connect(db_name) as conn:
+        return sorted(url for url, in conn.execute('SELECT url FROM pages'))
+
+
+@pytest.mark.parametrize('gzip', [False, True])
+def test_cached_responses_are_replayed_into_a_fresh_database_and_resumed(tmp_path, gzip):
+    cache = Cache(str(tmp_path / 'httpcache'), gzip)
+    cache.store(TITLE, body(1), mtime=1000)
+    cache.store('https://www.imdb.com/missing', body(2), status=404, mtime=1001)
+    cache.store('https://www.imdb.com/robots.txt', b'User-agent: *', cls=Response, mtime=1002)
+    out, state_path = str(tmp_path / 'reprocessed.db'), str(tmp_path / 'state.json')
+
+    counters = Reprocessor(out, workers=0, chunk_size=2, state_path=state_path).from_cache(cache.dir)
+    assert counters == {'read': 3, 'skipped': 2, 'stored': 1}
+    assert urls(out) == [TITLE]
+    state = load_watermark(state_path)
+    assert (state['source'], state['mtime']) == ('cache', 1002)
+    with IMDBDatabase(out) as db:
+        assert db.entities.find_titles() == [('tt0000001', 'First', 1999, None, None)]
+
+    # The crawl goes on caching; a resumed run only reads what it has not written yet
+    cache.store('https://www.imdb.com/title/tt0000002/', body(3), mtime=2000)
+    counters = Reprocessor(out, workers=0, state_path=state_path).from_cache(cache.dir, state)
+    assert counters == {'read': 1, 'skipped': 0, 'stored': 2}
+    assert load_watermark(state_path)['mtime'] == 2000
+
+
+def test_stored_pages_are_deduplicated_again_at_a_new_threshold(tmp_path):
+    source = str(tmp_path / 'pages.db')
+    text = ' '.join(f'word{i}' for i in range(300))
+    with IMDBDatabase(source, similarity_threshold=1.0) as db:
+        for n, page_text in enumerate([text, text + ' ' + ' '.join(f'footer{i}' for i in range(15)), ' '.join(f'other{i}' for i in range(300))]):
+            db.save_page(f'hash-{n}', f'https://example.com/{n}', '2024-01-01 00:00:00', 'text/html', len(page_text),
+                         f'Page {n}', page_text, f'html-{n}', '{}')
+    assert len(urls(source)) == 3
+    out, state_path = str(tmp_path / 'reprocessed.db'), str(tmp_path / 'state.json')
+
+    counters = Reprocessor(out, threshold=0.9, workers=2, chunk_size=2, state_path=state_path).from_pages(source)
+    assert counters == {'read': 3, 'skipped': 0, 'stored': 2}
+    assert urls(out) == ['https://example.com/0', 'https://example.com/2']
+    assert load_watermark(state_path) == {'source': 'pages', 'seq': 3}
+    assert Reprocessor(out, workers=0).from_pages(source, load_watermark(state_path))['read'] == 0
@@ -0,0 +1,77 @@
+import hashlib
+
+import pytest
+
+from imdbcrawler.spiders.imdb_database import IMDBDatabase
+from imdbcrawler.spiders.search_index import match_expression
+
+
+def page(n, text, title=None):
+    text = f'{text} ' + ' '.join(f'page{n}-word{i}' for i in range(20))
+    return (f'hash-{n}', f'https://example.com/{n}', '2024-01-01 00:00:00', 'text/html', len(text),
+            title or f'Title {n}', text, hashlib.md5(text.encode()).hexdigest(), '{}', None, None, None)
+
+
+def urls(db, query):
+    return [url for url, *_ in db.search.search(query)]
+
+
+@pytest.fixture
+def db(tmp_path):
+    with IMDBDatabase(str(tmp_path / 'pages.db')) as db:
+        db.save_pages([page(0, 'shawshank prison drama'), page(1, 'godfather crime family')])
+        yield db
+
+
+def test_inserted_pages_are_searchable(db):
+    assert urls(db, 'prison') == ['https://example.com/0']
+    assert sorted(urls(db, 'crime prison')) == ['https://example.com/0', 'https://example.com/1']
+    assert urls(db, 'Title') and db.search.generation() == 2
+
+
+def test_rewritten_pages_are_reindexed(db):
+    generation = db.search.generation()
+    db.save_pages([page(0, 'shawshank escape tunnel')])
+    assert urls(db, 'prison') == []
+    assert urls(db, 'tunnel') == ['https://example.com/0']
+    assert db.search.generation() == generation + 1
+
+
+def test_touches_leave_the_index_alone(db):
+    generation = db.search.generation()
+    db.touch_pages([('hash-0', 'https://example.com/0', '2024-02-01 00:00:00', '"etag"', None, 'body')])
+    assert db.search.generation() == generation
+    assert urls(db, 'prison') == ['https://example.com/0']
+
+
+def test_deleted_pages_leave_the_index(db):
+    generation = db.search.generation()
+    with db.conn:
+        db.conn.execute("DELETE FROM pages WHERE url_hash = 'hash-1'")
+    assert urls(db, 'godfather') == []
+    assert db.search.generation() == generation + 1
+
+
+def test_existing_pages_are_indexed_on_first_use(tmp_path):
+    db_name = str(tmp_path / 'pages.db')
+    with IMDBDatabase(db_name) as db:
+        db.save_pages([page(0, 'shawshank prison drama')])
+        db.conn.execute('DROP TABLE pages_fts')
+    with IMDBDatabase(db_name) as db:
+        assert urls(db, 'prison') == ['https://example.com/0']
+
+
+def test_blob_pages_are_counted_as_title_only(tmp_path):
+    with IMDBDatabase(str(tmp_path / 'pages.db'), storage='blob') as db:
+        db.save_pages([page(0, 'shawshank prison drama', title='Shawshank')])
+        assert urls(db, 'prison') == []
+        assert urls(db, 'shawshank') == ['https://example.com/0']
+        assert db.search.title_only_pages() == 1
+    with IMDBDatabase(str(tmp_path / 'raw.db')) as db:
+        db.save_pages([page(0, 'shawshank prison drama')])
+        assert db.search.title_only_pages() == 0
+
+
+def test_queries_cannot_be_syntax_errors():
+    assert match_expression('"shawshank  redemption" AND (') == '"shawshank redemption" OR "AND"'
+    assert match_expression('  !! ') is None
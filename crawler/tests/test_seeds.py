@@ -0,0 +1,48 @@
+import random
+
+import pytest
+
+from imdb_simulator import serve
+from imdbcrawler.seeds import SeedGenerator, prefix_key
+
+TITLES = 40
+
+
+@pytest.fixture
+def site():
+    server = serve(0, titles=TITLES, names=20)
+    yield f'http://127.0.0.1:{server.server_address[1]}/'
+    server.shutdown()
+    server.server_close()
+
+
+def test_discovers_the_sitemap_urls_and_caches_them(site, tmp_path):
+    cache_path = str(tmp_path / 'seeds.json')
+    generator = SeedGenerator(site, cache_path=cache_path, timeout=5)
+    urls = generator.candidates()
+    assert urls == [f'{site}title/tt{title_id:07d}/' for title_id in range(TITLES)]
+    assert generator.robots is not None and not generator.allowed(f'{site}help/')
+
+    # A fresh generator reads the cache instead of the site
+    cached = SeedGenerator(site, cache_path=cache_path, timeout=5)
+    cached.discover = lambda: pytest.fail('the seed cache was not used')
+    assert cached.candidates() == urls
+
+
+def test_seeds_are_distinct_sitemap_urls(site, tmp_path):
+    generator = SeedGenerator(site, cache_path=str(tmp_path / 'seeds.json'), timeout=5)
+    seeds = generator.seeds(8, rng=random.Random(1))
+    assert len(seeds) == len(set(seeds)) == 8
+    assert set(seeds) <= set(generator.candidates())
+
+
+def test_pending_urls_are_spread_across_prefixes(site, tmp_path):
+    pending = (
+        [f'{site}title/tt{n:07d}/' for n in range(10)]
+        + [f'{site}name/nm{n:07d}/' for n in range(5)]
+        + [f'{site}chart/top', f'{site}calendar/', 'http://elsewhere.example/title/tt0000001/']
+    )
+    generator = SeedGenerator(site, cache_path=str(tmp_path / 'seeds.json'), timeout=5)
+    seeds = generator.seeds(4, pending=pending, rng=random.Random(1))
+    assert sorted(prefix_key(url).split('/', 1)[1] for url in seeds) == ['calendar', 'chart', 'name', 'title']
+    assert not any('elsewhere' in url for url in seeds)
@@ -0,0 +1,104 @@
+import hashlib
+import sqlite3
+
+import pytest
+
+from imdbcrawler.shards import ShardMerger, shard_path
+from imdbcrawler.spiders.imdb_database import IMDBDatabase
+
+
+def page(n, date_time, text=None):
+    text = text or ' '.join(f'page{n}-word{i}' for i in range(20))
+    return (f'hash-{n}', f'https://example.com/{n}', date_time, 'text/html', len(text), f'Title {n}', text,
+            hashlib.md5(text.encode()).hexdigest(), '{}', None, None, None)
+
+
+def stored(db_name):
+    conn = sqlite3.connect(db_name)
+    try:
+        return dict(conn.execute('SELECT url_hash, date_time FROM pages'))
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def shard(tmp_path):
+    return shard_path(str(tmp_path / 'shards'), 0)
+
+
+@pytest.fixture
+def merger(tmp_path, shard):
+    return ShardMerger(str(tmp_path / 'pages.db'), str(tmp_path / 'shards'))
+
+
+def test_rows_committed_after_the_watermark_are_merged(merger, shard):
+    with IMDBDatabase(shard) as db:
+        db.save_pages([page(0, '2024-01-02 00:00:00')])
+    assert merger.merge() == {'worker-0.db': 1}
+
+    # Committed later but crawled earlier: a date_time watermark would skip it
+    with IMDBDatabase(shard) as db:
+        db.save_pages([page(1, '2024-01-01 00:00:00')])
+    assert merger.merge() == {'worker-0.db': 1}
+    assert merger.merge() == {'worker-0.db': 0}
+    assert stored(merger.db.db_name) == {'hash-0': '2024-01-02 00:00:00', 'hash-1': '2024-01-01 00:00:00'}
+
+
+def test_rewritten_rows_are_merged_again(merger, shard):
+    with IMDBDatabase(shard) as db:
+        db.save_pages([page(0, '2024-01-01 00:00:00')])
+    merger.merge()
+    with IMDBDatabase(shard) as db:
+        db.save_pages([page(0, '2024-01-05 00:00:00', text='a rewritten page about something else entirely')])
+    assert merger.merge() == {'worker-0.db': 1}
+    with IMDBDatabase(merger.db.db_name) as db:
+        assert db.get_html('hash-0') == 'a rewritten page about something else entirely'
+
+
+def test_newer_canonical_pages_win(merger, shard):
+    with IMDBDatabase(merger.db.db_name) as db:
+        db.save_pages([page(0, '2024-03-01 00:00:00')])
+    with IMDBDatabase(shard) as db:
+        db.save_pages([page(0, '2024-01-01 00:00:00', text='an older copy of the page')])
+    assert merger.merge() == {'worker-0.db': 0}
+    assert stored(merger.db.db_name) == {'hash-0': '2024-03-01 00:00:00'}
+
+
+def test_legacy_watermarks_merge_from_the_start(merger, shard):
+    with IMDBDatabase(shard) as db:
+        db.save_pages([page(0, '2024-01-01 00:00:00'), page(1, '2024-01-02 00:00:00')])
+    with IMDBDatabase(merger.db.db_name) as db:
+        db.conn.execute('CREATE TABLE shard_merges (shard TEXT PRIMARY KEY, date_time TEXT, row_id INTEGER, merged INTEGER)')
+        db.conn.execute("INSERT INTO shard_merges VALUES ('worker-0.db', '2024-01-02 00:00:00', 2, 2)")
+        db.conn.commit()
+    assert merger.merge() == {'worker-0.db': 2}
+    with merger.db:
+        assert merger.watermark('worker-0.db') > 0
+
+
+def test_blob_storage_is_used_for_merged_pages(tmp_path, shard):
+    with IMDBDatabase(shard) as db:
+        db.save_pages([page(0, '2024-01-01 00:00:00')])
+    merger = ShardMerger(str(tmp_path / 'pages.db'), str(tmp_path / 'shards'), storage='blob')
+    assert merger.merge() == {'worker-0.db': 1}
+    with IMDBDatabase(merger.db.db_name, storage='blob') as db:
+        assert db.conn.execute("SELECT html FROM pages WHERE url_hash = 'hash-0'").fetchone() == (None,)
+        assert db.get_html('hash-0') == page(0, '')[6]
+
+
+def test_near_duplicates_of_stored_pages_are_not_merged(merger, tmp_path):
+    text = ' '.join(f'word{i}' for i in range(300))
+    with IMDBDatabase(merger.db.db_name) as db:
+        db.save_pages([page(0, '2024-01-01 00:00:00', text=text)])
+    with IMDBDatabase(shard_path(str(tmp_path / 'shards'), 0)) as db:
+        db.save_pages([page(1, '2024-01-02 00:00:00', text=text + ' footer'), page(2, '2024-01-02 00:00:00')])
+    # The same near-duplicate from another worker, against a page merged in the same pass
+    with IMDBDatabase(shard_path(str(tmp_path / 'shards'), 1)) as db:
+        db.save_pages([page(3, '2024-01-03 00:00:00', text=' '.join(f'page2-word{i}' for i in range(20)) + ' ad')])
+    assert merger.merge() == {'worker-0.db': 1, 'worker-1.db': 0}
+    assert set(stored(merger.db.db_name)) == {'hash-0', 'hash-2'}
+    # A rewrite of a merged page is merged whatever its similarity
+    with IMDBDatabase(shard_path(str(tmp_path / 'shards'), 0)) as db:
+        db.save_pages([page(2, '2024-02-01 00:00:00', text=text + ' mirror')])
+    assert merger.merge() == {'worker-0.db': 1, 'worker-1.db': 0}
+    assert stored(merger.db.db_name)['hash-2'] == '2024-02-01 00:00:00'
@@ -0,0 +1,83 @@
+import hashlib
+import os
+
+from imdbcrawler.sketches import BloomFilter, BoundedLRU, CountMinSketch, ScalableBloomFilter
+
+
+def digest(value):
+    return hashlib.md5(str(value).encode()).digest()
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000)
+    for n in range(1000):
+        assert not bloom.add(digest(n))
+    assert all(digest(n) in bloom for n in range(1000))
+    assert sum(digest(n) in bloom for n in range(1000, 11000)) < 10
+    assert bloom.full
+
+
+def test_bloom_filter_survives_a_reopen(tmp_path):
+    path = str(tmp_path / 'content')
+    bloom = BloomFilter(1000, path=path)
+    bloom.add(digest('a'))
+    bloom.close()
+    bloom = BloomFilter(1000, path=path)
+    assert not bloom.fresh
+    assert digest('a') in bloom and bloom.count == 1
+
+
+def test_bloom_filter_with_other_parameters_is_rebuilt(tmp_path):
+    path = str(tmp_path / 'content')
+    bloom = BloomFilter(1000, path=path)
+    bloom.add(digest('a'))
+    bloom.close()
+    bloom = BloomFilter(5000, path=path)
+    assert bloom.fresh
+    assert digest('a') not in bloom and bloom.count == 0
+    assert os.path.getsize(path) == bloom.nbytes
+
+
+def test_scalable_filter_drops_filters_built_on_stale_ones(tmp_path):
+    path = str(tmp_path / 'content')
+    bloom = ScalableBloomFilter(100, path=path)
+    for n in range(500):
+        bloom.add(digest(n))
+    assert len(bloom.filters) > 1
+    bloom.close()
+    bloom = ScalableBloomFilter(100, path=path)
+    assert len(bloom.filters) > 1 and digest(1) in bloom
+    bloom.close()
+    bloom = ScalableBloomFilter(200, path=path)
+    assert len(bloom.filters) == 1 and digest(1) not in bloom
+    assert not os.path.exists(f'{path}.1')
+
+
+def test_count_min_sketch_never_undercounts():
+    sketch = CountMinSketch(width=64, depth=4)
+    for n in range(200):
+        for _ in range(n % 5 + 1):
+            sketch.add(digest(n))
+    assert all(sketch.estimate(digest(n)) >= n % 5 + 1 for n in range(200))
+
+
+def test_count_min_sketch_with_other_geometry_is_rebuilt(tmp_path):
+    path = str(tmp_path / 'visits')
+    sketch = CountMinSketch(width=64, depth=4, path=path)
+    sketch.add(digest('a'), 7)
+    sketch.close()
+    sketch = CountMinSketch(width=64, depth=4, path=path)
+    assert sketch.estimate(digest('a')) == 7
+    sketch.close()
+    sketch = CountMinSketch(width=128, depth=4, path=path)
+    assert sketch.fresh and sketch.estimate(digest('a')) == 0
+    sketch.close()
+
+
+def test_bounded_lru_evicts_least_recently_used():
+    cache = BoundedLRU(2)
+    cache['a'] = 1
+    cache['b'] = 2
+    cache['a']
+    cache['c'] = 3
+    assert list(cache) == ['a', 'c']
@@ -0,0 +1,80 @@
+import time
+
+import pytest
+
+from imdbcrawler.frontier import CLAIMED, PENDING, Frontier
+from imdbcrawler.supervisor import AIMDController, Supervisor
+
+
+class FakeProcess:
+    pids = iter(range(1000, 2000))
+
+    def __init__(self, command):
+        self.command = command
+        self.pid = next(self.pids)
+        self.returncode = None
+        self.signals = []
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.signals.append('TERM')
+
+    def kill(self):
+        self.signals.append('KILL')
+        self.returncode = -9
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+
+@pytest.fixture
+def supervisor(tmp_path):
+    supervisor = Supervisor(lambda worker_id: ['worker', str(worker_id)], AIMDController(), str(tmp_path / 'frontier.db'),
+                            str(tmp_path / 'metrics'), str(tmp_path / 'control.json'), launch=FakeProcess, lease_timeout=300)
+    supervisor.start_worker()
+    supervisor.start_worker()
+    return supervisor
+
+
+def owners(frontier):
+    return dict(frontier.conn.execute('SELECT partition, worker FROM frontier_partitions').fetchall())
+
+
+def test_partitions_only_move_when_the_workers_change(supervisor):
+    supervisor.rebalance()
+    with Frontier(supervisor.frontier_db) as frontier:
+        assigned = owners(frontier)
+        assert set(assigned.values()) == {0, 1}
+        frontier.conn.execute('UPDATE frontier_workers SET heartbeat = ?', (time.time() - 100,))
+        beats = frontier.heartbeats()
+    supervisor.rebalance()
+    with Frontier(supervisor.frontier_db) as frontier:
+        # A tick neither reshuffles the partitions nor heartbeats for the workers
+        assert owners(frontier) == assigned and frontier.heartbeats() == beats
+    supervisor.start_worker()
+    supervisor.rebalance()
+    with Frontier(supervisor.frontier_db) as frontier:
+        assert set(owners(frontier).values()) == {0, 1, 2}
+        # Only the new worker was given a starting heartbeat
+        assert {worker: beat for worker, beat in frontier.heartbeats().items() if worker != 2} == beats
+
+
+def test_a_stalled_worker_is_killed_and_its_partitions_reassigned(supervisor):
+    supervisor.rebalance()
+    with Frontier(supervisor.frontier_db) as frontier:
+        frontier.push_urls([f'https://example.com/{n}' for n in range(40)])
+        claimed = frontier.claim(1, 100)
+        assert claimed
+        # Worker 0 keeps renewing its lease; worker 1 hangs
+        frontier.conn.execute('UPDATE frontier_workers SET heartbeat = ? WHERE worker = 1', (time.time() - 1000,))
+        frontier.heartbeat(0)
+    stalled = supervisor.workers[1].process
+    supervisor.rebalance()
+    assert stalled.signals == ['KILL'] and supervisor.live_ids() == [0] and supervisor.crashes == 1
+    with Frontier(supervisor.frontier_db) as frontier:
+        assert set(owners(frontier).values()) == {0}
+        states = dict(frontier.conn.execute('SELECT url_hash, state FROM frontier').fetchall())
+        assert all(states[row[0]] == PENDING for row in claimed)
+        assert CLAIMED not in states.values() and frontier.pending_count(0) == 40
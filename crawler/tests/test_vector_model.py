@@ -0,0 +1,122 @@
+import multiprocessing
+import threading
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from imdbcrawler.spiders.imdb_database import IMDBDatabase
+from imdbcrawler.spiders.similarity import SimilarityIndex
+from imdbcrawler.spiders.vector_model import TfidfModel
+
+ROWS = [(f'hash-{n}', f'title {n} drama comedy word{n}') for n in range(50)]
+
+
+def stored(url_hash, text):
+    return (url_hash, f'http://example.com/{url_hash}', '2024-01-01 00:00:00', 'text/html', len(text), url_hash, text,
+            f'html-{url_hash}', '{}', None, None, None)
+
+
+def build(directory, barrier, results):
+    model = TfidfModel(directory).open()
+    barrier.wait()
+    results.put(model.build([ROWS[:25], ROWS[25:]]))
+    model.close()
+
+
+def test_build_only_fills_an_empty_model(tmp_path):
+    model = TfidfModel(str(tmp_path)).open()
+    assert model.build([ROWS])
+    assert len(model) == len(ROWS) and model.num_delta_rows == 0
+    assert not model.build([ROWS])
+    assert len(model) == len(ROWS)
+    model.close()
+
+
+def test_concurrent_builds_run_once(tmp_path):
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(3)
+    results = context.Queue()
+    processes = [context.Process(target=build, args=(str(tmp_path), barrier, results)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    built = sorted(results.get(timeout=30) for _ in processes)
+    for process in processes:
+        process.join()
+    assert built == [False, False, True]
+    model = TfidfModel(str(tmp_path)).open()
+    assert len(model) == len(ROWS)
+    model.close()
+
+
+def test_database_builds_the_model_from_stored_pages(tmp_path):
+    with IMDBDatabase(str(tmp_path / 'pages.db')) as db:
+        db.save_pages([stored(*row) for row in ROWS[:5]])
+    with IMDBDatabase(str(tmp_path / 'pages.db'), vector_model_dir=str(tmp_path / 'vectors')) as db:
+        assert len(db.vectors) == 5
+
+
+@pytest.mark.parametrize('vector_dedup', [False, True])
+def test_cosine_dedup_is_opt_in(tmp_path, vector_dedup):
+    with IMDBDatabase(str(tmp_path / 'pages.db'), vector_model_dir=str(tmp_path / 'vectors'),
+                      vector_dedup=vector_dedup) as db:
+        calls = []
+        max_similarities = db.similarity.max_similarities
+        db.similarity.max_similarities = lambda texts: calls.append(texts) or max_similarities(texts)
+        db.save_pages([stored(*row) for row in ROWS[:3]])
+        assert bool(calls) == vector_dedup
+        assert len(db.vectors) == 3
+
+
+def test_queries_hold_the_model_lock(tmp_path):
+    model = TfidfModel(str(tmp_path)).open()
+    model.append(ROWS[:10])
+    index = SimilarityIndex(model)
+    appended = threading.Event()
+    with model.reading():
+        writer = threading.Thread(target=lambda: (model.append(ROWS[10:]), appended.set()))
+        writer.start()
+        assert not appended.wait(0.2)
+        assert [key for key, _ in index._query_vector(*model.transform(ROWS[3][1]), k=1)] == ['hash-3']
+    writer.join()
+    assert len(model) == len(ROWS)
+    assert index.query(ROWS[30][1], k=1)[0][0] == 'hash-30'
+    model.close()
+
+
+def test_a_page_appended_again_only_matches_with_its_latest_text(tmp_path):
+    model = TfidfModel(str(tmp_path)).open()
+    model.build([ROWS])
+    index = SimilarityIndex(model)
+    old_text = ROWS[7][1]
+    assert index.query(old_text, k=1)[0] == ('hash-7', pytest.approx(1.0))
+    model.append([('hash-7', 'thriller heist caper'), ('hash-8', 'thriller heist caper sequel')])
+    model.append([('hash-8', 'western frontier sheriff')])
+    for results in (index.query(old_text, k=3), index.query_batch([old_text], k=3)[0]):
+        # The stale base row of hash-7 is masked even though it would score 1.0
+        assert 'hash-7' not in dict(results)
+        assert all(score < 0.99 for _, score in results)
+    assert [key for key, _ in index.query('thriller heist caper', k=1)] == ['hash-7']
+    assert 'hash-8' not in dict(index.query('thriller heist caper sequel', k=5))
+    assert model.row(model.row_for_key('hash-8'))[0] == 'hash-8'
+    assert model.row_for_key('hash-8') == len(model) - 1
+    assert model.row_for_key('hash-3') == 3 and model.row_for_key('missing') is None
+    # The latest text of hash-7 shares no term with any other live row
+    assert index.related('hash-7') == []
+    model.close()
+
+
+def test_batched_queries_match_single_queries(tmp_path):
+    model = TfidfModel(str(tmp_path)).open()
+    model.build([ROWS[:40]])
+    model.append(ROWS[40:] + [('hash-3', 'title 3 drama remastered')])
+    index = SimilarityIndex(model)
+    texts = [ROWS[n][1] for n in (0, 3, 12, 45)] + ['word3 word45 remastered', 'nothing matches', '']
+    batch = index.query_batch(texts, k=5)
+    assert len(batch) == len(texts)
+    for text, results in zip(texts, batch):
+        single = index.query(text, k=5)
+        assert [key for key, _ in results] == [key for key, _ in single]
+        assert [score for _, score in results] == pytest.approx([score for _, score in single])
+    assert batch[-1] == [] and batch[-2] == []
+    model.close()
@@ -38,6 +38,19 @@ public class Controller {
         return "DB has been successfully indexed.";
     }
 
+    // Incrementally indexes the feeds exported since the last run
+    // (python -m imdbcrawler.export in the crawler directory) and acknowledges them
+    @RequestMapping("/index_feed")
+    public String index_feed(@RequestParam(value = "path", defaultValue = "pages.jsonl") String feedPath) {
+        try {
+            int count = Indexer.index_feed(writer, feedPath);
+            return count + " pages have been indexed from the feed.";
+        } catch (IOException e) {
+            System.out.println("[Controller] [index_feed] EXCEPTION OCCURRED: " + e.getMessage());
+            return "Error occurred when indexing the feed.";
+        }
+    }
+
     // Queries the index with a user query string
     @RequestMapping("/query")
     public String search_for_results(@RequestParam("q") String userQuery) throws IOException, ParseException {
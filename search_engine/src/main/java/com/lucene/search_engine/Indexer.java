@@ -16,10 +16,21 @@ import org.apache.lucene.search.Query;
 import org.apache.lucene.search.ScoreDoc;
 import org.apache.lucene.store.NIOFSDirectory;
 
+import com.fasterxml.jackson.databind.JsonNode;
+import com.fasterxml.jackson.databind.ObjectMapper;
+import org.apache.lucene.index.Term;
+
+import java.io.BufferedReader;
 import java.io.IOException;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.DirectoryStream;
+import java.nio.file.Files;
+import java.nio.file.Path;
 import java.nio.file.Paths;
 import java.util.ArrayList;
+import java.util.Collections;
 import java.util.List;
+import java.util.regex.Pattern;
 
 import java.sql.Connection;
 import java.sql.DriverManager;
@@ -61,11 +72,70 @@ public class Indexer {
         }
     }
 
+    // Applies the JSONL feeds written by the crawler's imdbcrawler.export module next to
+    // feedFile, one per exported sequence range (pages.<first>-<last>.jsonl), oldest first.
+    // A feed is deleted once its pages are committed, which acknowledges it to the
+    // exporter; one that fails stays for the next call. Pages are upserted by URL, so
+    // only the exported delta is reindexed.
+    public static int index_feed(IndexWriter writer, String feedFile) throws IOException {
+        int count = 0;
+        for (Path feed : pending_feeds(Paths.get(feedFile))) {
+            count += index_feed_file(writer, feed);
+            Files.delete(feed);
+        }
+        return count;
+    }
+
+    public static List<Path> pending_feeds(Path feedFile) throws IOException {
+        Path dir = feedFile.toAbsolutePath().getParent();
+        String name = feedFile.getFileName().toString();
+        int dot = name.lastIndexOf('.');
+        String stem = dot > 0 ? name.substring(0, dot) : name;
+        String extension = dot > 0 ? name.substring(dot) : "";
+        Pattern range = Pattern.compile(Pattern.quote(stem) + "\\.\\d+-\\d+" + Pattern.quote(extension));
+        List<Path> feeds = new ArrayList<Path>();
+        try (DirectoryStream<Path> entries = Files.newDirectoryStream(dir)) {
+            for (Path entry : entries)
+                if (range.matcher(entry.getFileName().toString()).matches())
+                    feeds.add(entry);
+        }
+        // The sequence numbers are zero-padded, so name order is export order
+        Collections.sort(feeds);
+        return feeds;
+    }
+
+    public static int index_feed_file(IndexWriter writer, Path feed) throws IOException {
+        ObjectMapper mapper = new ObjectMapper();
+        int count = 0;
+        try (BufferedReader reader = Files.newBufferedReader(feed, StandardCharsets.UTF_8)) {
+            String line;
+            while ((line = reader.readLine()) != null) {
+                if (line.isBlank())
+                    continue;
+                JsonNode page = mapper.readTree(line);
+                update_document(writer, page.path("url").asText(), page.path("title").asText(""), page.path("html").asText(""));
+                count++;
+                if (count % 1000 == 0)
+                    writer.commit();
+            }
+        }
+        writer.commit();
+        return count;
+    }
+
+    public static void update_document(IndexWriter writer, String url, String title, String html) throws IOException {
+        writer.updateDocument(new Term("url", url), build_document(url, title, html));
+    }
+
     public static void index_document(IndexWriter writer, String url, String title, String html) throws IOException {
+        writer.addDocument(build_document(url, title, html));
+    }
+
+    public static Document build_document(String url, String title, String html) {
         Document doc = new Document();
         doc.add(new StringField("url", url, Field.Store.YES));
         doc.add(new TextField("title", title, Field.Store.YES));
         doc.add(new TextField("html", html, Field.Store.YES));
-        writer.addDocument(doc);
+        return doc;
     }
 }